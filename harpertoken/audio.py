@@ -0,0 +1,87 @@
+import csv
+import json
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchaudio
+
+from harpertoken.preprocessing import resample
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+
+def load_audio(audio_path, sample_rate=16000):
+    """Load an audio file as a mono float32 array resampled to ``sample_rate``
+
+    ``audio_path`` may also be a binary file-like object, e.g. a member read
+    out of a tar shard.
+    """
+    waveform, file_rate = _decode(audio_path)
+    # Convert to mono 1D float32 array for the processor
+    if waveform.dim() == 2:
+        waveform = waveform.mean(dim=0)
+    if file_rate != sample_rate:
+        waveform = resample(waveform, file_rate, sample_rate)
+    return waveform.numpy().astype(np.float32, copy=False)
+
+
+def load_audio_segment(audio_path, frame_offset, num_frames):
+    """Decode ``num_frames`` frames starting at ``frame_offset``.
+
+    Returns the segment at the file's native rate together with that rate, so
+    long recordings can be read window by window without decoding the whole
+    file.
+    """
+    return _decode(audio_path, frame_offset, num_frames)
+
+
+def _decode(audio_path, frame_offset=0, num_frames=-1):
+    source = audio_path if hasattr(audio_path, "read") else str(audio_path)
+    try:
+        return torchaudio.load(source, frame_offset=frame_offset, num_frames=num_frames)
+    except (ImportError, RuntimeError, OSError):
+        # Newer torchaudio releases need torchcodec/FFmpeg to decode; fall back
+        # to libsndfile, which librosa already pulls in.
+        import soundfile as sf
+
+        if hasattr(source, "seek"):
+            source.seek(0)
+        data, file_rate = sf.read(
+            source,
+            start=frame_offset,
+            frames=num_frames,
+            dtype="float32",
+            always_2d=True,
+        )
+        return torch.from_numpy(data.T.copy()), file_rate
+
+
+def list_audio_files(audio_dir):
+    """Return every audio file below ``audio_dir`` in a stable order"""
+    return sorted(
+        str(path)
+        for path in Path(audio_dir).rglob("*")
+        if path.suffix.lower() in AUDIO_EXTENSIONS
+    )
+
+
+def read_manifest(manifest_path):
+    """Yield manifest entries from a JSONL or CSV file.
+
+    Every entry is a dict with at least an ``audio_path`` key. Relative paths
+    are resolved against the manifest's directory.
+    """
+    manifest_path = Path(manifest_path)
+    with manifest_path.open(newline="") as f:
+        if manifest_path.suffix.lower() == ".csv":
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            entry = dict(row)
+            audio_path = Path(entry.get("audio_path") or entry["audio_filepath"])
+            if not audio_path.is_absolute():
+                audio_path = manifest_path.parent / audio_path
+            entry["audio_path"] = str(audio_path)
+            yield entry
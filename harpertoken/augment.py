@@ -0,0 +1,231 @@
+import torch
+from torch.utils.data import get_worker_info
+
+from harpertoken.batching import pad_time
+from harpertoken.distributed import get_rank
+from harpertoken.preprocessing import resample
+
+# Kaldi-style speed perturbation factors (Ko et al., 2015)
+SPEED_FACTORS = (0.9, 1.0, 1.1)
+
+
+class SpecAugment:
+    """Frequency and time masking of a padded feature batch (Park et al., 2019).
+
+    Every row gets its own random masks, drawn for the whole batch at once
+    and applied with one broadcast comparison per axis, so the cost does not
+    grow with a Python loop over clips. Masked cells are set to the mean of
+    the row's valid frames.
+    """
+
+    def __init__(
+        self,
+        freq_masks=2,
+        freq_width=27,
+        time_masks=2,
+        time_width=100,
+        max_time_ratio=0.2,
+    ):
+        """
+        Args:
+            freq_masks (int): Frequency masks per clip
+            freq_width (int): Widest frequency mask, in mel bins
+            time_masks (int): Time masks per clip
+            time_width (int): Widest time mask, in frames
+            max_time_ratio (float): Time masks also cover at most this share
+                of the clip's valid frames
+        """
+        self.freq_masks = freq_masks
+        self.freq_width = freq_width
+        self.time_masks = time_masks
+        self.time_width = time_width
+        self.max_time_ratio = max_time_ratio
+
+    def __call__(self, features, frames=None, generator=None):
+        """Mask ``[batch, bins, frames]`` features, of which ``frames`` are valid"""
+        batch, bins, length = features.shape
+        frames = (
+            torch.full((batch,), length)
+            if frames is None
+            else torch.as_tensor(frames).reshape(-1)
+        )
+        valid = torch.arange(length) < frames[:, None]
+        count = frames.clamp(min=1).to(features.dtype)
+        fill = (features * valid[:, None]).sum((1, 2)) / (count * bins)
+
+        freq = _masks(
+            torch.full((batch,), float(bins)),
+            self.freq_width,
+            self.freq_masks,
+            bins,
+            generator,
+        )
+        widths = (frames * self.max_time_ratio).floor().clamp(max=self.time_width)
+        time = _masks(frames.float(), widths, self.time_masks, length, generator)
+        masked = freq[:, :, None] | (time & valid)[:, None, :]
+        return torch.where(masked, fill[:, None, None].to(features.dtype), features)
+
+
+def _masks(limits, max_widths, count, size, generator):
+    """``[batch, size]`` bool masks of ``count`` random spans per row.
+
+    Span widths are uniform in ``[0, max_widths]`` and spans lie inside the
+    first ``limits`` positions of their row.
+    """
+    batch = len(limits)
+    positions = torch.arange(size)
+    mask = torch.zeros(batch, size, dtype=torch.bool)
+    max_widths = torch.as_tensor(max_widths, dtype=torch.float32).expand(batch)
+    for _ in range(count):
+        widths = (torch.rand(batch, generator=generator) * (max_widths + 1)).floor()
+        widths = torch.minimum(widths, limits)
+        starts = (torch.rand(batch, generator=generator) * (limits - widths)).floor()
+        mask |= (positions >= starts[:, None]) & (
+            positions < (starts + widths)[:, None]
+        )
+    return mask
+
+
+class NoiseBank:
+    """Background noise from a local directory, mixed in at random SNRs.
+
+    Every file is loaded once and concatenated; each clip mixes in a random
+    span of it, wrapping around at the end, at an SNR drawn per clip.
+    """
+
+    def __init__(self, noise_dir, sample_rate=16000, snr_db=(5.0, 20.0), prob=0.5):
+        """
+        Args:
+            noise_dir (str): Directory of noise recordings
+            sample_rate (int): Rate the noise is resampled to
+            snr_db (tuple): Range of signal-to-noise ratios, in dB
+            prob (float): Share of clips that get noise
+        """
+        from harpertoken.audio import list_audio_files, load_audio
+
+        paths = list_audio_files(noise_dir)
+        if not paths:
+            msg = f"No audio files in {noise_dir}"
+            raise ValueError(msg)
+        self.noise = torch.cat(
+            [torch.from_numpy(load_audio(path, sample_rate)) for path in paths]
+        )
+        self.snr_db = snr_db
+        self.prob = prob
+
+    def __call__(self, waveforms, lengths, generator=None):
+        """Mix noise into the valid samples of a ``[batch, time]`` batch"""
+        batch, length = waveforms.shape
+        valid = torch.arange(length) < torch.as_tensor(lengths)[:, None]
+        offsets = torch.randint(len(self.noise), (batch,), generator=generator)
+        # Wrap around by slicing a tiled copy, cheaper than a gather index
+        tiled = self.noise.repeat(-(-length // len(self.noise)) + 1)
+        noise = torch.stack([tiled[offset : offset + length] for offset in offsets])
+        low, high = self.snr_db
+        snr = low + (high - low) * torch.rand(batch, generator=generator)
+        signal_power = (waveforms**2 * valid).sum(-1) / valid.sum(-1).clamp(min=1)
+        noise_power = (noise**2 * valid).sum(-1) / valid.sum(-1).clamp(min=1)
+        gain = torch.sqrt(signal_power / (noise_power * 10 ** (snr / 10) + 1e-10))
+        gain *= torch.rand(batch, generator=generator) < self.prob
+        return waveforms + gain[:, None] * noise * valid
+
+
+class BatchAugment:
+    """Seeded, batched augmentation of training inputs.
+
+    Waveform batches are speed perturbed (one resampling call per factor in
+    the batch) and mixed with noise; feature batches get SpecAugment. Use it
+    as ``SpeechCollator(augment=...)``, where it runs on the padded batch
+    inside the DataLoader workers, or call ``waveforms``/``features``
+    directly, e.g. from AudioPreprocessor.process_batch.
+
+    Random draws come from a generator seeded with ``seed`` plus the global
+    index of the DataLoader worker across torch.distributed ranks, so runs
+    with the same seed, world size, worker count and batch order see the
+    same augmentations, while ranks, workers and epochs (with persistent
+    workers) differ from each other.
+    """
+
+    def __init__(
+        self,
+        spec_augment=None,
+        speed_factors=None,
+        noise=None,
+        sample_rate=16000,
+        seed=0,
+    ):
+        """
+        Args:
+            spec_augment (SpecAugment): Feature masking; None disables it
+            speed_factors (tuple): Speed factors drawn uniformly per clip,
+                e.g. SPEED_FACTORS; None disables speed perturbation
+            noise (NoiseBank): Noise to mix in; None disables it
+            sample_rate (int): Rate of the waveforms
+            seed (int): Seed of the random draws
+        """
+        self.spec_augment = spec_augment
+        self.speed_factors = speed_factors
+        self.noise = noise
+        self.sample_rate = sample_rate
+        self.seed = seed
+        self._generator = None
+
+    @property
+    def generator(self):
+        if self._generator is None:
+            info = get_worker_info()
+            worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+            stream = get_rank() * num_workers + worker_id
+            self._generator = torch.Generator().manual_seed(self.seed + stream)
+        return self._generator
+
+    def __call__(self, batch):
+        """Augment a SpeechCollator batch dict in place and return it"""
+        if "input_values" in batch:
+            values, lengths = self.waveforms(
+                batch["input_values"], batch["attention_mask"].sum(-1)
+            )
+            batch["input_values"] = values
+            batch["attention_mask"] = (
+                torch.arange(values.shape[-1]) < lengths[:, None]
+            ).long()
+        if "input_features" in batch:
+            frames = (
+                batch["attention_mask"].sum(-1) if "attention_mask" in batch else None
+            )
+            batch["input_features"] = self.features(batch["input_features"], frames)
+        return batch
+
+    def waveforms(self, waveforms, lengths):
+        """Speed perturb and add noise to a padded ``[batch, time]`` batch.
+
+        Returns the augmented batch and the new valid length of every row.
+        """
+        lengths = torch.as_tensor(lengths).reshape(-1)
+        if self.speed_factors:
+            waveforms, lengths = self._perturb_speed(waveforms, lengths)
+        if self.noise is not None:
+            waveforms = self.noise(waveforms, lengths, self.generator)
+        return waveforms, lengths
+
+    def features(self, features, frames=None):
+        """SpecAugment a padded ``[batch, bins, frames]`` batch"""
+        if self.spec_augment is None:
+            return features
+        return self.spec_augment(features, frames, self.generator)
+
+    def _perturb_speed(self, waveforms, lengths):
+        choices = torch.randint(
+            len(self.speed_factors), (len(waveforms),), generator=self.generator
+        ).tolist()
+        clips = [None] * len(waveforms)
+        new_lengths = lengths.clone()
+        for choice in set(choices):
+            rows = [i for i, c in enumerate(choices) if c == choice]
+            # Playing the clip at factor x its rate shortens it by 1 / x
+            rate = round(self.sample_rate * self.speed_factors[choice])
+            resampled = resample(waveforms[rows], rate, self.sample_rate)
+            for row, i in enumerate(rows):
+                new_lengths[i] = -(-int(lengths[i]) * self.sample_rate // rate)
+                clips[i] = resampled[row, : new_lengths[i]]
+        return pad_time(clips)[0], new_lengths
@@ -0,0 +1,175 @@
+import math
+from itertools import islice
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+LABEL_PAD_ID = -100  # ignored by the cross-entropy loss in transformers models
+
+
+class DurationBatchSampler(Sampler):
+    """Batch samples of similar duration up to a total padded duration.
+
+    A batch costs ``len(batch) * longest`` since every sample is padded to the
+    longest one, so sorting by duration first packs many short clips or a few
+    long ones into each batch. Batch order is shuffled per epoch with a seeded
+    generator, which keeps runs reproducible.
+    """
+
+    def __init__(self, durations, max_batch_duration, shuffle=True, seed=0):
+        """
+        Args:
+            durations (list): Length of every sample, in seconds or frames
+            max_batch_duration (float): Padded length budget per batch, same unit
+            shuffle (bool): Shuffle batch order every epoch
+            seed (int): Seed for the shuffle
+        """
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.max_batch_duration = max_batch_duration
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.batches = self._make_batches()
+
+    def _make_batches(self):
+        batches, batch, longest = [], [], 0.0
+        for idx in np.argsort(self.durations, kind="stable").tolist():
+            duration = self.durations[idx]
+            if batch and max(longest, duration) * (len(batch) + 1) > (
+                self.max_batch_duration
+            ):
+                batches.append(batch)
+                batch, longest = [], 0.0
+            batch.append(idx)
+            longest = max(longest, duration)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        order = np.arange(len(self.batches))
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(order)
+        for i in order.tolist():
+            yield self.batches[i]
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class DistributedBatchSampler(Sampler):
+    """Give each rank an equal, disjoint share of another batch sampler's batches.
+
+    Batches are dealt round-robin. The list is wrapped around to a multiple
+    of ``num_replicas`` first, because every rank has to run the same number
+    of steps or the gradient all-reduce would hang.
+    """
+
+    def __init__(self, batch_sampler, num_replicas, rank):
+        self.batch_sampler = batch_sampler
+        self.num_replicas = num_replicas
+        self.rank = rank
+
+    def set_epoch(self, epoch):
+        if hasattr(self.batch_sampler, "set_epoch"):
+            self.batch_sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        batches = list(self.batch_sampler)
+        if not batches:
+            return
+        total = len(self) * self.num_replicas
+        batches = [batches[i % len(batches)] for i in range(total)]
+        yield from batches[self.rank :: self.num_replicas]
+
+    def __len__(self):
+        return math.ceil(len(self.batch_sampler) / self.num_replicas)
+
+
+class ResumableBatchSampler(Sampler):
+    """Batch sampler wrapper that can start an epoch part-way through.
+
+    Setting ``skip`` drops that many batches from the start of the next
+    epoch without loading them, which is how training resumes mid-epoch.
+    """
+
+    def __init__(self, batch_sampler):
+        self.batch_sampler = batch_sampler
+        self.skip = 0
+
+    def set_epoch(self, epoch):
+        # A plain BatchSampler wraps the sampler that actually shuffles
+        target = getattr(self.batch_sampler, "sampler", self.batch_sampler)
+        if hasattr(target, "set_epoch"):
+            target.set_epoch(epoch)
+        elif hasattr(self.batch_sampler, "set_epoch"):
+            self.batch_sampler.set_epoch(epoch)
+
+    def __iter__(self):
+        skip, self.skip = self.skip, 0
+        yield from islice(self.batch_sampler, skip, None)
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+
+class SpeechCollator:
+    """Pad a list of dataset samples into one batch.
+
+    ``input_features`` (``[n_mels, frames]``) and ``input_values``
+    (``[1, samples]``) are right-padded with zeros along time and get an
+    ``attention_mask`` marking the real frames. ``labels`` are padded with
+    ``-100`` so padding is ignored by the loss; when samples carry ``text``
+    instead and a tokenizer is given, the text is tokenized here. An
+    ``augment`` callable (e.g. harpertoken.augment.BatchAugment) then
+    transforms the padded batch, in the DataLoader worker that built it.
+    """
+
+    def __init__(self, tokenizer=None, augment=None):
+        self.tokenizer = tokenizer
+        self.augment = augment
+
+    def __call__(self, samples):
+        batch = {}
+        if "input_features" in samples[0]:
+            features = [sample["input_features"] for sample in samples]
+            batch["input_features"], batch["attention_mask"] = pad_time(features)
+        if "input_values" in samples[0]:
+            values = [sample["input_values"].reshape(-1) for sample in samples]
+            batch["input_values"], batch["attention_mask"] = pad_time(values)
+
+        labels = None
+        if "labels" in samples[0]:
+            labels = [torch.as_tensor(sample["labels"]) for sample in samples]
+        elif "text" in samples[0] and self.tokenizer is not None:
+            labels = [
+                torch.tensor(self.tokenizer(sample["text"]).input_ids)
+                for sample in samples
+            ]
+        if labels is not None:
+            batch["labels"], _ = pad_time(labels, LABEL_PAD_ID)
+        if "text" in samples[0]:
+            batch["text"] = [sample["text"] for sample in samples]
+        if self.augment is not None:
+            batch = self.augment(batch)
+        return batch
+
+
+def pad_time(tensors, value=0):
+    """Right-pad tensors along their last dimension and stack them.
+
+    Returns the padded batch and a ``[batch, time]`` long mask of real steps.
+    """
+    lengths = [tensor.shape[-1] for tensor in tensors]
+    longest = max(lengths)
+    shape = (len(tensors), *tensors[0].shape[:-1], longest)
+    padded = torch.full(shape, value, dtype=tensors[0].dtype)
+    mask = torch.zeros(len(tensors), longest, dtype=torch.long)
+    for i, (tensor, length) in enumerate(zip(tensors, lengths)):
+        padded[i, ..., :length] = tensor
+        mask[i, :length] = 1
+    return padded, mask
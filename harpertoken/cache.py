@@ -0,0 +1,262 @@
+import hashlib
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+class FeatureCache:
+    """On-disk cache of processed model inputs, read back as memory maps.
+
+    Entries are keyed by a hash of the raw audio and live in a directory
+    named after a hash of the processor configuration, so changing either
+    the recording or any preprocessing setting misses the cache instead of
+    returning stale features.
+    """
+
+    def __init__(self, cache_dir, processor, extra=None):
+        """
+        Args:
+            cache_dir (str): Root directory for cached features
+            processor: Feature extractor or processor whose config keys the cache
+            extra (str): Anything else that changes the output, e.g. call kwargs
+        """
+        feature_extractor = getattr(processor, "feature_extractor", processor)
+        config = feature_extractor.to_json_string() + (extra or "")
+        config_hash = hashlib.sha256(config.encode()).hexdigest()[:16]
+        self.cache_dir = Path(cache_dir) / config_hash
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, audio, sample_rate):
+        audio = np.ascontiguousarray(audio)
+        digest = hashlib.sha256(f"{audio.dtype}{audio.shape}{sample_rate}".encode())
+        digest.update(audio.view(np.uint8))
+        return digest.hexdigest()
+
+    def load(self, key):
+        """Return the cached array for ``key`` as a copy-on-write memmap, or None"""
+        path = self.cache_dir / f"{key}.npy"
+        try:
+            return np.load(path, mmap_mode="c")
+        except (FileNotFoundError, ValueError):
+            # Missing, or left truncated by a crash mid-write
+            return None
+
+    def store(self, key, features):
+        path = self.cache_dir / f"{key}.npy"
+        # Write to a temporary file and rename so readers never see a
+        # partially written entry, even with several DataLoader workers
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, features)
+            Path(tmp_path).replace(path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        return np.load(path, mmap_mode="c")
+
+    def get_or_compute(self, audio, sample_rate, compute):
+        """Return cached features for ``audio``, computing them on a miss"""
+        key = self.key(audio, sample_rate)
+        features = self.load(key)
+        if features is not None:
+            self.hits += 1
+            return features
+        self.misses += 1
+        return self.store(key, np.asarray(compute(audio)))
+
+
+class EncoderCache:
+    """Cache of Whisper encoder outputs for decoding the same audio again.
+
+    Sweeps over languages, tasks, beam widths or prompts decode identical
+    ``input_features`` many times, and each ``generate`` call would rerun
+    the encoder. Outputs are cached per clip, keyed by a hash of its
+    features and a fingerprint of the model (name or path, Hub revision,
+    dtype, quantization and a sampled digest of the encoder weights), so a
+    changed checkpoint, or weights updated in place, miss the cache.
+
+    Entries are kept in memory up to ``max_bytes`` and the least recently
+    used are evicted beyond that. With ``spill_dir``, evicted entries are
+    written there and read back as memory maps on a later miss, which also
+    lets later processes reuse them.
+    """
+
+    def __init__(self, max_bytes=512 * 2**20, spill_dir=None):
+        """
+        Args:
+            max_bytes (int): Memory budget for cached encoder outputs
+            spill_dir (str): Keep evicted entries on disk in this directory
+        """
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.nbytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def encode(self, model, input_features):
+        """Return ``model``'s encoder output for a batch of features.
+
+        Only the clips missing from the cache go through the encoder, in one
+        batched call.
+
+        Args:
+            model: WhisperForConditionalGeneration
+            input_features: ``[batch, n_mels, frames]`` features
+        Returns:
+            ``[batch, positions, d_model]`` encoder hidden states
+        """
+        fingerprint = self._fingerprint(model)
+        keys = [self.key(fingerprint, row) for row in input_features]
+        outputs = [self._lookup(key) for key in keys]
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        if missing:
+            with torch.no_grad():
+                encoded = model.get_encoder()(input_features[missing]).last_hidden_state
+            for i, output in zip(missing, encoded):
+                outputs[i] = output
+                self._insert(keys[i], output)
+        return torch.stack(outputs).to(input_features.device)
+
+    def key(self, fingerprint, features):
+        features = features.detach().cpu().contiguous()
+        digest = hashlib.sha256(
+            f"{fingerprint}{features.dtype}{tuple(features.shape)}".encode()
+        )
+        digest.update(features.view(torch.uint8).numpy())
+        return digest.hexdigest()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _fingerprint(self, model):
+        encoder = model.get_encoder()
+        state = _parameter_state(encoder)
+        memo = self._fingerprints.get(model)
+        # Recomputed once a parameter was replaced or updated in place, e.g.
+        # by an optimizer step or load_state_dict, so stale entries miss
+        if memo is None or memo[0] != state:
+            fingerprint = f"{_model_fingerprint(model)}:{_parameter_digest(encoder)}"
+            memo = (state, fingerprint)
+            self._fingerprints[model] = memo
+        return memo[1]
+
+    def _lookup(self, key):
+        with self._lock:
+            output = self._entries.get(key)
+            if output is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return output
+        output = self._load_spilled(key)
+        if output is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        return output
+
+    def _insert(self, key, output):
+        # A row of the batch output would keep the whole batch alive
+        output = output.detach().clone()
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = output
+            self.nbytes += output.nbytes
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old = self._entries.popitem(last=False)
+                self.nbytes -= old.nbytes
+                evicted.append((old_key, old))
+        for old_key, old in evicted:
+            self._spill(old_key, old)
+
+    def _spill(self, key, output):
+        if self.spill_dir is None:
+            return
+        path = self.spill_dir / f"{key}.npy"
+        if path.exists():
+            return
+        # numpy has no bfloat16; fp32 holds it exactly and is cast back on load
+        array = output.cpu().float().numpy()
+        fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, array)
+            Path(tmp_path).replace(path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        (self.spill_dir / f"{key}.dtype").write_text(str(output.dtype))
+
+    def _load_spilled(self, key):
+        if self.spill_dir is None:
+            return None
+        try:
+            array = np.load(self.spill_dir / f"{key}.npy", mmap_mode="c")
+            dtype = (self.spill_dir / f"{key}.dtype").read_text()
+        except (FileNotFoundError, ValueError):
+            return None
+        return torch.from_numpy(array).to(getattr(torch, dtype.split(".")[-1]))
+
+
+def _model_fingerprint(model):
+    """Identify the weights of a transformers model without hashing them"""
+    config = model.config
+    quantized = any(
+        "quantized" in type(module).__module__ for module in model.modules()
+    )
+    parts = [
+        type(model).__name__,
+        str(config._name_or_path),  # noqa: SLF001
+        str(getattr(config, "_commit_hash", None)),
+        str(model.dtype),
+        f"quantized={quantized}",
+    ]
+    model_dir = Path(str(config._name_or_path))  # noqa: SLF001
+    if not config._name_or_path:  # noqa: SLF001
+        # Built from a config, so only this instance has these weights
+        parts.append(f"id={id(model)}")
+    elif model_dir.is_dir():
+        for path in sorted(model_dir.iterdir()):
+            stat = path.stat()
+            parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()[:16]
+
+
+def _parameter_state(module):
+    """Storage and version counter of every parameter; cheap to read"""
+    return tuple(
+        (param.data_ptr(), param._version)  # noqa: SLF001
+        for param in module.parameters()
+    )
+
+
+def _parameter_digest(module, samples=1024):
+    """Hash up to ``samples`` evenly spaced values of every parameter.
+
+    Enough to tell fine-tuned or reloaded weights apart, at a small fraction
+    of the cost of hashing all of them.
+    """
+    digest = hashlib.sha256()
+    for param in module.parameters():
+        flat = param.detach().reshape(-1)
+        values = flat[:: max(1, flat.numel() // samples)]
+        digest.update(values.float().cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
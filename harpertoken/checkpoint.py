@@ -0,0 +1,161 @@
+import json
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from safetensors import safe_open
+from safetensors.torch import load_file, save_file
+
+CHECKPOINT_PATTERN = re.compile(r"step-(\d+)\.safetensors$")
+
+
+class CheckpointManager:
+    """Periodic, resumable training checkpoints written in the background.
+
+    A checkpoint is a single safetensors file holding the state dicts of the
+    given objects (model, optimizer, scheduler, ...), the RNG states and a
+    JSON ``progress`` record such as the epoch and batch position. Tensors
+    are copied to CPU on the caller's thread, so training can carry on while
+    a worker thread serialises them. At most one save is in flight; the next
+    one waits for it, which bounds the extra memory to one snapshot.
+    """
+
+    def __init__(self, directory, keep=2):
+        """
+        Args:
+            directory (str): Where checkpoints are written
+            keep (int): Number of most recent checkpoints to keep on disk
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.keep = keep
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def save(self, step, stateful, progress):
+        """Snapshot ``stateful`` objects and write them asynchronously.
+
+        Args:
+            step (int): Global optimizer step, used to name the checkpoint
+            stateful (dict): Objects with ``state_dict``/``load_state_dict``
+            progress (dict): JSON-serialisable training position
+        """
+        self.wait()
+        state = {name: obj.state_dict() for name, obj in stateful.items()}
+        state["rng"] = _rng_state()
+        tensors = {}
+        structure = _flatten(state, "", tensors)
+        metadata = {"state": json.dumps(structure), "progress": json.dumps(progress)}
+        self._pending = self._executor.submit(self._write, step, tensors, metadata)
+
+    def _write(self, step, tensors, metadata):
+        path = self.directory / f"step-{step:08d}.safetensors"
+        tmp_path = path.with_suffix(".tmp")
+        save_file(tensors, str(tmp_path), metadata=metadata)
+        tmp_path.replace(path)
+        for old in self.checkpoints()[: -self.keep]:
+            old.unlink(missing_ok=True)
+        return path
+
+    def wait(self):
+        """Block until the in-flight save, if any, has been written"""
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+    def checkpoints(self):
+        """Checkpoint files on disk, oldest first"""
+        paths = [
+            p for p in self.directory.iterdir() if CHECKPOINT_PATTERN.search(p.name)
+        ]
+        return sorted(paths, key=lambda p: int(CHECKPOINT_PATTERN.search(p.name)[1]))
+
+    def restore(self, stateful, path=None):
+        """Load the latest (or given) checkpoint into ``stateful`` objects.
+
+        Restores the RNG states too and returns the saved progress record, or
+        None when there is no checkpoint to resume from.
+        """
+        self.wait()
+        if path is None:
+            checkpoints = self.checkpoints()
+            if not checkpoints:
+                return None
+            path = checkpoints[-1]
+        with safe_open(str(path), framework="pt") as f:
+            metadata = f.metadata()
+        state = _unflatten(json.loads(metadata["state"]), load_file(str(path)))
+        for name, obj in stateful.items():
+            obj.load_state_dict(state[name])
+        _set_rng_state(state["rng"])
+        return json.loads(metadata["progress"])
+
+
+def _rng_state():
+    state = {
+        "torch": torch.get_rng_state(),
+        "numpy": np.random.get_state(),  # noqa: NPY002
+        "python": random.getstate(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])  # noqa: NPY002
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _flatten(obj, prefix, tensors):
+    """Move tensors out of a nested state into ``tensors``; return the rest.
+
+    The returned structure is JSON-serialisable and records where every
+    tensor goes, along with container types JSON cannot express (tuples,
+    non-string dict keys).
+    """
+    if isinstance(obj, torch.Tensor):
+        tensors[prefix] = obj.detach().to("cpu", copy=True).contiguous()
+        return {"__tensor__": prefix}
+    if isinstance(obj, np.ndarray):
+        tensors[prefix] = torch.from_numpy(obj.copy())
+        return {"__ndarray__": prefix}
+    if isinstance(obj, dict):
+        return {
+            "__dict__": [
+                [key, _flatten(value, f"{prefix}/{key}", tensors)]
+                for key, value in obj.items()
+            ]
+        }
+    if isinstance(obj, (list, tuple)):
+        items = [
+            _flatten(value, f"{prefix}/{i}", tensors) for i, value in enumerate(obj)
+        ]
+        return {"__tuple__": items} if isinstance(obj, tuple) else items
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return obj
+
+
+def _unflatten(structure, tensors):
+    if isinstance(structure, list):
+        return [_unflatten(value, tensors) for value in structure]
+    if not isinstance(structure, dict):
+        return structure
+    if "__tensor__" in structure:
+        return tensors[structure["__tensor__"]]
+    if "__ndarray__" in structure:
+        return tensors[structure["__ndarray__"]].numpy()
+    if "__tuple__" in structure:
+        return tuple(_unflatten(value, tensors) for value in structure["__tuple__"])
+    return {key: _unflatten(value, tensors) for key, value in structure["__dict__"]}
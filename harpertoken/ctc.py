@@ -0,0 +1,291 @@
+import math
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+BLANK_ID = 0  # <pad> doubles as the CTC blank in wav2vec2 vocabularies
+WORD_DELIMITER = "|"
+# Backoff penalty of "stupid backoff" (Brants et al., 2007), as log10(0.4)
+STUPID_BACKOFF = math.log10(0.4)
+
+
+def output_lengths(config, input_lengths):
+    """Logit frames wav2vec2's convolutional feature encoder produces.
+
+    Args:
+        config: Wav2Vec2Config
+        input_lengths: Tensor of waveform lengths in samples
+    """
+    lengths = torch.as_tensor(input_lengths)
+    for kernel, stride in zip(config.conv_kernel, config.conv_stride):
+        lengths = torch.div(lengths - kernel, stride, rounding_mode="floor") + 1
+    return lengths.clamp(min=0)
+
+
+def greedy_decode(logits, lengths=None, blank_id=BLANK_ID):
+    """Best-path CTC decoding of a batch, without a Python loop over frames.
+
+    Takes the most likely token of every frame, then drops repeats of the
+    previous frame's token and blanks with one mask over the whole batch.
+
+    Args:
+        logits: ``[batch, frames, vocab]`` scores
+        lengths: Valid frames of every row; all frames if None
+        blank_id (int): Index of the CTC blank token
+    Returns:
+        A list of token id lists, one per row
+    """
+    ids = logits.argmax(-1)
+    keep = ids != blank_id
+    keep[:, 1:] &= ids[:, 1:] != ids[:, :-1]
+    if lengths is not None:
+        frames = torch.arange(ids.shape[1], device=ids.device)
+        keep &= frames < torch.as_tensor(lengths, device=ids.device)[:, None]
+    counts = keep.sum(1).tolist()
+    return [row.tolist() for row in torch.split(ids[keep], counts)]
+
+
+class NGramLM:
+    """Word n-gram language model in ARPA form, for CTC beam search.
+
+    Probabilities are looked up with standard ARPA backoff. Load a model
+    trained with e.g. KenLM via ``from_arpa``, or count one from in-domain
+    text with ``from_texts``. Words are matched case-insensitively.
+    """
+
+    def __init__(self, order, log_probs, backoffs=None):
+        """
+        Args:
+            order (int): Longest n-gram
+            log_probs (dict): log10 probability of every n-gram tuple
+            backoffs (dict): log10 backoff weight of n-gram contexts
+        """
+        self.order = order
+        self.log_probs = log_probs
+        self.backoffs = backoffs or {}
+        self.unk = log_probs.get(("<unk>",), -10.0)
+
+    @classmethod
+    def from_arpa(cls, path):
+        log_probs, backoffs = {}, {}
+        order = 0
+        with Path(path).open(encoding="utf-8") as f:
+            for raw_line in f:
+                line = raw_line.strip()
+                if not line or line.startswith(("\\data\\", "ngram ", "\\end\\")):
+                    continue
+                if line.endswith("-grams:"):
+                    order = int(line[1:].split("-")[0])
+                    continue
+                fields = line.split()
+                ngram = tuple(word.lower() for word in fields[1 : 1 + order])
+                log_probs[ngram] = float(fields[0])
+                if len(fields) > 1 + order:
+                    backoffs[ngram] = float(fields[1 + order])
+        return cls(order, log_probs, backoffs)
+
+    @classmethod
+    def from_texts(cls, texts, order=3):
+        """Count an n-gram model from sentences, with stupid backoff.
+
+        Unigrams are add-one smoothed so unseen words get a small probability
+        rather than none.
+        """
+        counts = Counter()
+        for text in texts:
+            words = ["<s>", *text.lower().split(), "</s>"]
+            for n in range(1, order + 1):
+                for i in range(len(words) - n + 1):
+                    counts[tuple(words[i : i + n])] += 1
+        unigrams = {ngram: c for ngram, c in counts.items() if len(ngram) == 1}
+        total = sum(unigrams.values()) + len(unigrams) + 1
+        log_probs = {("<unk>",): math.log10(1 / total)}
+        for ngram, count in counts.items():
+            if len(ngram) == 1:
+                log_probs[ngram] = math.log10((count + 1) / total)
+            else:
+                log_probs[ngram] = math.log10(count / counts[ngram[:-1]])
+        backoffs = {ngram: STUPID_BACKOFF for ngram in counts if len(ngram) < order}
+        return cls(order, log_probs, backoffs)
+
+    def score(self, context, word):
+        """Natural-log probability of ``word`` after the ``context`` words"""
+        context = tuple(context[len(context) - self.order + 1 :])
+        word = word.lower()
+        penalty = 0.0
+        while True:
+            log_prob = self.log_probs.get((*context, word))
+            if log_prob is not None:
+                break
+            if not context:
+                log_prob = self.unk
+                break
+            penalty += self.backoffs.get(context, 0.0)
+            context = context[1:]
+        return (penalty + log_prob) * math.log(10)
+
+
+class CTCDecoder:
+    """Turn CTC logits into text, greedily or with a prefix beam search.
+
+    The beam search keeps collapsed token prefixes with separate
+    probabilities of ending in a blank and in a non-blank, so alignments
+    that collapse to the same text share one beam entry. With an ``lm``,
+    prefixes are ranked by acoustic log-probability plus ``alpha`` times the
+    LM log-probability of their completed words and ``beta`` per word
+    (shallow fusion).
+    """
+
+    def __init__(self, vocab, beam_width=1, lm=None, alpha=0.5, beta=1.0):
+        """
+        Args:
+            vocab (list): Token string of every id, e.g. from
+                ``CTCDecoder.from_tokenizer``; ``"|"`` separates words
+            beam_width (int): 1 decodes greedily; larger runs a beam search
+                keeping this many prefixes after every frame
+            lm (NGramLM): Word language model for the beam search
+            alpha (float): LM weight
+            beta (float): Bonus per word, offsetting the LM's bias to short
+                output
+        """
+        self.vocab = list(vocab)
+        self.beam_width = beam_width
+        self.lm = lm
+        self.alpha = alpha
+        self.beta = beta
+        self.blank_id = BLANK_ID
+        self.delimiter = (
+            self.vocab.index(WORD_DELIMITER) if WORD_DELIMITER in self.vocab else None
+        )
+        # Only the most likely tokens of a frame extend prefixes
+        self.prune = min(16, len(self.vocab))
+        # Special tokens such as <s> and <unk> never make it into the text
+        self.skip = {i for i, token in enumerate(self.vocab) if token.startswith("<")}
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer, **kwargs):
+        vocab = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        return cls(vocab, **kwargs)
+
+    def decode(self, logits, lengths=None):
+        """Return the transcript of every row of ``[batch, frames, vocab]``"""
+        if self.beam_width == 1 and self.lm is None:
+            return [self.to_text(ids) for ids in greedy_decode(logits, lengths)]
+        log_probs = torch.log_softmax(logits.float(), dim=-1).cpu().numpy()
+        if lengths is None:
+            lengths = [log_probs.shape[1]] * len(log_probs)
+        return [
+            self.to_text(self.beam_search(rows[:length]))
+            for rows, length in zip(log_probs, torch.as_tensor(lengths).tolist())
+        ]
+
+    def to_text(self, ids):
+        text = "".join(self.vocab[i] for i in ids if i not in self.skip)
+        return " ".join(text.replace(WORD_DELIMITER, " ").split())
+
+    def beam_search(self, log_probs):
+        """Token ids of the best prefix for one ``[frames, vocab]`` utterance"""
+        # prefix -> [log P(ends in blank), log P(ends in non-blank)]
+        beams = {(): [0.0, -np.inf]}
+        # prefix -> (LM bonus of its completed words, those words)
+        lm_state = {(): (0.0, ())}
+        for frame in np.asarray(log_probs, dtype=np.float64):
+            next_beams = self._extend(beams, frame, lm_state)
+            ranked = sorted(
+                next_beams.items(),
+                key=lambda item: np.logaddexp(*item[1]) + lm_state[item[0]][0],
+                reverse=True,
+            )
+            beams = dict(ranked[: self.beam_width])
+
+        def final_score(prefix):
+            bonus, words = self._add_word(prefix, *lm_state[prefix])
+            if self.lm is not None:
+                bonus += self.alpha * self.lm.score(words, "</s>")
+            return np.logaddexp(*beams[prefix]) + bonus
+
+        return list(max(beams, key=final_score))
+
+    def _extend(self, beams, frame, lm_state):
+        """Advance every prefix by one frame"""
+        candidates = np.argpartition(frame, -self.prune)[-self.prune :].tolist()
+        if self.blank_id not in candidates:
+            candidates.append(self.blank_id)
+        next_beams = defaultdict(lambda: [-np.inf, -np.inf])
+        for prefix, (blank, non_blank) in beams.items():
+            total = np.logaddexp(blank, non_blank)
+            for token in candidates:
+                p = frame[token]
+                if token == self.blank_id:
+                    entry = next_beams[prefix]
+                    entry[0] = np.logaddexp(entry[0], total + p)
+                    continue
+                new = (*prefix, token)
+                if new not in lm_state:
+                    state = lm_state[prefix]
+                    if token == self.delimiter:
+                        state = self._add_word(prefix, *state)
+                    lm_state[new] = state
+                entry = next_beams[new]
+                if prefix and token == prefix[-1]:
+                    # A repeat only starts a new token after a blank ...
+                    entry[1] = np.logaddexp(entry[1], blank + p)
+                    # ... and otherwise collapses into the previous one
+                    same = next_beams[prefix]
+                    same[1] = np.logaddexp(same[1], non_blank + p)
+                else:
+                    entry[1] = np.logaddexp(entry[1], total + p)
+        return next_beams
+
+    def _add_word(self, prefix, bonus, words):
+        """Score the word a prefix ends with, once it is complete"""
+        if self.lm is None:
+            return bonus, words
+        chars = []
+        for token in reversed(prefix):
+            if token == self.delimiter:
+                break
+            chars.append(self.vocab[token])
+        word = "".join(reversed(chars))
+        if not word:
+            return bonus, words
+        bonus += self.alpha * self.lm.score(words, word) + self.beta
+        return bonus, (*words, word)
+
+
+def ctc_transcriber(model, processor, decoder=None):
+    """Return a ``transcribe_batch(waveforms) -> texts`` function for wav2vec2.
+
+    One batched forward pass produces the logits of every clip at once;
+    there is no autoregressive loop, so latency is a single encoder pass
+    plus decoding.
+
+    Args:
+        model: Wav2Vec2ForCTC
+        processor: Wav2Vec2Processor of the model
+        decoder (CTCDecoder): Greedy decoding with the processor's vocabulary
+            if None
+    """
+    decoder = decoder or CTCDecoder.from_tokenizer(processor.tokenizer)
+    feature_extractor = processor.feature_extractor
+
+    def transcribe_batch(waveforms):
+        inputs = feature_extractor(
+            waveforms,
+            sampling_rate=feature_extractor.sampling_rate,
+            padding=True,
+            return_attention_mask=True,
+            return_tensors="pt",
+        )
+        kwargs = {}
+        # Checkpoints trained without a mask expect zero padding and no mask
+        if feature_extractor.return_attention_mask:
+            kwargs["attention_mask"] = inputs.attention_mask
+        with torch.no_grad():
+            logits = model(inputs.input_values.to(model.dtype), **kwargs).logits
+        lengths = output_lengths(model.config, inputs.attention_mask.sum(-1))
+        return decoder.decode(logits, lengths)
+
+    return transcribe_batch
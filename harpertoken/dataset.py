@@ -1,31 +1,89 @@
+import io
+import json
 import os
+import tarfile
+from itertools import chain, count, islice
+from pathlib import Path
 
 import numpy as np
-from torch.utils.data import Dataset
-from transformers import Wav2Vec2FeatureExtractor, WhisperProcessor
+import torch
+import torch.distributed as dist
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
+
+from harpertoken.audio import AUDIO_EXTENSIONS, load_audio, read_manifest
+from harpertoken.cache import FeatureCache
+from harpertoken.registry import shared_processor
+from harpertoken.store import AudioStore
+
+
+def load_processor(model_type):
+    """Return the shared feature processor matching ``model_type``"""
+    from transformers import Wav2Vec2FeatureExtractor, WhisperProcessor
+
+    if model_type == "whisper":
+        return shared_processor(WhisperProcessor, "openai/whisper-small")
+    if model_type == "wav2vec2":
+        return shared_processor(
+            Wav2Vec2FeatureExtractor,
+            "facebook/wav2vec2-base-960h",
+        )
+    msg = f"Unsupported model type: {model_type}"
+    raise ValueError(msg)
+
+
+def extract_features(processor, model_type, audio, sample_rate):
+    """Run the processor on one waveform and drop the batch dimension"""
+    if model_type == "whisper":
+        inputs = processor(
+            audio,
+            sampling_rate=sample_rate,
+            return_tensors="pt",
+        )
+        return inputs.input_features.squeeze(0)
+    inputs = processor(
+        audio,
+        sampling_rate=sample_rate,
+        return_tensors="pt",
+        padding=True,
+    )
+    return inputs.input_values.squeeze(0)
+
+
+def model_inputs(model_type, features):
+    """Wrap features in the dict the model and training loop expect"""
+    if model_type == "whisper":
+        return {"input_features": features}
+    if model_type == "wav2vec2":
+        # Ensure proper input dimensions for Wav2Vec2
+        return {"input_values": features.unsqueeze(0)}
+    return None
 
 
 class LiveSpeechDataset(Dataset):
-    def __init__(self, model_type="whisper", sample_rate=16000, record_seconds=5):
+    def __init__(
+        self,
+        model_type="whisper",
+        sample_rate=16000,
+        record_seconds=5,
+        cache_dir=None,
+    ):
         """
         Args:
             model_type (str): Model type to use (whisper or wav2vec2)
             sample_rate (int): Sample rate for audio recording
             record_seconds (int): Duration of each recording in seconds
+            cache_dir (str): Directory for cached processed features; None
+                recomputes features on every access
         """
         self.model_type = model_type
         self.sample_rate = sample_rate
         self.record_seconds = record_seconds
 
-        if model_type == "whisper":
-            self.processor = WhisperProcessor.from_pretrained("openai/whisper-small")
-        elif model_type == "wav2vec2":
-            self.processor = Wav2Vec2FeatureExtractor.from_pretrained(
-                "facebook/wav2vec2-base-960h",
-            )
-        else:
-            msg = f"Unsupported model type: {model_type}"
-            raise ValueError(msg)
+        self.processor = load_processor(model_type)
+
+        self.feature_cache = None
+        if cache_dir is not None:
+            self.feature_cache = FeatureCache(cache_dir, self.processor, model_type)
 
         self.recordings = []
         # Ensure at least one sample exists
@@ -49,27 +107,31 @@ class LiveSpeechDataset(Dataset):
     def __len__(self):
         return len(self.recordings)
 
+    def durations(self):
+        """Duration of every recording in seconds, for duration-aware batching"""
+        return [len(audio) / self.sample_rate for audio in self.recordings]
+
     def __getitem__(self, idx):
         # Get audio and process it
         audio = self.recordings[idx]
 
-        if self.model_type == "whisper":
-            inputs = self.processor(
-                audio,
-                sampling_rate=self.sample_rate,
-                return_tensors="pt",
-            )
-            return {"input_features": inputs.input_features.squeeze(0)}
-        if self.model_type == "wav2vec2":
-            inputs = self.processor(
-                audio,
-                sampling_rate=self.sample_rate,
-                return_tensors="pt",
-                padding=True,
+        if self.feature_cache is None:
+            features = self._extract_features(audio)
+        else:
+            features = torch.from_numpy(
+                self.feature_cache.get_or_compute(
+                    audio,
+                    self.sample_rate,
+                    lambda a: self._extract_features(a).numpy(),
+                )
             )
-            # Ensure proper input dimensions for Wav2Vec2
-            return {"input_values": inputs.input_values.squeeze(0).unsqueeze(0)}
-        return None
+
+        return model_inputs(self.model_type, features)
+
+    def _extract_features(self, audio):
+        return extract_features(
+            self.processor, self.model_type, audio, self.sample_rate
+        )
 
     def record_audio(self):
         """Record audio from the default microphone"""
@@ -93,3 +155,206 @@ class LiveSpeechDataset(Dataset):
         audio = audio.squeeze()
         self.recordings.append(audio)
         return audio
+
+
+class PackedSpeechDataset(Dataset):
+    """Map-style dataset over a corpus packed by harpertoken.store.pack_audio.
+
+    Clips are read as zero-copy slices of the store's memory map, so random
+    access is O(1) and DataLoader workers share the page cache rather than
+    each decoding its own copy of the corpus. Each sample is the dict
+    ``LiveSpeechDataset.__getitem__`` returns, plus ``text`` when known.
+    """
+
+    def __init__(self, store, model_type="whisper", processor=None):
+        """
+        Args:
+            store (str | AudioStore): Packed corpus or its directory
+            model_type (str): Model type to use (whisper or wav2vec2)
+            processor: Feature processor; loaded for ``model_type`` when None
+        """
+        self.store = store if isinstance(store, AudioStore) else AudioStore(store)
+        self.model_type = model_type
+        self.sample_rate = self.store.sample_rate
+        self.processor = processor or load_processor(model_type)
+
+    def __len__(self):
+        return len(self.store)
+
+    def durations(self):
+        return self.store.durations()
+
+    def __getitem__(self, idx):
+        features = extract_features(
+            self.processor, self.model_type, self.store.audio(idx), self.sample_rate
+        )
+        sample = model_inputs(self.model_type, features)
+        text = self.store.texts[idx]
+        if text is not None:
+            sample["text"] = text
+        return sample
+
+
+class StreamingSpeechDataset(IterableDataset):
+    """Stream a corpus from a manifest or WebDataset-style tar shards.
+
+    ``source`` is a JSONL/CSV manifest with an ``audio_path`` column (and an
+    optional ``text`` column), or one or more ``.tar`` shards given as a
+    path, a glob pattern or a list. Inside a shard, files sharing a basename
+    form one sample: an audio file plus an optional ``.txt`` transcript or
+    ``.json`` metadata with a ``text`` field.
+
+    Audio is decoded and resampled lazily in whichever DataLoader worker
+    consumes the sample. Work is split deterministically over
+    ``world_size * num_workers`` streams: whole shards when there are enough
+    of them, otherwise every n-th sample. Shorter streams wrap around to as
+    many samples as the longest one, because every rank has to run the same
+    number of steps or the gradient all-reduce would hang; stream lengths
+    come from a pass over the manifest or the tar headers. Each sample is
+    the dict ``LiveSpeechDataset.__getitem__`` returns, plus ``text`` when
+    known.
+    """
+
+    def __init__(self, source, model_type="whisper", sample_rate=16000, processor=None):
+        """
+        Args:
+            source (str | list): Manifest path, tar shard path/glob, or list of shards
+            model_type (str): Model type to use (whisper or wav2vec2)
+            sample_rate (int): Sample rate audio is resampled to
+            processor: Feature processor; loaded for ``model_type`` when None
+        """
+        self.model_type = model_type
+        self.sample_rate = sample_rate
+        self.processor = processor or load_processor(model_type)
+        if isinstance(source, (list, tuple)):
+            self.shards = [str(shard) for shard in source]
+            self.manifest = None
+        elif str(source).endswith(".tar") or "*" in str(source):
+            pattern = Path(source)
+            self.shards = sorted(str(p) for p in pattern.parent.glob(pattern.name))
+            self.manifest = None
+        else:
+            self.shards = []
+            self.manifest = str(source)
+        # Set by train.build_dataloader in the training process, as DataLoader
+        # workers need not see its process group; None reads torch.distributed
+        self.rank = None
+        self.world_size = None
+
+    def stream_position(self):
+        """Return ``(stream_index, num_streams)`` for the calling worker"""
+        rank, world_size = self.rank, self.world_size
+        if rank is None:
+            initialized = dist.is_available() and dist.is_initialized()
+            rank = dist.get_rank() if initialized else 0
+            world_size = dist.get_world_size() if initialized else 1
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info else (0, 1)
+        return rank * num_workers + worker_id, world_size * num_workers
+
+    def stream_lengths(self, num_streams):
+        """Number of samples in each of ``num_streams`` streams, before padding"""
+        if self.manifest is not None:
+            total = sum(1 for _ in read_manifest(self.manifest))
+        elif len(self.shards) >= num_streams:
+            sizes = [_count_tar_samples(shard) for shard in self.shards]
+            return [sum(sizes[i::num_streams]) for i in range(num_streams)]
+        else:
+            total = sum(_count_tar_samples(shard) for shard in self.shards)
+        return [len(range(i, total, num_streams)) for i in range(num_streams)]
+
+    def __iter__(self):
+        stream, num_streams = self.stream_position()
+        lengths = self.stream_lengths(num_streams)
+        if lengths[stream] == 0:
+            # Nothing of its own to repeat: pad from the whole corpus
+            stream, num_streams = 0, 1
+        samples = islice(
+            chain.from_iterable(
+                self._stream_samples(stream, num_streams) for _ in count()
+            ),
+            max(lengths),
+        )
+
+        for audio_source, text in samples:
+            audio = load_audio(audio_source, self.sample_rate)
+            features = extract_features(
+                self.processor, self.model_type, audio, self.sample_rate
+            )
+            sample = model_inputs(self.model_type, features)
+            if text is not None:
+                sample["text"] = text
+            yield sample
+
+    def _stream_samples(self, stream, num_streams):
+        if self.manifest is not None:
+            return _every_nth(self._manifest_samples(), stream, num_streams)
+        if len(self.shards) >= num_streams:
+            return self._shard_samples(self.shards[stream::num_streams])
+        return _every_nth(self._shard_samples(self.shards), stream, num_streams)
+
+    def _manifest_samples(self):
+        for entry in read_manifest(self.manifest):
+            yield entry["audio_path"], entry.get("text")
+
+    def _shard_samples(self, shards):
+        for shard in shards:
+            with tarfile.open(shard) as tar:
+                for key, files in _group_tar_members(tar):
+                    audio_name = next(
+                        (n for n in files if n.lower().endswith(AUDIO_EXTENSIONS)), None
+                    )
+                    if audio_name is None:
+                        continue
+                    audio = io.BytesIO(files[audio_name])
+                    audio.name = audio_name
+                    yield audio, _tar_text(files, key)
+
+
+def _every_nth(items, start, step):
+    for i, item in enumerate(items):
+        if i % step == start:
+            yield item
+
+
+def _member_key(name):
+    # WebDataset convention: the key is the path up to the first dot of the
+    # basename, so "a/utt1.wav" and "a/utt1.txt" belong together
+    basename = name.rsplit("/", 1)[-1]
+    return name[: len(name) - len(basename)] + basename.split(".")[0]
+
+
+def _count_tar_samples(shard):
+    """Samples in a shard, read from the member headers alone"""
+    with tarfile.open(shard) as tar:
+        return len(
+            {
+                _member_key(member.name)
+                for member in tar
+                if member.isfile() and member.name.lower().endswith(AUDIO_EXTENSIONS)
+            }
+        )
+
+
+def _group_tar_members(tar):
+    """Yield ``(key, {name: bytes})`` for consecutive members sharing a key"""
+    current_key, files = None, {}
+    for member in tar:
+        if not member.isfile():
+            continue
+        key = _member_key(member.name)
+        if key != current_key and files:
+            yield current_key, files
+            files = {}
+        current_key = key
+        files[member.name] = tar.extractfile(member).read()
+    if files:
+        yield current_key, files
+
+
+def _tar_text(files, key):
+    if f"{key}.txt" in files:
+        return files[f"{key}.txt"].decode().strip()
+    if f"{key}.json" in files:
+        return json.loads(files[f"{key}.json"]).get("text")
+    return None
@@ -0,0 +1,115 @@
+import threading
+
+import torch
+
+from harpertoken.registry import registry
+
+# Same tokenizer as whisper-small, a tenth of the parameters
+DRAFT_MODEL_ID = "openai/whisper-tiny"
+
+
+def load_draft_model(model_id=DRAFT_MODEL_ID, dtype=None):
+    """Shared, read-only draft Whisper for assisted decoding.
+
+    The draft must use the same tokenizer as the model it assists, and
+    ``dtype`` should match that model's so both accept the same features.
+    """
+    from transformers import WhisperForConditionalGeneration
+
+    if dtype == torch.float32:
+        dtype = None  # the registry key of a default load
+    return registry.model(WhisperForConditionalGeneration, model_id, dtype=dtype)
+
+
+class Decoder:
+    """Whisper ``generate`` with assisted decoding and a reusable KV cache.
+
+    Drop-in for the wrapped model wherever only ``generate`` and ``dtype``
+    are used, e.g. by the inference, streaming and server helpers.
+
+    With a ``draft_model``, single-utterance greedy requests use assisted
+    decoding: the draft proposes a few tokens at a time and the full model
+    checks them all in one forward pass, keeping the longest prefix it would
+    have produced itself. The output is identical to greedy decoding; it is
+    faster whenever the draft is mostly right, which for a Whisper draft on
+    clean speech is most of the time. Batches decode as usual, since
+    transformers assists one sequence at a time, and so do beam search and
+    sampling, whose output assisted decoding would change.
+
+    With ``static_cache``, other requests decode into a preallocated static
+    KV cache that is reset and reused by later calls of the same batch size
+    instead of growing a new cache token by token. Assisted decoding does not
+    support static caches, so it takes precedence.
+
+    With an ``encoder_cache`` (harpertoken.cache.EncoderCache), requests not
+    using the draft take their encoder outputs from the cache, so decoding
+    the same audio again runs the decoder only.
+    """
+
+    def __init__(self, model, draft_model=None, static_cache=False, encoder_cache=None):
+        """
+        Args:
+            model: WhisperForConditionalGeneration to decode with
+            draft_model: Smaller Whisper with the same tokenizer, see
+                load_draft_model
+            static_cache (bool): Reuse a preallocated KV cache across calls
+            encoder_cache (EncoderCache): Reuse encoder outputs of audio
+                decoded before
+        """
+        self.model = model
+        self.draft_model = draft_model
+        self.static_cache = static_cache
+        self.encoder_cache = encoder_cache
+        self.cache = None
+        self._cache_key = None
+        self._lock = threading.Lock()
+
+    @property
+    def dtype(self):
+        return self.model.dtype
+
+    def generate(self, **kwargs):
+        features = kwargs.get("input_features")
+        batch_size = 1 if features is None else features.shape[0]
+        if self.draft_model is not None and batch_size == 1 and self._greedy(kwargs):
+            # The draft encodes the audio itself, so it needs the features
+            kwargs.setdefault("assistant_model", self.draft_model)
+            return self.model.generate(**kwargs)
+        # Long-form input is split into windows inside generate; leave it be
+        window = self.model.config.max_source_positions * 2
+        short_form = features is not None and features.shape[-1] <= window
+        if self.encoder_cache is not None and short_form:
+            from transformers.modeling_outputs import BaseModelOutput
+
+            hidden_states = self.encoder_cache.encode(
+                self.model, kwargs.pop("input_features")
+            )
+            kwargs["encoder_outputs"] = BaseModelOutput(last_hidden_state=hidden_states)
+        if self.static_cache and short_form and "past_key_values" not in kwargs:
+            # One cache, so concurrent callers take turns
+            with self._lock:
+                kwargs["past_key_values"] = self._reset_cache(batch_size)
+                return self.model.generate(**kwargs)
+        return self.model.generate(**kwargs)
+
+    def _greedy(self, kwargs):
+        config = self.model.generation_config
+        num_beams = kwargs.get("num_beams", config.num_beams) or 1
+        return num_beams == 1 and not kwargs.get("do_sample", config.do_sample)
+
+    def _reset_cache(self, batch_size):
+        from transformers import EncoderDecoderCache, StaticCache
+
+        # Static caches size themselves on first use, so a cache is only
+        # reusable for the batch size, dtype and device it was filled with
+        key = (batch_size, self.model.dtype, self.model.device)
+        if key == self._cache_key:
+            self.cache.reset()
+            return self.cache
+        config = self.model.config
+        self.cache = EncoderDecoderCache(
+            StaticCache(config=config, max_cache_len=config.max_target_positions),
+            StaticCache(config=config, max_cache_len=config.max_source_positions),
+        )
+        self._cache_key = key
+        return self.cache
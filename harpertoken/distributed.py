@@ -0,0 +1,70 @@
+import functools
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """True on rank 0, or when not running distributed at all"""
+    return get_rank() == 0
+
+
+def wrap_model(model):
+    """Wrap ``model`` in DistributedDataParallel when a process group is up"""
+    if not is_distributed():
+        return model
+    return DistributedDataParallel(model)
+
+
+def unwrap_model(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def launch(fn, nproc, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` in ``nproc`` processes joined by gloo.
+
+    gloo runs on plain CPU nodes. Each process gets an equal share of the
+    machine's cores for its intra-op threads so the workers do not
+    oversubscribe the CPU.
+    """
+    port = _free_port()
+    call = functools.partial(fn, *args, **kwargs)
+    mp.spawn(_worker, args=(nproc, port, call), nprocs=nproc, join=True)
+
+
+def _worker(rank, world_size, port, call):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    try:
+        call()
+    finally:
+        dist.destroy_process_group()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
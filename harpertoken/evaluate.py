@@ -1,3 +1,18 @@
+import dataclasses
+import itertools
+import json
+import os
+import re
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+# Upper bound on the batched alignment table held by one worker (int32 cells)
+MAX_TABLE_CELLS = 16_000_000
+
+
 def compute_metrics(predictions, references):
     # Word Error Rate (WER) calculation
     wer = calculate_wer(predictions, references)
@@ -8,38 +23,474 @@ def compute_metrics(predictions, references):
 def calculate_wer(predictions, references):
     # Implementation of WER
     # This function calculates the WER based on the predictions and references
-    errors = 0
-    for i in range(len(predictions)):
-        prediction = predictions[i]
-        reference = references[i]
-        errors += edit_distance(prediction, reference)
-    total_words = sum(len(reference.split()) for reference in references)
+    reference_words = [reference.split() for reference in references]
+    prediction_words = [prediction.split() for prediction in predictions]
+    errors = sum(edit_distances(prediction_words, reference_words))
+    total_words = sum(len(words) for words in reference_words)
     return errors / total_words
 
 
 def calculate_cer(predictions, references):
     # Implementation of CER
     # This function calculates the CER based on the predictions and references
-    errors = 0
-    total_chars = 0
-    for i in range(len(predictions)):
-        prediction = predictions[i]
-        reference = references[i]
-        errors += edit_distance(prediction, reference)
-        total_chars += len(reference)
+    errors = sum(edit_distances(predictions, references))
+    total_chars = sum(len(reference) for reference in references)
     return errors / total_chars
 
 
+@dataclasses.dataclass
+class ErrorReport:
+    """Word and character error counts for one utterance or a whole corpus.
+
+    Reports add up with ``+``, so per-utterance reports can be summed into
+    a corpus report.
+    """
+
+    num_utterances: int = 0
+    reference_words: int = 0
+    substitutions: int = 0
+    insertions: int = 0
+    deletions: int = 0
+    reference_chars: int = 0
+    char_errors: int = 0
+
+    @property
+    def word_errors(self):
+        return self.substitutions + self.insertions + self.deletions
+
+    @property
+    def wer(self):
+        return self.word_errors / max(self.reference_words, 1)
+
+    @property
+    def cer(self):
+        return self.char_errors / max(self.reference_chars, 1)
+
+    def __add__(self, other):
+        return ErrorReport(
+            *(
+                getattr(self, field.name) + getattr(other, field.name)
+                for field in dataclasses.fields(self)
+            )
+        )
+
+    def as_dict(self):
+        return {**dataclasses.asdict(self), "wer": self.wer, "cer": self.cer}
+
+
+def normalize(text):
+    """Lower-case and drop punctuation so WER counts word errors only"""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+class ManifestEvaluator:
+    """Transcribe and score a manifest of audio with reference transcripts.
+
+    Audio is read on ``num_workers`` loader threads and decoded a batch at a
+    time on a single decoder thread, so reading the next batches overlaps
+    with decoding the current one. One decoder thread because
+    ``transcribe_batch`` usually wraps one shared model, whose forward
+    passes are not safe to run concurrently; torch parallelises each one
+    over the cores instead. Each batch is scored as soon as it is decoded
+    and written out as one JSON line per utterance, in manifest order. An
+    utterance whose audio cannot be read gets a record with an ``error``
+    and is left out of the scores. Only a bounded window of batches is in
+    flight at any time, so the memory use does not grow with the size of
+    the manifest.
+    """
+
+    def __init__(
+        self,
+        transcribe_batch,
+        sample_rate=16000,
+        batch_size=8,
+        num_workers=2,
+        normalize_text=True,
+    ):
+        """
+        Args:
+            transcribe_batch: Callable turning a list of float32 waveforms
+                into a list of transcripts
+            sample_rate (int): Rate the audio is loaded at
+            batch_size (int): Utterances per transcribe_batch call
+            num_workers (int): Loader threads reading audio ahead of decoding
+            normalize_text (bool): Lower-case and strip punctuation from both
+                sides before scoring
+        """
+        self.transcribe_batch = transcribe_batch
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        self.normalize_text = normalize_text
+
+    def run(self, entries, output):
+        """Evaluate manifest ``entries``, writing per-utterance JSON lines.
+
+        Args:
+            entries: Iterable of dicts with ``audio_path`` and ``text``, e.g.
+                from harpertoken.audio.read_manifest
+            output: Writable text file for the per-utterance records
+        Returns:
+            The corpus :class:`ErrorReport` and a dict with its WER/CER, the
+            number of unreadable files, the audio duration, the decoding time
+            and the real-time factors
+        """
+        from harpertoken.audio import load_audio
+
+        total = ErrorReport()
+        audio_seconds = decode_seconds = 0.0
+        failed = 0
+        start = time.perf_counter()
+        batches = _batched(enumerate(entries), self.batch_size)
+        pending = deque()
+        loaders = ThreadPoolExecutor(self.num_workers)
+        decoder = ThreadPoolExecutor(1)
+        with loaders, decoder:
+
+            def submit(batch):
+                loads = [
+                    loaders.submit(load_audio, entry["audio_path"], self.sample_rate)
+                    for _, entry in batch
+                ]
+                pending.append(decoder.submit(self._decode, batch, loads))
+
+            # Keep the decoder busy with the next batches already loading
+            for batch in itertools.islice(batches, self.num_workers + 1):
+                submit(batch)
+            while pending:
+                decoded = pending.popleft().result()
+                for next_batch in itertools.islice(batches, 1):
+                    submit(next_batch)
+                total += self._score(decoded, output)
+                audio_seconds += sum(decoded.durations)
+                decode_seconds += decoded.elapsed
+                failed += len(decoded.errors)
+        wall_seconds = time.perf_counter() - start
+        return total, {
+            **total.as_dict(),
+            "failed": failed,
+            "audio_seconds": audio_seconds,
+            "decode_seconds": decode_seconds,
+            "wall_seconds": wall_seconds,
+            # Decoding alone, and end to end
+            "rtf": decode_seconds / max(audio_seconds, 1e-9),
+            "wall_rtf": wall_seconds / max(audio_seconds, 1e-9),
+        }
+
+    def _decode(self, batch, loads):
+        decoded = _DecodedBatch()
+        waveforms = []
+        for item, load in zip(batch, loads):
+            # Waits for the load; an unreadable file fails only its own entry
+            error = load.exception()
+            if error is None:
+                waveforms.append(load.result())
+                decoded.batch.append(item)
+            else:
+                decoded.errors.append((item, f"could not load audio: {error}"))
+        start = time.perf_counter()
+        decoded.hypotheses = self.transcribe_batch(waveforms) if waveforms else []
+        decoded.elapsed = time.perf_counter() - start
+        decoded.durations = [len(waveform) / self.sample_rate for waveform in waveforms]
+        return decoded
+
+    def _score(self, decoded, output):
+        records = [
+            {
+                "index": index,
+                "audio_path": entry["audio_path"],
+                "reference": entry["text"],
+                "error": error,
+            }
+            for (index, entry), error in decoded.errors
+        ]
+        batch_total = ErrorReport()
+        if decoded.batch:
+            references = [entry["text"] for _, entry in decoded.batch]
+            hypotheses = decoded.hypotheses
+            if self.normalize_text:
+                scored = [normalize(text) for text in hypotheses]
+                references = [normalize(text) for text in references]
+            else:
+                scored = list(hypotheses)
+            batch_total, reports = evaluate_corpus(
+                scored, references, num_workers=1, per_utterance=True
+            )
+            # Utterances share their batch's decoding time in proportion to length
+            rtf = decoded.elapsed / max(sum(decoded.durations), 1e-9)
+            for (index, entry), hypothesis, duration, report in zip(
+                decoded.batch, hypotheses, decoded.durations, reports
+            ):
+                record = {
+                    "index": index,
+                    "audio_path": entry["audio_path"],
+                    "reference": entry["text"],
+                    "hypothesis": hypothesis,
+                    "duration": duration,
+                    "rtf": rtf,
+                    **report.as_dict(),
+                }
+                del record["num_utterances"]
+                records.append(record)
+        for record in sorted(records, key=lambda record: record["index"]):
+            output.write(json.dumps(record) + "\n")
+        return batch_total
+
+
+@dataclasses.dataclass
+class _DecodedBatch:
+    """Decoder output for one batch; unreadable entries are in ``errors``"""
+
+    batch: list = dataclasses.field(default_factory=list)
+    errors: list = dataclasses.field(default_factory=list)
+    hypotheses: list = dataclasses.field(default_factory=list)
+    durations: list = dataclasses.field(default_factory=list)
+    elapsed: float = 0.0
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def evaluate_corpus(
+    predictions, references, num_workers=None, chunk_size=2048, per_utterance=False
+):
+    """Score a corpus at word and character level.
+
+    Words are interned to integer IDs once for the whole corpus and pairs are
+    sorted by length, then each chunk of ``chunk_size`` pairs is aligned in a
+    single batched DP over a process pool (``num_workers=1`` runs
+    in-process). Returns the corpus :class:`ErrorReport`, or a tuple of it and
+    the per-utterance reports (in input order) when ``per_utterance`` is set.
+    """
+    if len(predictions) != len(references):
+        msg = f"Got {len(predictions)} predictions for {len(references)} references"
+        raise ValueError(msg)
+    # Unseen words get the next free ID on first lookup
+    vocab = defaultdict()
+    vocab.default_factory = vocab.__len__
+    prediction_ids = [_intern(prediction, vocab) for prediction in predictions]
+    reference_ids = [_intern(reference, vocab) for reference in references]
+
+    # Similar lengths in a chunk keep the padded DP tables small
+    order = sorted(
+        range(len(references)),
+        key=lambda k: (len(reference_ids[k]), len(prediction_ids[k])),
+    )
+    chunks = [
+        [
+            (prediction_ids[k], reference_ids[k], predictions[k], references[k])
+            for k in chunk
+        ]
+        for chunk in _chunk_by_cells(order, prediction_ids, reference_ids, chunk_size)
+    ]
+    num_workers = num_workers or os.cpu_count() or 1
+    if num_workers == 1 or len(chunks) <= 1:
+        results = [_score_chunk(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            results = list(pool.map(_score_chunk, chunks))
+
+    counts = np.zeros((4, len(references)), dtype=np.int64)
+    if results:
+        counts[:, order] = np.concatenate(results, axis=1)
+    substitutions, insertions, deletions, char_errors = counts
+    reference_words = np.array([len(ids) for ids in reference_ids], dtype=np.int64)
+    reference_chars = np.array([len(text) for text in references], dtype=np.int64)
+
+    total = ErrorReport(
+        num_utterances=len(references),
+        reference_words=int(reference_words.sum()),
+        substitutions=int(substitutions.sum()),
+        insertions=int(insertions.sum()),
+        deletions=int(deletions.sum()),
+        reference_chars=int(reference_chars.sum()),
+        char_errors=int(char_errors.sum()),
+    )
+    if not per_utterance:
+        return total
+    rows = zip(
+        reference_words.tolist(),
+        substitutions.tolist(),
+        insertions.tolist(),
+        deletions.tolist(),
+        reference_chars.tolist(),
+        char_errors.tolist(),
+    )
+    return total, [ErrorReport(1, *row) for row in rows]
+
+
+def score_utterance(prediction, reference):
+    """Word and character error counts for a single pair of transcripts"""
+    return evaluate_corpus([prediction], [reference], num_workers=1)
+
+
+def _chunk_by_cells(order, prediction_ids, reference_ids, chunk_size):
+    """Split ``order`` into chunks whose padded alignment tables stay bounded"""
+    chunk, max_m, max_n = [], 0, 0
+    for k in order:
+        m = max(max_m, len(prediction_ids[k]))
+        n = max(max_n, len(reference_ids[k]))
+        if chunk and (
+            len(chunk) == chunk_size
+            or (len(chunk) + 1) * (m + 1) * (n + 1) > MAX_TABLE_CELLS
+        ):
+            yield chunk
+            chunk, m, n = [], len(prediction_ids[k]), len(reference_ids[k])
+        chunk.append(k)
+        max_m, max_n = m, n
+    if chunk:
+        yield chunk
+
+
+def _intern(text, vocab):
+    return [vocab[word] for word in text.split()]
+
+
+def _score_chunk(pairs):
+    """Return a ``(4, len(pairs))`` array of S/I/D word and character errors"""
+    prediction_ids, reference_ids, predictions, references = zip(*pairs)
+    words = _batched_alignment(prediction_ids, reference_ids)
+    chars = _batched_distance(
+        [_code_points(text) for text in predictions],
+        [_code_points(text) for text in references],
+    )
+    return np.vstack([*words, chars])
+
+
+def _code_points(text):
+    return np.frombuffer(text.encode("utf-32-le"), dtype="<u4")
+
+
+def _pad(sequences, fill):
+    lengths = np.array([len(seq) for seq in sequences], dtype=np.int64)
+    padded = np.full((len(sequences), lengths.max(initial=0)), fill, dtype=np.int64)
+    for row, seq in zip(padded, sequences):
+        row[: len(seq)] = seq
+    return padded, lengths
+
+
+def _dp_rows(hypotheses, references):
+    """Yield the rows of the edit-distance DP for a batch of padded pairs.
+
+    Row ``i`` has shape ``(batch, n + 1)``. Diagonal and vertical moves are
+    elementwise; the chain of horizontal moves within a row is a running
+    minimum of ``cost - j``. Padding uses different fill values on each side
+    so it never matches, and never affects cells inside a pair's own lengths.
+    """
+    columns = np.arange(references.shape[1] + 1, dtype=np.int32)
+    row = np.broadcast_to(columns, (len(references), len(columns))).copy()
+    yield row
+    best = np.empty_like(row)
+    for i in range(1, hypotheses.shape[1] + 1):
+        best[:, 0] = i
+        mismatch = references != hypotheses[:, i - 1 : i]
+        np.minimum(row[:, 1:] + 1, row[:, :-1] + mismatch, out=best[:, 1:])
+        row = np.minimum.accumulate(best - columns, axis=1) + columns
+        yield row
+
+
+def _batched_distance(hypotheses, references):
+    hypotheses, m = _pad(hypotheses, -1)
+    references, n = _pad(references, -2)
+    distances = n.copy()
+    for i, row in enumerate(_dp_rows(hypotheses, references)):
+        done = m == i
+        distances[done] = row[done, n[done]]
+    return distances
+
+
+def _batched_alignment(hypotheses, references):
+    """Substitution, insertion and deletion counts of a minimum-cost alignment"""
+    hypotheses, m = _pad(hypotheses, -1)
+    references, n = _pad(references, -2)
+    table = np.stack(list(_dp_rows(hypotheses, references)))
+
+    # Walk every pair back from its corner at once, preferring diagonal moves
+    pair = np.arange(len(m))
+    i, j = m.copy(), n.copy()
+    substitutions, insertions, deletions = (np.zeros_like(m) for _ in range(3))
+    while True:
+        active = (i > 0) & (j > 0)
+        if not active.any():
+            break
+        up, left = np.maximum(i - 1, 0), np.maximum(j - 1, 0)
+        current = table[i, pair, j]
+        mismatch = hypotheses[pair, up] != references[pair, left]
+        diagonal = active & (current == table[up, pair, left] + mismatch)
+        vertical = active & ~diagonal & (current == table[up, pair, j] + 1)
+        horizontal = active & ~diagonal & ~vertical
+        substitutions += diagonal & mismatch
+        insertions += vertical
+        deletions += horizontal
+        i -= diagonal | vertical
+        j -= diagonal | horizontal
+    # Whatever is left over on one side is pure insertion or deletion
+    return substitutions, insertions + i, deletions + j
+
+
+def edit_distances(predictions, references):
+    """Return the edit distance of every prediction/reference pair in a corpus.
+
+    The bit masks built for a reference are reused whenever the same
+    reference appears again, which is common in regression sets.
+    """
+    if len(predictions) != len(references):
+        msg = f"Got {len(predictions)} predictions for {len(references)} references"
+        raise ValueError(msg)
+    masks = {}
+    distances = []
+    for prediction, reference in zip(predictions, references):
+        key = reference if isinstance(reference, str) else tuple(reference)
+        if key not in masks:
+            masks[key] = _match_masks(reference)
+        distances.append(_bit_parallel_distance(masks[key], len(reference), prediction))
+    return distances
+
+
 def edit_distance(prediction, reference):
-    m = len(prediction) + 1
-    n = len(reference) + 1
-    dp = [[0] * n for _ in range(m)]
-    for i in range(m):
-        dp[i][0] = i
-    for j in range(n):
-        dp[0][j] = j
-    for i in range(1, m):
-        for j in range(1, n):
-            cost = 0 if prediction[i - 1] == reference[j - 1] else 1
-            dp[i][j] = min(dp[i - 1][j] + 1, dp[i][j - 1] + 1, dp[i - 1][j - 1] + cost)
-    return dp[m - 1][n - 1]
+    """Levenshtein distance between two strings or sequences of tokens.
+
+    Uses the bit-parallel algorithm of Myers as formulated by Hyyrö: each DP
+    column is encoded as bit vectors of +1/-1 vertical deltas, so the whole
+    column is updated with a handful of integer operations per symbol instead
+    of one Python-level step per cell.
+    """
+    if len(prediction) > len(reference):
+        # Keep the bit vectors as short as possible; distance is symmetric
+        prediction, reference = reference, prediction
+    return _bit_parallel_distance(_match_masks(prediction), len(prediction), reference)
+
+
+def _match_masks(pattern):
+    masks = {}
+    for i, symbol in enumerate(pattern):
+        masks[symbol] = masks.get(symbol, 0) | (1 << i)
+    return masks
+
+
+def _bit_parallel_distance(masks, m, text):
+    if m == 0:
+        return len(text)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    # Column 0 of the DP table is 0..m: every vertical delta is +1
+    positive, negative, score = full, 0, m
+    for symbol in text:
+        eq = masks.get(symbol, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        h_positive = negative | (~(xh | positive) & full)
+        h_negative = positive & xh
+        if h_positive & last:
+            score += 1
+        elif h_negative & last:
+            score -= 1
+        # Row 0 is 0..n, so a +1 horizontal delta enters at the bottom bit
+        h_positive = ((h_positive << 1) | 1) & full
+        h_negative = (h_negative << 1) & full
+        positive = h_negative | (~(xv | h_positive) & full)
+        negative = h_positive & xv
+    return score
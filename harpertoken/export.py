@@ -0,0 +1,422 @@
+import inspect
+import warnings
+from pathlib import Path
+
+import torch
+from torch import nn
+
+BACKENDS = ("torchscript", "onnx")
+ONNX_OPSET = 17
+_SUFFIXES = {"torchscript": ".pt", "onnx": ".onnx"}
+
+
+class WhisperEncoderGraph(nn.Module):
+    """Encoder pass returning the cross-attention keys and values.
+
+    The projections of the encoder output are the same for every decoding
+    step, so they are computed once here and stacked as
+    ``[decoder layers, batch, heads, frames, head dim]``.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.model.encoder
+        self.layers = model.model.decoder.layers
+        self.num_heads = model.config.decoder_attention_heads
+
+    def forward(self, input_features):
+        hidden = self.encoder(input_features).last_hidden_state
+        keys, values = [], []
+        for layer in self.layers:
+            keys.append(_heads(layer.encoder_attn.k_proj(hidden), self.num_heads))
+            values.append(_heads(layer.encoder_attn.v_proj(hidden), self.num_heads))
+        return torch.stack(keys), torch.stack(values)
+
+
+class WhisperDecoderGraph(nn.Module):
+    """One decoder step over the self-attention keys and values of the past.
+
+    Takes one token per row and its position, returns the next-token logits
+    and the caches extended by that token. Every tensor shape is an input,
+    so one traced or exported graph serves every step and batch size.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.decoder = model.model.decoder
+        self.proj_out = model.proj_out
+        self.num_heads = model.config.decoder_attention_heads
+
+    def forward(  # noqa: PLR0913, PLR0917
+        self, input_ids, position, keys, values, cross_keys, cross_values
+    ):
+        decoder = self.decoder
+        positions = decoder.embed_positions.weight[position]
+        hidden = decoder.embed_tokens(input_ids) + positions.unsqueeze(0)
+        new_keys, new_values = [], []
+        for i, layer in enumerate(decoder.layers):
+            normed = layer.self_attn_layer_norm(hidden)
+            attention = layer.self_attn
+            key = torch.cat(
+                [keys[i], _heads(attention.k_proj(normed), self.num_heads)], dim=2
+            )
+            value = torch.cat(
+                [values[i], _heads(attention.v_proj(normed), self.num_heads)], dim=2
+            )
+            new_keys.append(key)
+            new_values.append(value)
+            hidden = hidden + _attend(attention, normed, key, value, self.num_heads)
+
+            normed = layer.encoder_attn_layer_norm(hidden)
+            hidden = hidden + _attend(
+                layer.encoder_attn,
+                normed,
+                cross_keys[i],
+                cross_values[i],
+                self.num_heads,
+            )
+
+            normed = layer.final_layer_norm(hidden)
+            hidden = hidden + layer.fc2(layer.activation_fn(layer.fc1(normed)))
+        logits = self.proj_out(decoder.layer_norm(hidden))
+        return logits[:, -1], torch.stack(new_keys), torch.stack(new_values)
+
+
+def _heads(states, num_heads):
+    """``[batch, time, d_model]`` -> ``[batch, heads, time, head dim]``"""
+    return states.reshape(states.shape[0], states.shape[1], num_heads, -1).transpose(
+        1, 2
+    )
+
+
+def _attend(attention, hidden, keys, values, num_heads):
+    query = _heads(attention.q_proj(hidden), num_heads) * attention.scaling
+    weights = torch.softmax(query @ keys.transpose(-1, -2), dim=-1)
+    output = (weights @ values).transpose(1, 2)
+    return attention.out_proj(output.reshape(output.shape[0], output.shape[1], -1))
+
+
+def _example_inputs(config, batch=2, past=3):
+    heads = config.decoder_attention_heads
+    head_dim = config.d_model // heads
+    frames = config.max_source_positions
+    cache = (config.decoder_layers, batch, heads, past, head_dim)
+    cross = (config.decoder_layers, batch, heads, frames, head_dim)
+    features = torch.zeros(batch, config.num_mel_bins, 2 * frames)
+    step = (
+        torch.zeros(batch, 1, dtype=torch.long),
+        torch.tensor([past]),
+        torch.zeros(cache),
+        torch.zeros(cache),
+        torch.zeros(cross),
+        torch.zeros(cross),
+    )
+    return features, step
+
+
+def export_whisper(model, output_dir, backend="torchscript"):
+    """Write the encoder and decoder-with-past graphs of a Whisper model.
+
+    ``output_dir`` receives ``encoder`` and ``decoder_with_past`` graphs plus
+    the model's config and generation config, which is everything
+    ExportedWhisper.from_pretrained needs.
+
+    Args:
+        model: fp32 WhisperForConditionalGeneration, e.g. a fine-tuned
+            ``save_pretrained`` directory loaded with ``from_pretrained``
+        output_dir (str): Created if missing
+        backend (str): "torchscript" traces the graphs with torch.jit;
+            "onnx" exports them for ONNX Runtime and needs the onnx package
+    Returns:
+        Path of ``output_dir``
+    """
+    if backend not in BACKENDS:
+        msg = f"backend must be one of {BACKENDS}, got {backend!r}"
+        raise ValueError(msg)
+    if model.dtype != torch.float32:
+        msg = f"Export an fp32 model, got {model.dtype}"
+        raise ValueError(msg)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    encoder = WhisperEncoderGraph(model).eval()
+    decoder = WhisperDecoderGraph(model).eval()
+    features, step = _example_inputs(model.config)
+    suffix = _SUFFIXES[backend]
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", torch.jit.TracerWarning)
+        if backend == "torchscript":
+            for name, graph, inputs in (
+                ("encoder", encoder, (features,)),
+                ("decoder_with_past", decoder, step),
+            ):
+                traced = torch.jit.trace(graph, inputs, check_trace=False)
+                torch.jit.save(traced, str(output_dir / f"{name}{suffix}"))
+        else:
+            _export_onnx(encoder, decoder, features, step, output_dir)
+    model.config.save_pretrained(output_dir)
+    model.generation_config.save_pretrained(output_dir)
+    return output_dir
+
+
+def _export_onnx(encoder, decoder, features, step, output_dir):
+    kwargs = {"opset_version": ONNX_OPSET}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The dynamic_axes below are for the TorchScript-based exporter
+        kwargs["dynamo"] = False
+    batch = {1: "batch"}
+    cache = {1: "batch", 3: "past"}
+    torch.onnx.export(
+        encoder,
+        (features,),
+        str(output_dir / "encoder.onnx"),
+        input_names=["input_features"],
+        output_names=["cross_keys", "cross_values"],
+        dynamic_axes={
+            "input_features": {0: "batch"},
+            "cross_keys": batch,
+            "cross_values": batch,
+        },
+        **kwargs,
+    )
+    torch.onnx.export(
+        decoder,
+        step,
+        str(output_dir / "decoder_with_past.onnx"),
+        input_names=[
+            "input_ids",
+            "position",
+            "keys",
+            "values",
+            "cross_keys",
+            "cross_values",
+        ],
+        output_names=["logits", "new_keys", "new_values"],
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "keys": cache,
+            "values": cache,
+            "cross_keys": batch,
+            "cross_values": batch,
+            "logits": {0: "batch"},
+            "new_keys": {1: "batch", 3: "total"},
+            "new_values": {1: "batch", 3: "total"},
+        },
+        **kwargs,
+    )
+
+
+class _TorchGraph:
+    def __init__(self, module):
+        self.module = module
+
+    def __call__(self, *inputs):
+        with torch.no_grad():
+            return self.module(*inputs)
+
+
+class _OnnxGraph:
+    def __init__(self, path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            msg = "The onnx backend needs onnxruntime: pip install onnxruntime"
+            raise ImportError(msg) from e
+
+        self.session = onnxruntime.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+        self.names = [node.name for node in self.session.get_inputs()]
+
+    def __call__(self, *inputs):
+        feed = {name: x.numpy() for name, x in zip(self.names, inputs)}
+        return tuple(torch.from_numpy(out) for out in self.session.run(None, feed))
+
+
+class ExportedWhisper:
+    """Greedy Whisper decoding on exported encoder and decoder graphs.
+
+    Drop-in for the model wherever only ``generate`` and ``dtype`` are used,
+    e.g. by transcribe_audio and transcribe_batch. Each token costs one call
+    of the decoder-with-past graph on explicit cache tensors, without the
+    Python-side cache objects, logits processors and stopping criteria of
+    transformers' ``generate``; the cross-attention projections of the
+    encoder output are computed once per clip.
+
+    Only greedy decoding of short-form (up to 30 s) audio is supported. The
+    tokens match eager greedy ``generate`` up to float rounding.
+    """
+
+    dtype = torch.float32
+
+    def __init__(self, encoder, decoder, config, generation_config):
+        """
+        Args:
+            encoder: Callable running WhisperEncoderGraph
+            decoder: Callable running WhisperDecoderGraph
+            config: WhisperConfig of the exported model
+            generation_config: Its GenerationConfig, for the special tokens
+        """
+        self.encoder = encoder
+        self.decoder = decoder
+        self.config = config
+        self.generation_config = generation_config
+
+    @classmethod
+    def from_pretrained(cls, path, backend=None):
+        """Load the graphs export_whisper wrote to ``path``.
+
+        ``backend`` defaults to "onnx" when ONNX graphs are present, else
+        "torchscript".
+        """
+        from transformers import GenerationConfig, WhisperConfig
+
+        path = Path(path)
+        if backend is None:
+            backend = "onnx" if (path / "encoder.onnx").exists() else "torchscript"
+        if backend not in BACKENDS:
+            msg = f"backend must be one of {BACKENDS}, got {backend!r}"
+            raise ValueError(msg)
+        suffix = _SUFFIXES[backend]
+        graphs = [path / f"{name}{suffix}" for name in ("encoder", "decoder_with_past")]
+        if backend == "onnx":
+            encoder, decoder = (_OnnxGraph(graph) for graph in graphs)
+        else:
+            encoder, decoder = (
+                _TorchGraph(torch.jit.load(str(graph), map_location="cpu"))
+                for graph in graphs
+            )
+        return cls(
+            encoder,
+            decoder,
+            WhisperConfig.from_pretrained(path),
+            GenerationConfig.from_pretrained(path),
+        )
+
+    @classmethod
+    def from_model(cls, model):
+        """Run the graphs eagerly on ``model``, without exporting them"""
+        return cls(
+            _TorchGraph(WhisperEncoderGraph(model).eval()),
+            _TorchGraph(WhisperDecoderGraph(model).eval()),
+            model.config,
+            model.generation_config,
+        )
+
+    def generate(
+        self,
+        input_features,
+        language=None,
+        task=None,
+        max_new_tokens=None,
+        min_new_tokens=0,
+        **kwargs,
+    ):
+        """Greedily decode ``[batch, mel bins, frames]`` features.
+
+        ``attention_mask`` is accepted and ignored, as Whisper's encoder
+        does not use it. Returns the generated token ids of every row, ending
+        in EOS followed by padding, like transformers' short-form output.
+        """
+        kwargs.pop("attention_mask", None)
+        if kwargs.pop("num_beams", 1) > 1 or any(kwargs.values()):
+            msg = "Exported Whisper models support greedy short-form decoding only"
+            raise ValueError(msg)
+        if input_features.shape[-1] > 2 * self.config.max_source_positions:
+            msg = "Long-form audio is not supported; decode it in 30 s windows"
+            raise ValueError(msg)
+        cross = self.encoder(input_features.float())
+        batch_size = input_features.shape[0]
+        heads = self.config.decoder_attention_heads
+        empty = torch.zeros(
+            self.config.decoder_layers,
+            batch_size,
+            heads,
+            0,
+            self.config.d_model // heads,
+        )
+        state = _DecodeState(self.decoder, (empty, empty), cross)
+        start = self.generation_config.decoder_start_token_id
+        logits = state.step(torch.full((batch_size, 1), start))
+        for ids in self._prompt(logits, language, task):
+            logits = state.step(ids)
+        config = self.generation_config
+        limit = max_new_tokens or config.max_length - state.position
+        limit = min(limit, self.config.max_target_positions - state.position)
+        return self._greedy(state, logits, limit, min_new_tokens)
+
+    def _prompt(self, logits, language, task):
+        """Language, task and no-timestamps tokens after the start token"""
+        config = self.generation_config
+        lang_to_id = getattr(config, "lang_to_id", None)
+        if not lang_to_id:
+            if language is not None or task is not None:
+                msg = "This model has no language or task tokens"
+                raise ValueError(msg)
+            return []
+        batch_size = logits.shape[0]
+        if language is None:
+            # Detect it from the first step, as transformers does
+            candidates = torch.tensor(list(lang_to_id.values()))
+            prompt = [candidates[logits[:, candidates].argmax(-1)][:, None]]
+        else:
+            token = lang_to_id[_language_token(language, lang_to_id)]
+            prompt = [torch.full((batch_size, 1), token)]
+        prompt.append(
+            torch.full((batch_size, 1), config.task_to_id[task or "transcribe"])
+        )
+        no_timestamps = getattr(config, "no_timestamps_token_id", None)
+        if no_timestamps is not None:
+            prompt.append(torch.full((batch_size, 1), no_timestamps))
+        return prompt
+
+    def _greedy(self, state, logits, limit, min_new_tokens):
+        config = self.generation_config
+        eos = config.eos_token_id
+        pad = eos if config.pad_token_id is None else config.pad_token_id
+        suppress = list(config.suppress_tokens or [])
+        finished = torch.zeros(logits.shape[0], dtype=torch.bool)
+        generated = []
+        for i in range(limit):
+            blocked = suppress + (
+                list(config.begin_suppress_tokens or []) if i == 0 else []
+            )
+            if i < min_new_tokens:
+                blocked.append(eos)
+            if blocked:
+                logits[:, blocked] = -float("inf")
+            ids = torch.where(finished, pad, logits.argmax(-1))
+            generated.append(ids)
+            finished |= ids == eos
+            if finished.all() or i == limit - 1:
+                break
+            logits = state.step(ids[:, None])
+        return torch.stack(generated, dim=1)
+
+
+class _DecodeState:
+    """The growing self-attention cache of one ``generate`` call"""
+
+    def __init__(self, decoder, cache, cross):
+        self.decoder = decoder
+        self.cache = cache
+        self.cross = cross
+        self.position = 0
+
+    def step(self, ids):
+        logits, *self.cache = self.decoder(
+            ids, torch.tensor([self.position]), *self.cache, *self.cross
+        )
+        self.position += 1
+        return logits
+
+
+def _language_token(language, lang_to_id):
+    """``"en"``, ``"english"`` or ``"<|en|>"`` -> ``"<|en|>"``"""
+    from transformers.models.whisper.tokenization_whisper import TO_LANGUAGE_CODE
+
+    code = TO_LANGUAGE_CODE.get(language.lower(), language.lower().strip("<|>"))
+    token = f"<|{code}|>"
+    if token not in lang_to_id:
+        msg = f"Unsupported language {language!r}"
+        raise ValueError(msg)
+    return token
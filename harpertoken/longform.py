@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+import torch
+
+from harpertoken.audio import load_audio_segment
+from harpertoken.preprocessing import resample
+
+# Whisper's feature extractor pads or truncates every input to 30 s
+CHUNK_SECONDS = 30.0
+OVERLAP_SECONDS = 5.0
+
+
+def iter_windows(
+    audio,
+    sample_rate=16000,
+    chunk_seconds=CHUNK_SECONDS,
+    overlap_seconds=OVERLAP_SECONDS,
+):
+    """Yield overlapping ``(start_seconds, window)`` views over a waveform.
+
+    Windows are slices of ``audio``, so no samples are copied.
+    """
+    chunk, step = _window_sizes(sample_rate, chunk_seconds, overlap_seconds)
+    start = 0
+    while True:
+        yield start / sample_rate, audio[start : start + chunk]
+        if start + chunk >= len(audio):
+            return
+        start += step
+
+
+def iter_file_windows(
+    audio_path,
+    sample_rate=16000,
+    chunk_seconds=CHUNK_SECONDS,
+    overlap_seconds=OVERLAP_SECONDS,
+):
+    """Yield overlapping ``(start_seconds, window)`` pairs read from a file.
+
+    Only one window is decoded at a time, so memory stays flat however long
+    the recording is. Windows are mono float32 at ``sample_rate``.
+    """
+    # Read a single frame to learn the file's native rate
+    _, file_rate = load_audio_segment(audio_path, 0, 1)
+    chunk, step = _window_sizes(file_rate, chunk_seconds, overlap_seconds)
+    start = 0
+    while True:
+        # One extra frame tells us whether the recording continues past this
+        # window without having to know its total length up front
+        waveform, _ = load_audio_segment(audio_path, start, chunk + 1)
+        is_last = waveform.shape[-1] <= chunk
+        waveform = waveform[..., :chunk]
+        if waveform.shape[-1] == 0:
+            return
+        if waveform.dim() == 2:
+            waveform = waveform.mean(dim=0)
+        if file_rate != sample_rate:
+            waveform = resample(waveform, file_rate, sample_rate)
+        yield start / file_rate, waveform.numpy().astype(np.float32, copy=False)
+        if is_last:
+            return
+        start += step
+
+
+def _window_sizes(sample_rate, chunk_seconds, overlap_seconds):
+    if not 0 <= overlap_seconds < chunk_seconds:
+        msg = "overlap_seconds must be non-negative and shorter than chunk_seconds"
+        raise ValueError(msg)
+    chunk = int(chunk_seconds * sample_rate)
+    return chunk, chunk - int(overlap_seconds * sample_rate)
+
+
+def iter_segments(model, processor, windows, batch_size=4, **generate_kwargs):
+    """Transcribe overlapping windows in batches and yield stitched segments.
+
+    ``windows`` is an iterable of ``(start_seconds, waveform)`` pairs such as
+    the ones produced by :func:`iter_windows`. Every window is decoded with
+    Whisper timestamps; a segment is kept by the window whose share of the
+    overlap contains the segment's midpoint, so words inside an overlap are
+    emitted exactly once. Segments are dicts with absolute ``start``/``end``
+    seconds and ``text``.
+    """
+    sample_rate = processor.feature_extractor.sampling_rate
+    batch = []
+    for window in _with_boundaries(windows, sample_rate):
+        batch.append(window)
+        if len(batch) == batch_size:
+            yield from _decode_windows(model, processor, batch, generate_kwargs)
+            batch = []
+    if batch:
+        yield from _decode_windows(model, processor, batch, generate_kwargs)
+
+
+def transcribe_long(model, processor, windows, batch_size=4, **generate_kwargs):
+    """Transcribe a long recording, returning its text and timestamped segments"""
+    segments = list(
+        iter_segments(model, processor, windows, batch_size, **generate_kwargs)
+    )
+    text = " ".join(segment["text"] for segment in segments if segment["text"])
+    return {"text": text, "segments": segments}
+
+
+def _with_boundaries(windows, sample_rate):
+    """Attach to each window the span of time it is responsible for.
+
+    The boundary between two neighbouring windows is the middle of their
+    overlap; the first window owns everything before it and the last window
+    everything after.
+    """
+    previous = None
+    lower = -math.inf
+    for start, audio in windows:
+        if previous is not None:
+            prev_start, prev_audio = previous
+            prev_end = prev_start + len(prev_audio) / sample_rate
+            boundary = (start + prev_end) / 2
+            yield prev_start, prev_audio, lower, boundary
+            lower = boundary
+        previous = (start, audio)
+    if previous is not None:
+        yield previous[0], previous[1], lower, math.inf
+
+
+def _decode_windows(model, processor, batch, generate_kwargs):
+    sample_rate = processor.feature_extractor.sampling_rate
+    inputs = processor(
+        [audio for _, audio, _, _ in batch],
+        sampling_rate=sample_rate,
+        return_attention_mask=True,
+        return_tensors="pt",
+    )
+    with torch.no_grad():
+        generated_ids = model.generate(
+            input_features=inputs.input_features.to(model.dtype),
+            attention_mask=inputs.attention_mask,
+            return_timestamps=True,
+            **generate_kwargs,
+        )
+
+    for ids, (start, audio, lower, upper) in zip(generated_ids, batch):
+        decoded = processor.decode(ids, skip_special_tokens=True, output_offsets=True)
+        offsets = decoded["offsets"] or [
+            # No timestamp tokens: treat the whole window as one segment
+            {"text": decoded["text"], "timestamp": (0.0, len(audio) / sample_rate)}
+        ]
+        for offset in offsets:
+            seg_start, seg_end = offset["timestamp"]
+            seg_start = start + seg_start
+            seg_end = start + (seg_end if seg_end is not None else seg_start)
+            if lower <= (seg_start + seg_end) / 2 < upper:
+                yield {
+                    "start": seg_start,
+                    "end": seg_end,
+                    "text": offset["text"].strip(),
+                }
@@ -1,8 +1,12 @@
 import logging
 import warnings
 
+import torch
 from torch import nn
-from transformers import Wav2Vec2Model, WhisperForConditionalGeneration
+
+from harpertoken.decoding import Decoder, load_draft_model
+from harpertoken.quantize import load_for_inference, quantize_model
+from harpertoken.registry import registry
 
 # Suppress model weight warnings
 warnings.simplefilter("ignore", category=UserWarning)
@@ -10,42 +14,142 @@ logging.getLogger("transformers").setLevel(logging.ERROR)
 logging.getLogger("accelerate").setLevel(logging.ERROR)
 
 
+# transformers class names, resolved when a model is built so that importing
+# this module does not load transformers
+MODEL_IDS = {
+    "wav2vec2": ("Wav2Vec2ForCTC", "facebook/wav2vec2-base-960h"),
+    "whisper": ("WhisperForConditionalGeneration", "openai/whisper-small"),
+}
+
+
 class SpeechModel(nn.Module):
-    def __init__(self, model_type="whisper"):
+    def __init__(
+        self,
+        model_type="whisper",
+        shared=False,
+        precision="fp32",
+        quantized_cache_dir=None,
+        config=None,
+    ):
+        """
+        Args:
+            model_type (str): "whisper" or "wav2vec2"
+            shared (bool): Use the registry's read-only instance, for
+                inference; by default the model loads its own trainable weights
+            precision (str): "fp32", or "int8"/"bf16" for an inference-only
+                model with dynamically quantized or bfloat16 weights
+            quantized_cache_dir (str): Cache int8 models here across starts
+            config: transformers config to build a randomly initialised model
+                from instead of loading pretrained weights, which needs no
+                network; used by tests and benchmarks
+        """
+        import transformers
+
         super().__init__()
         self.model_type = model_type
+        self.precision = precision
+        self.decoder = None
 
-        if model_type == "wav2vec2":
-            self.model = Wav2Vec2Model.from_pretrained("facebook/wav2vec2-base-960h")
-            self.fc = nn.Linear(768, 32)  # Adjust output size as needed
-        elif model_type == "whisper":
-            self.model = WhisperForConditionalGeneration.from_pretrained(
-                "openai/whisper-small",
-            )
-        else:
+        if model_type not in MODEL_IDS:
             msg = f"Unsupported model type: {model_type}"
             raise ValueError(msg)
+        class_name, model_id = MODEL_IDS[model_type]
+        cls = getattr(transformers, class_name)
+        if config is not None:
+            self.model = quantize_model(cls(config), precision)
+        elif precision != "fp32":
+            self.model = load_for_inference(
+                cls, model_id, precision, cache_dir=quantized_cache_dir
+            )
+        elif shared:
+            self.model = registry.model(cls, model_id)
+        else:
+            # A private load, so the registry does not also pin these weights
+            self.model = cls.from_pretrained(model_id)
+        if precision != "fp32":
+            self.eval()
+
+    def _cast(self, inputs):
+        # bf16 weights need bf16 inputs; int8 layers quantize fp32 on the fly
+        if self.precision == "bf16":
+            return inputs.to(torch.bfloat16)
+        return inputs
 
     def forward(self, inputs, labels=None):
         if self.model_type == "wav2vec2":
             # Ensure proper input dimensions for Wav2Vec2
             if inputs.dim() == 4:
                 inputs = inputs.squeeze(1)
-            outputs = self.model(inputs).last_hidden_state
-            outputs = self.fc(outputs)
-            return outputs
+            inputs = self._cast(inputs)
+            # Labels padded with -100 give the CTC loss, else the logits
+            if labels is not None:
+                return self.model(inputs, labels=labels)
+            return self.model(inputs).logits
         if self.model_type == "whisper":
+            inputs = self._cast(inputs)
             if labels is not None:
                 return self.model(input_features=inputs, labels=labels)
             return self.model(input_features=inputs)
 
+    def freeze_encoder(self):
+        """Exclude the acoustic encoder from training.
+
+        For Whisper this freezes the whole audio encoder; for wav2vec2 the
+        convolutional feature encoder, as is usual when fine-tuning it.
+        """
+        if self.model_type == "whisper":
+            self.model.get_encoder().requires_grad_(requires_grad=False)
+        else:
+            self.model.freeze_feature_encoder()
+
+    def configure_decoding(
+        self, draft_model=None, static_cache=False, encoder_cache=None
+    ):
+        """Speed up Whisper generate without changing its output.
+
+        See harpertoken.decoding.Decoder.
+
+        Args:
+            draft_model: Hub id, SpeechModel or Whisper model proposing tokens
+                for assisted greedy decoding, e.g. decoding.DRAFT_MODEL_ID
+            static_cache (bool): Reuse a preallocated KV cache across calls
+            encoder_cache (EncoderCache): Skip the encoder for audio decoded
+                before, e.g. in language, task, beam or prompt sweeps
+        """
+        if self.model_type != "whisper":
+            msg = "Assisted decoding is only supported for 'whisper'"
+            raise ValueError(msg)
+        if isinstance(draft_model, str):
+            draft_model = load_draft_model(draft_model, dtype=self.model.dtype)
+        elif isinstance(draft_model, SpeechModel):
+            draft_model = draft_model.model
+        self.decoder = Decoder(self.model, draft_model, static_cache, encoder_cache)
+
     def generate(self, **kwargs):
         """Generate output tokens for transcription.
 
-        For Whisper models, this forwards directly to the underlying
-        WhisperForConditionalGeneration.generate with the provided kwargs.
+        For Whisper models, this forwards to the underlying
+        WhisperForConditionalGeneration.generate with the provided kwargs, or
+        to the Decoder set up by configure_decoding.
+
+        For wav2vec2 it takes ``input_values`` (and optionally
+        ``attention_mask``) and returns the most likely token of every logit
+        frame, blank past the end of each clip, which the processor's
+        ``batch_decode`` collapses into text. For beam search with a language
+        model decode the logits with harpertoken.ctc.CTCDecoder instead.
         """
         if self.model_type == "whisper":
-            return self.model.generate(**kwargs)
-        error_message = "generate is only supported for 'whisper' in SpeechModel"
-        raise NotImplementedError(error_message)
+            if "input_features" in kwargs:
+                kwargs["input_features"] = self._cast(kwargs["input_features"])
+            return (self.decoder or self.model).generate(**kwargs)
+        from harpertoken.ctc import BLANK_ID, output_lengths
+
+        inputs = self._cast(kwargs["input_values"])
+        attention_mask = kwargs.get("attention_mask")
+        with torch.no_grad():
+            logits = self.model(inputs, attention_mask=attention_mask).logits
+        ids = logits.argmax(-1)
+        if attention_mask is not None:
+            lengths = output_lengths(self.model.config, attention_mask.sum(-1))
+            ids[torch.arange(ids.shape[1]) >= lengths[:, None]] = BLANK_ID
+        return ids
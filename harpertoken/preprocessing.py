@@ -1,12 +1,134 @@
-import torchaudio.transforms as T
+import functools
+
+import torch
+
+from harpertoken.batching import pad_time
+
+
+@functools.lru_cache(maxsize=16)
+def _resampler(orig_freq, new_freq):
+    # torchaudio takes seconds to import; only pay for it when used
+    import torchaudio.transforms as T
+
+    return T.Resample(orig_freq=orig_freq, new_freq=new_freq)
+
+
+def resample(waveform, orig_freq, new_freq):
+    """Resample a tensor along its last dimension.
+
+    The windowed-sinc kernel for each rate pair is built once and reused, where
+    torchaudio.functional.resample recomputes it on every call.
+    """
+    if orig_freq == new_freq:
+        return waveform
+    return _resampler(orig_freq, new_freq)(waveform)
 
 
 class AudioPreprocessor:
-    def __init__(self, sample_rate=16000, n_mels=64):
+    """Turn batches of raw waveforms into mel spectrograms.
+
+    Clips are resampled to ``sample_rate`` (one padded resampling call per
+    source rate in the batch), padded together and transformed in a single
+    vectorised mel spectrogram call. With ``normalize`` the features are
+    log-compressed and scaled to zero mean and unit variance per mel bin over
+    each clip's own frames.
+
+    These are generic mel features, not Whisper's or wav2vec2's inputs: the
+    training, inference and serving paths get those from the transformers
+    feature extractors (see harpertoken.dataset.extract_features), which
+    already batch their STFT in torch. Only the resampling kernel cache
+    (``resample``) is shared with those paths.
+    """
+
+    def __init__(self, sample_rate=16000, n_mels=64, normalize=False):
+        import torchaudio.transforms as T
+
         self.sample_rate = sample_rate
+        self.normalize = normalize
         self.mel_transform = T.MelSpectrogram(sample_rate=sample_rate, n_mels=n_mels)
-        self.normalize = T.Resample(orig_freq=sample_rate, new_freq=sample_rate)
 
-    def process(self, waveform):
+    def process(self, waveform, sample_rate=None):
+        """Mel spectrogram of one waveform of shape ``[..., time]``"""
+        waveform = resample(
+            torch.as_tensor(waveform), sample_rate or self.sample_rate, self.sample_rate
+        )
         mel_spectrogram = self.mel_transform(waveform)
+        if self.normalize:
+            flat = mel_spectrogram.reshape(-1, *mel_spectrogram.shape[-2:])
+            frames = torch.full((flat.shape[0],), flat.shape[-1])
+            mel_spectrogram = _normalize(flat, frames).reshape(mel_spectrogram.shape)
         return mel_spectrogram
+
+    def process_batch(self, waveforms, sample_rate=None, lengths=None, augment=None):
+        """Mel spectrograms of a batch of clips.
+
+        Args:
+            waveforms: Padded ``[batch, time]`` tensor, or a list of 1-D clips
+            sample_rate (int or list): Input rate, or one rate per clip of a
+                list; defaults to ``self.sample_rate``
+            lengths: Valid samples in each row of a padded tensor
+            augment (BatchAugment): Augments the resampled waveforms and the
+                features, for training
+        Returns:
+            ``[batch, n_mels, frames]`` features and the number of valid
+            frames of every clip
+        """
+        if isinstance(waveforms, torch.Tensor):
+            rate = sample_rate or self.sample_rate
+            if lengths is None:
+                lengths = [waveforms.shape[-1]] * waveforms.shape[0]
+            batch = resample(waveforms.float(), rate, self.sample_rate)
+            lengths = [_resampled_length(n, rate, self.sample_rate) for n in lengths]
+        else:
+            batch, lengths = self._resample_clips(waveforms, sample_rate)
+        if augment is not None:
+            batch, lengths = augment.waveforms(batch, lengths)
+            lengths = lengths.tolist()
+
+        features = self.mel_transform(batch)
+        # MelSpectrogram centres its frames, giving length // hop + 1 of them
+        hop_length = self.mel_transform.spectrogram.hop_length
+        frames = torch.tensor(
+            [min(n // hop_length + 1, features.shape[-1]) for n in lengths]
+        )
+        if self.normalize:
+            features = _normalize(features, frames)
+        if augment is not None:
+            features = augment.features(features, frames)
+        return features, frames
+
+    def _resample_clips(self, waveforms, sample_rate):
+        waveforms = [
+            torch.as_tensor(w, dtype=torch.float32).reshape(-1) for w in waveforms
+        ]
+        if isinstance(sample_rate, (list, tuple)):
+            rates = list(sample_rate)
+        else:
+            rates = [sample_rate or self.sample_rate] * len(waveforms)
+
+        clips = [None] * len(waveforms)
+        lengths = [0] * len(waveforms)
+        for rate in set(rates):
+            group = [i for i, r in enumerate(rates) if r == rate]
+            padded, _ = pad_time([waveforms[i] for i in group])
+            resampled = resample(padded, rate, self.sample_rate)
+            for row, i in enumerate(group):
+                lengths[i] = _resampled_length(
+                    len(waveforms[i]), rate, self.sample_rate
+                )
+                clips[i] = resampled[row, : lengths[i]]
+        return pad_time(clips)[0], lengths
+
+
+def _resampled_length(length, orig_freq, new_freq):
+    return -(-length * new_freq // orig_freq)
+
+
+def _normalize(features, frames):
+    """Log-compress, then standardise each clip over its valid frames"""
+    features = torch.log(features + 1e-6)
+    mask = (torch.arange(features.shape[-1]) < frames[:, None]).unsqueeze(1)
+    count = frames.clamp(min=1).to(features.dtype)[:, None, None]
+    mean = (features * mask).sum(-1, keepdim=True) / count
+    var = (((features - mean) * mask) ** 2).sum(-1, keepdim=True) / count
+    return (features - mean) / torch.sqrt(var + 1e-5) * mask
@@ -0,0 +1,202 @@
+import contextlib
+import json
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+
+class Profiler:
+    """Named stage timers and counters written as JSON lines.
+
+    Wrap each stage of a step in ``stage(name)``, add to counters with
+    ``count(name, n)`` and close the step with ``step()``. Every step becomes
+    one ``{"event": "step", ...}`` record holding its wall time, the time of
+    each stage, the counters, samples per second and ``data_wait_ratio``, the
+    share of the step spent in the ``"data"`` stage: close to 1 means the run
+    is input-bound, close to 0 compute-bound. ``summary()`` writes the totals
+    since the previous summary, e.g. once per epoch.
+
+    Without an ``output`` the profiler is disabled and its hooks cost next to
+    nothing, so hot paths can call them unconditionally. With ``trace_steps``
+    a torch.profiler trace of that many steps, after ``trace_wait`` warm-up
+    steps, is saved to ``trace_dir`` for TensorBoard or Perfetto.
+    """
+
+    def __init__(
+        self,
+        output=None,
+        trace_dir=None,
+        trace_steps=0,
+        trace_wait=1,
+        synchronize=False,
+    ):
+        """
+        Args:
+            output: Path or writable text file for the JSON lines; ``"-"``
+                writes to stderr
+            trace_dir (str): Where torch.profiler traces are saved
+            trace_steps (int): Steps to capture in the trace; 0 disables it
+            trace_wait (int): Steps to skip before the trace starts
+            synchronize (bool): Wait for queued CUDA kernels at the end of
+                every stage, so GPU time is charged to the stage launching it
+        """
+        self.enabled = output is not None
+        self.synchronize = synchronize
+        self.fields = {}
+        self.steps = 0
+        self._stages = defaultdict(float)
+        self._counters = defaultdict(float)
+        self._totals = defaultdict(float)
+        self._total_counters = defaultdict(float)
+        self._total_time = 0.0
+        self._step_start = time.perf_counter()
+        self._trace = None
+        if output == "-":
+            self._file, self._owns_file = sys.stderr, False
+        elif isinstance(output, (str, Path)):
+            file = Path(output).open("a", buffering=1)  # noqa: SIM115
+            self._file, self._owns_file = file, True
+        else:
+            self._file, self._owns_file = output, False
+        if self.enabled and trace_steps > 0:
+            self._trace = _start_trace(trace_dir or "traces", trace_steps, trace_wait)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time the enclosed block as stage ``name`` of the current step"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        with contextlib.ExitStack() as stack:
+            if self._trace is not None:
+                from torch.profiler import record_function
+
+                stack.enter_context(record_function(name))
+            yield
+            if self.synchronize:
+                _cuda_synchronize()
+        self._stages[name] += time.perf_counter() - start
+
+    def timed(self, iterable, name="data"):
+        """Iterate ``iterable``, timing every ``next()`` as stage ``name``"""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self._counters[name] += value
+
+    def step(self, **fields):
+        """Finish the current step and write its record.
+
+        Keyword arguments (e.g. the epoch or loss) are added to the record.
+        """
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        elapsed = now - self._step_start
+        self._step_start = now
+        self.steps += 1
+        for name, value in self._stages.items():
+            self._totals[name] += value
+        for name, value in self._counters.items():
+            self._total_counters[name] += value
+        self._total_time += elapsed
+        self._write(
+            "step",
+            step=self.steps,
+            **fields,
+            **_rates(elapsed, self._stages, self._counters),
+        )
+        self._stages.clear()
+        self._counters.clear()
+        if self._trace is not None:
+            self._trace.step()
+
+    def summary(self, **fields):
+        """Write the totals of all steps since the previous summary"""
+        if not self.enabled or self._total_time == 0:
+            return
+        self._write(
+            "summary",
+            steps=self.steps,
+            **fields,
+            **_rates(self._total_time, self._totals, self._total_counters),
+        )
+        self._totals.clear()
+        self._total_counters.clear()
+        self._total_time = 0.0
+
+    def close(self):
+        if self._trace is not None:
+            self._trace.stop()
+            self._trace = None
+        if self._owns_file:
+            self._file.close()
+            self._owns_file = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write(self, event, **record):
+        record = {"event": event, "time": time.time(), **self.fields, **record}
+        self._file.write(json.dumps(record) + "\n")
+
+
+_DONE = object()
+
+
+def _rates(elapsed, stages, counters):
+    stages = {name: round(value, 6) for name, value in stages.items()}
+    record = {
+        "wall_time": round(elapsed, 6),
+        "stages": stages,
+        # Time spent outside every stage, e.g. logging or loss.item() syncs
+        "other": round(max(elapsed - sum(stages.values()), 0.0), 6),
+        "data_wait_ratio": stages.get("data", 0.0) / elapsed if elapsed else 0.0,
+        "counters": dict(counters),
+    }
+    if "samples" in counters and elapsed:
+        record["samples_per_sec"] = counters["samples"] / elapsed
+    if counters.get("audio_seconds"):
+        record["rtf"] = elapsed / counters["audio_seconds"]
+    return record
+
+
+def _cuda_synchronize():
+    import torch
+
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def _start_trace(trace_dir, trace_steps, trace_wait):
+    import torch
+    from torch.profiler import (
+        ProfilerActivity,
+        profile,
+        schedule,
+        tensorboard_trace_handler,
+    )
+
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    trace = profile(
+        activities=activities,
+        schedule=schedule(wait=trace_wait, warmup=1, active=trace_steps, repeat=1),
+        on_trace_ready=tensorboard_trace_handler(str(trace_dir)),
+        record_shapes=True,
+    )
+    trace.start()
+    return trace
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import tempfile
+import warnings
+from pathlib import Path
+
+import torch
+from torch import nn
+
+from harpertoken.registry import registry
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def quantize_model(model, precision):
+    """Convert an fp32 module for CPU inference, in place where possible.
+
+    ``int8`` applies dynamic quantization to every ``nn.Linear``: weights are
+    stored as int8 and activations are quantized on the fly, which cuts the
+    memory of the linear layers by 4x and runs them on int8 kernels. ``bf16``
+    casts all parameters to bfloat16.
+    """
+    if precision == "fp32":
+        return model
+    if precision == "bf16":
+        return model.to(torch.bfloat16)
+    if precision == "int8":
+        with warnings.catch_warnings():
+            # torch.ao.quantization is deprecated in favour of torchao, which
+            # is not a dependency; the eager-mode API still works
+            warnings.simplefilter("ignore", DeprecationWarning)
+            return torch.ao.quantization.quantize_dynamic(
+                model, {nn.Linear}, dtype=torch.qint8, inplace=True
+            )
+    msg = f"Unsupported precision: {precision}"
+    raise ValueError(msg)
+
+
+def resolve_revision(model_id, revision=None):
+    """Commit sha a Hub revision points at.
+
+    Asks the Hub when it is reachable and otherwise reads the locally cached
+    snapshot, whose directory is named after the commit. Local directories and
+    revisions that cannot be resolved are returned unchanged.
+
+    Args:
+        model_id (str): Hub id or local directory
+        revision (str): Hub branch, tag or commit; None for the default branch
+    """
+    if Path(model_id).is_dir():
+        return revision
+    import huggingface_hub
+
+    try:
+        return huggingface_hub.model_info(model_id, revision=revision, timeout=10).sha
+    except Exception:
+        return _cached_revision(model_id, revision)
+
+
+def _cached_revision(model_id, revision):
+    """Commit of the locally cached snapshot of ``revision``, if there is one"""
+    import huggingface_hub
+
+    try:
+        snapshot = huggingface_hub.snapshot_download(
+            model_id, revision=revision, local_files_only=True
+        )
+    except Exception:
+        return revision
+    return Path(snapshot).name
+
+
+class QuantizedModelCache:
+    """On-disk cache of quantized models.
+
+    Quantizing a model means loading its fp32 weights first, so caching the
+    result lets later starts skip both. Entries are whole pickled modules and
+    are keyed by the model, the precision and the torch/transformers versions
+    that produced them, since the pickles are only loadable by compatible
+    versions. Hub revisions are resolved to the commit they point at, so a
+    moved branch or tag misses the cache; for local model directories the
+    weight files' sizes and modification times are part of the key instead.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, cls, model_id, revision, precision):
+        import transformers
+
+        parts = [
+            cls.__name__,
+            str(model_id),
+            str(resolve_revision(model_id, revision)),
+            precision,
+            torch.__version__,
+            transformers.__version__,
+        ]
+        model_dir = Path(model_id)
+        if model_dir.is_dir():
+            for path in sorted(model_dir.iterdir()):
+                stat = path.stat()
+                parts.append(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}")
+        return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+    def load(self, key):
+        path = self.cache_dir / f"{key}.pt"
+        if not path.exists():
+            return None
+        # Only ever loads files this class wrote to its own cache directory
+        return torch.load(path, weights_only=False)
+
+    def store(self, key, model):
+        path = self.cache_dir / f"{key}.pt"
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(model, f)
+            Path(tmp_path).replace(path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+
+def load_for_inference(cls, model_id, precision="fp32", cache_dir=None, revision=None):
+    """Load a pretrained model at ``precision`` for CPU inference.
+
+    fp32 and bf16 models come from the shared registry; bf16 weights are cast
+    while loading, so the fp32 checkpoint is never resident. int8 models are
+    read from ``cache_dir`` when it holds them, and otherwise loaded,
+    quantized and written there.
+
+    Args:
+        cls: transformers model class, e.g. WhisperForConditionalGeneration
+        model_id (str): Hub id or local directory
+        precision (str): "fp32", "bf16" or "int8"
+        cache_dir (str): Directory for quantized models
+        revision (str): Hub branch, tag or commit
+    """
+    if precision == "fp32":
+        return registry.model(cls, model_id, revision)
+    if precision == "bf16":
+        return registry.model(cls, model_id, revision, dtype=torch.bfloat16)
+    if precision not in PRECISIONS:
+        msg = f"Unsupported precision: {precision}"
+        raise ValueError(msg)
+
+    cache = key = None
+    if cache_dir is not None:
+        cache = QuantizedModelCache(cache_dir)
+        key = cache.key(cls, model_id, revision, precision)
+        model = cache.load(key)
+        if model is not None:
+            return model
+    # Load a private copy: quantization replaces its layers in place
+    model = cls.from_pretrained(model_id, revision=revision)
+    model.eval()
+    model = quantize_model(model, precision)
+    if cache is not None:
+        cache.store(key, model)
+    return model
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """Process-wide cache of pretrained models and processors.
+
+    ``from_pretrained`` deserialises the full checkpoint every time it is
+    called, so building a dataset, a model and an inference pipeline for the
+    same model id used to load it several times. The registry loads each
+    (class, model id, revision, dtype) once and hands out the same instance.
+    Weights come from safetensors files where the checkpoint has them, which
+    are memory-mapped rather than read into a buffer first.
+
+    Shared models are put in eval mode with gradients disabled and must be
+    treated as read-only. Models whose weights change, by training or
+    quantization, are loaded privately rather than through the registry.
+    The least recently used model is evicted once more than ``max_models``
+    are resident. Processors are small and never evicted.
+    """
+
+    def __init__(self, max_models=2):
+        """
+        Args:
+            max_models (int): Number of models kept resident at once
+        """
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._processors = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._processor_locks = {}
+        self.loads = 0
+
+    def model(self, cls, model_id, revision=None, dtype=None):
+        """Return the shared, read-only ``cls.from_pretrained(model_id)``.
+
+        Args:
+            cls: transformers model class, e.g. WhisperForConditionalGeneration
+            model_id (str): Hub id or local directory
+            revision (str): Hub branch, tag or commit
+            dtype (torch.dtype): Load the weights in this dtype
+        """
+        key = (cls, model_id, revision, dtype)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Load outside the registry lock so other models stay available, but
+        # hold a per-key lock so concurrent callers load a given model once
+        with key_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+            model = cls.from_pretrained(model_id, **_load_kwargs(revision, dtype))
+            model.eval()
+            model.requires_grad_(requires_grad=False)
+            with self._lock:
+                self.loads += 1
+                self._models[key] = model
+                while len(self._models) > self.max_models:
+                    evicted, _ = self._models.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+        return model
+
+    def processor(self, cls, model_id, revision=None):
+        """Return the shared ``cls.from_pretrained(model_id)`` processor"""
+        key = (cls, model_id, revision)
+        with self._lock:
+            if key in self._processors:
+                return self._processors[key]
+            key_lock = self._processor_locks.setdefault(key, threading.Lock())
+
+        # As in model: a slow download blocks only callers of this processor
+        with key_lock:
+            with self._lock:
+                if key in self._processors:
+                    return self._processors[key]
+            processor = cls.from_pretrained(model_id, revision=revision)
+            with self._lock:
+                self._processors[key] = processor
+                self._processor_locks.pop(key, None)
+        return processor
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._processors.clear()
+            self._key_locks.clear()
+            self._processor_locks.clear()
+
+
+def _load_kwargs(revision, dtype):
+    kwargs = {"revision": revision}
+    if dtype is not None:
+        kwargs["torch_dtype"] = dtype
+    return kwargs
+
+
+registry = ModelRegistry()
+
+
+def shared_processor(cls, model_id, revision=None):
+    """``registry.processor`` on the process-wide registry"""
+    return registry.processor(cls, model_id, revision)
@@ -0,0 +1,404 @@
+import asyncio
+import base64
+import collections
+import hashlib
+import io
+import json
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from harpertoken.audio import load_audio
+from harpertoken.streaming import Segmenter, stream_transcripts
+
+MAX_BODY_BYTES = 64 * 2**20
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+WEBSOCKET_CLOSE_NORMAL = 1000
+WEBSOCKET_CLOSE_TRY_AGAIN_LATER = 1013
+STATUS_TEXT = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class QueueFullError(Exception):
+    """Raised when the request queue is full and the server sheds load"""
+
+
+class Metrics:
+    """Counters plus sliding windows of recent batch sizes and latencies"""
+
+    def __init__(self, window=1000):
+        self.requests = 0
+        self.rejected = 0
+        self.batches = 0
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.latencies = collections.deque(maxlen=window)
+
+    def snapshot(self, queue_depth):
+        latencies = np.asarray(self.latencies, dtype=np.float64)
+        p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (0, 0)
+        return {
+            "queue_depth": queue_depth,
+            "requests_total": self.requests,
+            "rejected_total": self.rejected,
+            "batches_total": self.batches,
+            "mean_batch_size": float(np.mean(self.batch_sizes))
+            if self.batch_sizes
+            else 0.0,
+            "last_batch_size": self.batch_sizes[-1] if self.batch_sizes else 0,
+            "latency_p50_ms": float(p50) * 1000,
+            "latency_p99_ms": float(p99) * 1000,
+        }
+
+
+class MicroBatcher:
+    """Gather concurrent transcription requests into batched model calls.
+
+    The first waiting request opens a batch; others arriving within
+    ``max_wait_ms`` join it until ``max_batch_size`` is reached. Batches run
+    one at a time on a dedicated thread so the event loop keeps accepting
+    requests meanwhile. At most ``max_queue`` requests may wait; beyond that
+    ``submit`` raises :class:`QueueFullError` so clients back off instead of
+    piling up unbounded latency.
+    """
+
+    def __init__(
+        self, transcribe_batch, max_batch_size=8, max_wait_ms=10, max_queue=64
+    ):
+        """
+        Args:
+            transcribe_batch: Callable mapping a list of waveforms to texts
+            max_batch_size (int): Most requests per model call
+            max_wait_ms (float): How long a batch waits for more requests
+            max_queue (int): Most requests waiting for a batch
+        """
+        self.transcribe_batch = transcribe_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.metrics = Metrics()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, audio):
+        """Queue one waveform and wait for its transcription"""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((audio, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.metrics.rejected += 1
+            msg = "transcription queue is full"
+            raise QueueFullError(msg) from None
+        self.metrics.requests += 1
+        return await future
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+            # Requests whose client has gone away are not worth decoding
+            batch = [item for item in batch if not item[1].done()]
+            if batch:
+                await self._run_batch(batch)
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run_batch(self, batch):
+        self.metrics.batches += 1
+        self.metrics.batch_sizes.append(len(batch))
+        try:
+            texts = await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                self.transcribe_batch,
+                [audio for audio, _, _ in batch],
+            )
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        now = time.perf_counter()
+        for (_, future, submitted), text in zip(batch, texts):
+            self.metrics.latencies.append(now - submitted)
+            if not future.done():
+                future.set_result(text)
+
+
+def batch_transcriber(model, processor, sample_rate=16000, **generate_kwargs):
+    """Return a ``transcribe_batch(waveforms) -> texts`` function for Whisper"""
+    import torch
+
+    def transcribe_batch(waveforms):
+        inputs = processor(
+            waveforms,
+            sampling_rate=sample_rate,
+            return_attention_mask=True,
+            return_tensors="pt",
+        )
+        with torch.no_grad():
+            generated_ids = model.generate(
+                input_features=inputs.input_features.to(model.dtype),
+                attention_mask=inputs.attention_mask,
+                **generate_kwargs,
+            )
+        texts = processor.batch_decode(generated_ids, skip_special_tokens=True)
+        return [text.strip() for text in texts]
+
+    return transcribe_batch
+
+
+class TranscriptionServer:
+    """HTTP and WebSocket front end for a :class:`MicroBatcher`.
+
+    Endpoints:
+        POST /transcribe: body is an audio file; returns ``{"text", "duration"}``
+        GET /metrics: queue depth, batch sizes and p50/p99 latency as JSON
+        GET /health: liveness check
+        GET /ws: WebSocket; binary messages carry raw 16-bit mono PCM and a
+            text message ends the audio. The server answers with partial and
+            final hypotheses as JSON text messages, then closes; when the
+            queue is full it sends an ``{"error"}`` message and closes with
+            code 1013 (try again later)
+
+    Connections are kept alive between requests. The server only depends on
+    the standard library, so it runs wherever the model does.
+    """
+
+    def __init__(self, batcher, sample_rate=16000):
+        self.batcher = batcher
+        self.sample_rate = sample_rate
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.close()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    await self._websocket(reader, writer, headers)
+                    break
+                status, payload = await self._route(method, path, body)
+                _write_response(writer, status, payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except _BadRequestError as exc:
+            _write_response(writer, exc.status, {"error": str(exc)})
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/metrics":
+            return 200, self.batcher.metrics.snapshot(self.batcher.queue.qsize())
+        if method == "POST" and path == "/transcribe":
+            try:
+                audio = await asyncio.get_running_loop().run_in_executor(
+                    None, load_audio, io.BytesIO(body), self.sample_rate
+                )
+            except Exception as exc:
+                return 400, {"error": f"could not decode audio: {exc}"}
+            try:
+                text = await self.batcher.submit(audio)
+            except QueueFullError as exc:
+                return 503, {"error": str(exc)}
+            return 200, {"text": text, "duration": len(audio) / self.sample_rate}
+        return 404, {"error": f"no route for {method} {path}"}
+
+    async def _websocket(self, reader, writer, headers):
+        if "sec-websocket-key" not in headers:
+            raise _BadRequestError(400, "missing Sec-WebSocket-Key header")
+        accept = base64.b64encode(
+            hashlib.sha1(  # noqa: S324 - fixed by the WebSocket protocol
+                (headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()
+            ).digest()
+        ).decode()
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept.encode() + b"\r\n\r\n"
+        )
+        await writer.drain()
+
+        source = _WebSocketSource(reader, writer, self.sample_rate)
+        segmenter = Segmenter(self.sample_rate)
+        close_code = WEBSOCKET_CLOSE_NORMAL
+        try:
+            async for hypothesis in stream_transcripts(
+                source, self.batcher.submit, segmenter
+            ):
+                message = json.dumps(
+                    {
+                        "text": hypothesis.text,
+                        "start": hypothesis.start,
+                        "end": hypothesis.end,
+                        "final": hypothesis.final,
+                    }
+                )
+                writer.write(_websocket_frame(0x1, message.encode()))
+                await writer.drain()
+        except QueueFullError as exc:
+            # Tell the client why, then close so it retries later
+            message = json.dumps({"error": str(exc)})
+            writer.write(_websocket_frame(0x1, message.encode()))
+            close_code = WEBSOCKET_CLOSE_TRY_AGAIN_LATER
+        writer.write(_websocket_frame(0x8, struct.pack(">H", close_code)))
+        await writer.drain()
+
+
+class _BadRequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+async def _read_request(reader):
+    """Parse one HTTP/1.1 request; None when the client closed the connection"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as exc:
+        if exc.partial:
+            raise
+        return None
+    except asyncio.LimitOverrunError:
+        raise _BadRequestError(400, "request head too large") from None
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ")
+    except ValueError:
+        raise _BadRequestError(400, "malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise _BadRequestError(400, "invalid Content-Length header") from None
+    if length < 0:
+        raise _BadRequestError(400, "invalid Content-Length header")
+    if length > MAX_BODY_BYTES:
+        raise _BadRequestError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], headers, body
+
+
+def _write_response(writer, status, payload):
+    body = json.dumps(payload).encode()
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+
+
+def _websocket_frame(opcode, payload):
+    """An unmasked, unfragmented server-to-client frame"""
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 2**16:
+        header += bytes([126]) + struct.pack(">H", len(payload))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(payload))
+    return header + payload
+
+
+async def _read_websocket_frame(reader):
+    """Return ``(fin, opcode, payload)`` of one client frame, unmasked"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        (length,) = struct.unpack(">H", await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack(">Q", await reader.readexactly(8))
+    if length > MAX_BODY_BYTES:
+        raise _BadRequestError(413, f"frame larger than {MAX_BODY_BYTES} bytes")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = (
+            np.frombuffer(payload, dtype=np.uint8)
+            ^ np.resize(np.frombuffer(mask, dtype=np.uint8), length)
+        ).tobytes()
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+async def _read_websocket_message(reader, writer):
+    """Return ``(opcode, payload)`` of the next message, answering pings"""
+    message, message_opcode = b"", None
+    while True:
+        fin, opcode, payload = await _read_websocket_frame(reader)
+        if opcode == 0x9:  # ping
+            writer.write(_websocket_frame(0xA, payload))
+        elif opcode == 0x8:  # close
+            return opcode, payload
+        elif opcode != 0xA:  # data or continuation; pongs are ignored
+            message_opcode = message_opcode if opcode == 0x0 else opcode
+            message += payload
+            if fin:
+                return message_opcode, message
+
+
+class _WebSocketSource:
+    """Audio source for stream_transcripts fed by WebSocket binary messages"""
+
+    def __init__(self, reader, writer, sample_rate):
+        self.reader = reader
+        self.writer = writer
+        self.sample_rate = sample_rate
+
+    async def blocks(self):
+        while True:
+            try:
+                opcode, payload = await _read_websocket_message(
+                    self.reader, self.writer
+                )
+            except (asyncio.IncompleteReadError, _BadRequestError):
+                return
+            if opcode in (0x1, 0x8):
+                # A text message marks the end of the audio
+                return
+            if opcode == 0x2:
+                payload = payload[: len(payload) - len(payload) % 2]
+                yield np.frombuffer(payload, dtype="<i2").astype(np.float32) / 32768
@@ -0,0 +1,112 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from harpertoken.audio import load_audio
+
+STORE_DTYPES = ("int16", "float32")
+INT16_SCALE = 32767
+
+
+def pack_audio(sources, output_dir, sample_rate=16000, dtype="int16"):
+    """Decode a corpus once into a packed, memory-mappable audio store.
+
+    Every clip is decoded, down-mixed and resampled, then appended to one
+    contiguous ``audio.bin``; ``index.npy`` holds the ``(offset, length)``
+    of every clip in samples and ``meta.json`` its source path and
+    transcript. int16 halves the size of float32 at 16-bit PCM precision.
+
+    Args:
+        sources: Audio paths, or manifest entries (dicts with ``audio_path``
+            and an optional ``text``) as read_manifest yields them
+        output_dir (str): Created if missing
+        sample_rate (int): Sample rate clips are resampled to
+        dtype (str): "int16" or "float32" storage
+    Returns:
+        AudioStore over the packed corpus
+    """
+    if dtype not in STORE_DTYPES:
+        msg = f"dtype must be one of {STORE_DTYPES}, got {dtype!r}"
+        raise ValueError(msg)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    index, paths, texts = [], [], []
+    offset = 0
+    with (output_dir / "audio.bin").open("wb") as f:
+        for source in sources:
+            entry = source if isinstance(source, dict) else {"audio_path": source}
+            audio = load_audio(entry["audio_path"], sample_rate)
+            if dtype == "int16":
+                audio = np.clip(np.round(audio * INT16_SCALE), -32768, 32767)
+            f.write(audio.astype(dtype).tobytes())
+            index.append((offset, len(audio)))
+            offset += len(audio)
+            paths.append(str(entry["audio_path"]))
+            texts.append(entry.get("text"))
+    np.save(output_dir / "index.npy", np.asarray(index, dtype=np.int64).reshape(-1, 2))
+    # Written last, so a store interrupted while packing fails to open
+    meta = {"sample_rate": sample_rate, "dtype": dtype, "paths": paths, "texts": texts}
+    (output_dir / "meta.json").write_text(json.dumps(meta))
+    return AudioStore(output_dir)
+
+
+class AudioStore:
+    """Random access to the clips of a corpus packed by pack_audio.
+
+    Clips are slices of one read-only memory map, so indexing is O(1) and
+    copies nothing. The map is opened on first access in every process and
+    never pickled: DataLoader workers each map the file themselves and share
+    the OS page cache instead of holding private decoded copies.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Directory pack_audio wrote
+        """
+        self.path = Path(path)
+        meta = json.loads((self.path / "meta.json").read_text())
+        self.sample_rate = meta["sample_rate"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.paths = meta["paths"]
+        self.texts = meta["texts"]
+        self.index = np.load(self.path / "index.npy")
+        self._samples = None
+
+    @property
+    def samples(self):
+        """Every sample of the corpus as one read-only memory map"""
+        if self._samples is None:
+            total = int(self.index[:, 1].sum())
+            self._samples = (
+                np.memmap(self.path / "audio.bin", dtype=self.dtype, mode="r")
+                if total
+                else np.empty(0, dtype=self.dtype)
+            )
+        return self._samples
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, idx):
+        """Clip ``idx`` in the stored dtype, as a view into the memory map"""
+        offset, length = self.index[idx]
+        return self.samples[offset : offset + length]
+
+    def audio(self, idx):
+        """Clip ``idx`` as float32 in [-1, 1]; zero-copy for float32 stores"""
+        clip = self[idx]
+        if self.dtype == np.int16:
+            return clip.astype(np.float32) / INT16_SCALE
+        return clip
+
+    def durations(self):
+        """Duration of every clip in seconds, for duration-aware batching"""
+        return (self.index[:, 1] / self.sample_rate).tolist()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # A pickled memmap is a full in-memory copy; workers reopen it instead
+        state["_samples"] = None
+        return state
@@ -0,0 +1,336 @@
+import asyncio
+import dataclasses
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from harpertoken.audio import load_audio
+
+FRAME_SECONDS = 0.03  # voice activity is decided per frame of this length
+PADDING_SECONDS = 0.2  # audio kept from before a detected speech onset
+
+
+@dataclasses.dataclass
+class Hypothesis:
+    """A transcript of one speech segment.
+
+    Partial hypotheses cover the segment heard so far and are superseded by
+    later ones; the final hypothesis is emitted once the segment has ended.
+    """
+
+    text: str
+    start: float
+    end: float
+    final: bool
+
+
+class RingBuffer:
+    """Fixed-size float32 sample buffer shared between two threads.
+
+    The audio callback writes and the consumer reads. When the consumer falls
+    behind by more than ``capacity`` samples the oldest audio is overwritten
+    and counted in ``dropped`` rather than blocking the callback.
+    """
+
+    def __init__(self, capacity):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.start = 0
+        self.size = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if len(samples) > self.capacity:
+                self.dropped += len(samples) - self.capacity
+                samples = samples[-self.capacity :]
+            overflow = self.size + len(samples) - self.capacity
+            if overflow > 0:
+                self.start = (self.start + overflow) % self.capacity
+                self.size -= overflow
+                self.dropped += overflow
+            end = (self.start + self.size) % self.capacity
+            first = min(len(samples), self.capacity - end)
+            self.buffer[end : end + first] = samples[:first]
+            self.buffer[: len(samples) - first] = samples[first:]
+            self.size += len(samples)
+
+    def read(self):
+        """Remove and return everything buffered"""
+        with self._lock:
+            indices = (self.start + np.arange(self.size)) % self.capacity
+            samples = self.buffer[indices]
+            self.start, self.size = 0, 0
+        return samples
+
+
+class MicrophoneSource:
+    """Capture the default input device in small blocks via a callback.
+
+    PortAudio calls back on its own thread with every ``block_seconds`` of
+    audio; the block goes into a ring buffer and wakes the event loop, so
+    nothing waits for a fixed-length recording to finish.
+    """
+
+    def __init__(self, sample_rate=16000, block_seconds=0.1, buffer_seconds=30):
+        self.sample_rate = sample_rate
+        self.block_size = int(sample_rate * block_seconds)
+        self.ring = RingBuffer(int(sample_rate * buffer_seconds))
+
+    async def blocks(self):
+        try:
+            import sounddevice as sd  # Lazy import to avoid PortAudio at import time
+        except Exception as exc:
+            error_message = "sounddevice not available for recording"
+            raise OSError(error_message) from exc
+
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+
+        def callback(indata, _frames, _time, _status):
+            self.ring.write(indata[:, 0])
+            loop.call_soon_threadsafe(ready.set)
+
+        with sd.InputStream(
+            samplerate=self.sample_rate,
+            blocksize=self.block_size,
+            channels=1,
+            dtype="float32",
+            callback=callback,
+        ):
+            while True:
+                await ready.wait()
+                ready.clear()
+                yield self.ring.read()
+
+
+class FileSource:
+    """Stand-in for the microphone that streams a file or a pipe.
+
+    A path is decoded and resampled like any other audio file. ``"-"`` or a
+    binary file object is read as raw 16-bit mono PCM at ``sample_rate``, as
+    produced by e.g. ``arecord -t raw -f S16_LE`` or ``ffmpeg -f s16le``.
+    With ``realtime`` set, blocks are paced at the speed of the audio.
+    """
+
+    def __init__(self, source, sample_rate=16000, block_seconds=0.1, realtime=False):
+        self.source = source
+        self.sample_rate = sample_rate
+        self.block_size = int(sample_rate * block_seconds)
+        self.realtime = realtime
+
+    async def blocks(self):
+        loop = asyncio.get_running_loop()
+        if self.source == "-" or hasattr(self.source, "read"):
+            stream = sys.stdin.buffer if self.source == "-" else self.source
+            read_block = self._pcm_reader(stream)
+        else:
+            audio = await loop.run_in_executor(
+                None, load_audio, self.source, self.sample_rate
+            )
+            offsets = iter(range(0, len(audio), self.block_size))
+
+            def read_block():
+                offset = next(offsets, None)
+                return (
+                    None if offset is None else audio[offset : offset + self.block_size]
+                )
+
+        block_seconds = self.block_size / self.sample_rate
+        while True:
+            # Pipe reads block, so they run off the event loop
+            block = await loop.run_in_executor(None, read_block)
+            if block is None or len(block) == 0:
+                return
+            yield block
+            if self.realtime:
+                await asyncio.sleep(block_seconds)
+
+    def _pcm_reader(self, stream):
+        num_bytes = 2 * self.block_size
+
+        def read_block():
+            data = stream.read(num_bytes)
+            # Drop a trailing odd byte from a truncated stream
+            data = data[: len(data) - len(data) % 2]
+            return np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768
+
+        return read_block
+
+
+class Segmenter:
+    """Split a sample stream into speech segments with an energy VAD.
+
+    Audio is scored in ``FRAME_SECONDS`` frames; a frame is speech when its
+    RMS exceeds ``threshold``. A segment ends after ``min_silence`` seconds
+    of non-speech, or at ``max_segment`` seconds so one segment never exceeds
+    Whisper's 30 s window. While a segment is open, a partial event is
+    produced every ``partial_every`` seconds of new audio.
+    """
+
+    def __init__(
+        self,
+        sample_rate=16000,
+        threshold=0.01,
+        min_silence=0.5,
+        max_segment=30.0,
+        partial_every=1.0,
+    ):
+        """
+        Args:
+            sample_rate (int): Sample rate of the incoming audio
+            threshold (float): Frame RMS above which a frame counts as speech
+            min_silence (float): Silence that ends a segment, in seconds
+            max_segment (float): Longest segment, in seconds
+            partial_every (float): Audio between partial events; 0 disables them
+        """
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.frame_size = int(sample_rate * FRAME_SECONDS)
+        self.min_silence_frames = round(min_silence / FRAME_SECONDS)
+        self.max_segment = int(sample_rate * max_segment)
+        self.partial_every = int(sample_rate * partial_every)
+        self.padding = int(sample_rate * PADDING_SECONDS)
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.position = 0  # samples consumed from the stream so far
+        self.segment = []
+        self.segment_start = None
+        self.segment_size = 0
+        self.silent_frames = 0
+        self.last_partial = 0
+        self.history = np.zeros(0, dtype=np.float32)
+
+    def push(self, block):
+        """Feed samples; return a list of ``(final, start, audio)`` events"""
+        samples = np.concatenate([self.pending, block])
+        num_frames = len(samples) // self.frame_size
+        self.pending = samples[num_frames * self.frame_size :]
+        frames = samples[: num_frames * self.frame_size].reshape(
+            num_frames, self.frame_size
+        )
+        speech = np.sqrt(np.mean(frames**2, axis=1)) > self.threshold
+
+        events = []
+        for frame, is_speech in zip(frames, speech.tolist()):
+            events.extend(self._push_frame(frame, is_speech))
+            self.position += self.frame_size
+        return events
+
+    def flush(self):
+        """Close the open segment at the end of the stream"""
+        if self.segment_start is None:
+            return []
+        return [self._finish()]
+
+    def _push_frame(self, frame, is_speech):
+        if self.segment_start is None:
+            if not is_speech:
+                history = np.concatenate([self.history, frame])
+                self.history = history[-self.padding :]
+                return []
+            # Open a segment, keeping a little audio from before the onset
+            self.segment = [self.history]
+            self.segment_start = self.position - len(self.history)
+            self.segment_size = len(self.history)
+            self.silent_frames = 0
+            self.last_partial = 0
+            self.history = np.zeros(0, dtype=np.float32)
+
+        self.segment.append(frame)
+        self.segment_size += len(frame)
+        self.silent_frames = 0 if is_speech else self.silent_frames + 1
+        if (
+            self.silent_frames >= self.min_silence_frames
+            or self.segment_size >= self.max_segment
+        ):
+            return [self._finish()]
+        if self.partial_every and (
+            self.segment_size - self.last_partial >= self.partial_every
+        ):
+            self.last_partial = self.segment_size
+            return [(False, self.segment_start, np.concatenate(self.segment))]
+        return []
+
+    def _finish(self):
+        event = (True, self.segment_start, np.concatenate(self.segment))
+        self.segment = []
+        self.segment_start = None
+        self.segment_size = 0
+        return event
+
+
+async def stream_transcripts(source, transcribe, segmenter=None):
+    """Transcribe a live audio source incrementally.
+
+    Blocks from ``source`` are segmented by voice activity while a single
+    background thread runs ``transcribe(audio) -> str``, so capture never
+    waits for the model. Yields partial and final :class:`Hypothesis`
+    objects as they become available. When the model falls behind, partials
+    that a newer partial or the final already supersede are skipped; finals
+    are never dropped.
+
+    Args:
+        source: Object with an async ``blocks()`` generator of float32 arrays
+        transcribe: Callable turning a float32 waveform into text, or a
+            coroutine function doing so, e.g. a server's micro-batcher
+        segmenter (Segmenter): Voice activity segmentation settings
+    """
+    segmenter = segmenter or Segmenter(sample_rate=source.sample_rate)
+    sample_rate = segmenter.sample_rate
+    loop = asyncio.get_running_loop()
+    jobs = asyncio.Queue()
+
+    async def capture():
+        try:
+            async for block in source.blocks():
+                for event in segmenter.push(block):
+                    jobs.put_nowait(event)
+            for event in segmenter.flush():
+                jobs.put_nowait(event)
+        finally:
+            jobs.put_nowait(None)
+
+    capture_task = asyncio.ensure_future(capture())
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        while True:
+            job = await jobs.get()
+            if job is None:
+                break
+            final, start, audio = job
+            if not final and not jobs.empty():
+                continue
+            if asyncio.iscoroutinefunction(transcribe):
+                text = await transcribe(audio)
+            else:
+                text = await loop.run_in_executor(executor, transcribe, audio)
+            yield Hypothesis(
+                text=text.strip(),
+                start=start / sample_rate,
+                end=(start + len(audio)) / sample_rate,
+                final=final,
+            )
+        await capture_task
+    finally:
+        capture_task.cancel()
+        executor.shutdown(wait=False)
+
+
+def whisper_transcriber(model, processor, sample_rate=16000, **generate_kwargs):
+    """Return a ``transcribe(audio) -> str`` function for stream_transcripts"""
+    import torch
+
+    def transcribe(audio):
+        inputs = processor(audio, sampling_rate=sample_rate, return_tensors="pt")
+        with torch.no_grad():
+            generated_ids = model.generate(
+                input_features=inputs.input_features.to(model.dtype),
+                **generate_kwargs,
+            )
+        return processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+
+    return transcribe
@@ -1,68 +1,482 @@
+import contextlib
+import dataclasses
 import os
 import time
 from datetime import datetime
+from itertools import islice
+from pathlib import Path
 
 import torch
-from huggingface_hub import HfApi, login
 from torch.optim import AdamW, lr_scheduler
-from torch.utils.data import DataLoader
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    DistributedSampler,
+    IterableDataset,
+    SequentialSampler,
+)
 
-from harpertoken.dataset import LiveSpeechDataset
-from harpertoken.model import SpeechModel
+from harpertoken.batching import (
+    DistributedBatchSampler,
+    DurationBatchSampler,
+    ResumableBatchSampler,
+    SpeechCollator,
+)
+from harpertoken.checkpoint import CheckpointManager
+from harpertoken.distributed import (
+    barrier,
+    get_rank,
+    get_world_size,
+    is_main_process,
+    unwrap_model,
+    wrap_model,
+)
+from harpertoken.profiling import Profiler
 
 
-def train_model(model_type="whisper", num_epochs=10, initial_lr=1e-4):
-    # Initialize dataset
-    dataset = LiveSpeechDataset()
-    dataloader = DataLoader(dataset, batch_size=1, shuffle=False)
+@dataclasses.dataclass
+class TrainingConfig:
+    """Data loading and optimisation settings for train_model.
+
+    Args:
+        batch_size (int): Samples per batch when max_batch_seconds is unset
+        max_batch_seconds (float): Fill batches up to this much padded audio
+            instead of a fixed batch size. Whisper pads every clip to one
+            30 s window, so its batches hold ``max_batch_seconds // 30``
+            clips; the duration sort only saves padding for wav2vec2
+        num_workers (int): DataLoader worker processes
+        prefetch_factor (int): Batches each worker loads ahead
+        seed (int): Seed for batch shuffling
+        precision (str): "fp32", "bf16" (autocast on CPU or GPU) or "fp16"
+            (CUDA AMP with loss scaling)
+        grad_accum_steps (int): Micro-batches per optimizer step
+        max_grad_norm (float): Clip the gradient norm to this value if set
+        freeze_encoder (bool): Train only the decoder / transformer layers
+        checkpoint_dir (str): Write resumable checkpoints here if set
+        checkpoint_every (int): Optimizer steps between checkpoints; 0 saves
+            only at the end of each epoch
+        resume (bool): Continue from the latest checkpoint in checkpoint_dir
+        profile_path (str): Append per-step stage timings as JSON lines here;
+            under torch.distributed each rank writes ``<stem>.rank<N>``
+        trace_dir (str): Where torch.profiler traces are saved
+        trace_steps (int): Capture a torch.profiler trace of this many steps
+        audio_store (str): Train Whisper on this corpus packed by
+            harpertoken.store.pack_audio, with its transcripts as labels,
+            instead of a microphone recording
+        stream_source (str): Train Whisper on a corpus streamed from this
+            manifest or tar shard path/glob (StreamingSpeechDataset), with
+            its transcripts as labels, instead of a microphone recording
+        augment (bool): SpecAugment every batch, and speed perturb waveform
+            inputs, in the DataLoader workers; seeded by ``seed``. Whisper
+            trains on log-mel features, so it only gets SpecAugment
+        noise_dir (str): Also mix noise from this directory into waveform
+            inputs when augmenting; wav2vec2 only
+        push_to_hub (bool): Upload the fine-tuned model after saving it
+    """
+
+    batch_size: int = 1
+    max_batch_seconds: float = None
+    num_workers: int = 0
+    prefetch_factor: int = 2
+    seed: int = 0
+    precision: str = "fp32"
+    grad_accum_steps: int = 1
+    max_grad_norm: float = None
+    freeze_encoder: bool = False
+    checkpoint_dir: str = None
+    checkpoint_every: int = 0
+    resume: bool = False
+    profile_path: str = None
+    trace_dir: str = None
+    trace_steps: int = 0
+    audio_store: str = None
+    stream_source: str = None
+    augment: bool = False
+    noise_dir: str = None
+    push_to_hub: bool = True
+
+
+class TrainStep:
+    """Forward and backward pass for one micro-batch.
+
+    Runs the forward pass under autocast for reduced precision, scales the
+    loss by the accumulation factor and steps the optimizer (with optional
+    gradient clipping) once every ``grad_accum_steps`` micro-batches. The
+    forward, backward and optimizer stages are timed by ``profiler``.
+    """
+
+    def __init__(self, model, optimizer, config, profiler=None):
+        if config.precision not in ("fp32", "bf16", "fp16"):
+            msg = f"Unsupported precision: {config.precision}"
+            raise ValueError(msg)
+        self.model = model
+        self.optimizer = optimizer
+        self.config = config
+        self.profiler = profiler or Profiler()
+        self.device_type = next(model.parameters()).device.type
+        self.scaler = _grad_scaler(
+            self.device_type,
+            enabled=config.precision == "fp16" and self.device_type == "cuda",
+        )
+        self.pending = 0
+        self.steps = 0
+
+    def autocast(self):
+        if self.config.precision == "fp32":
+            return contextlib.nullcontext()
+        dtype = torch.bfloat16 if self.config.precision == "bf16" else torch.float16
+        return torch.autocast(device_type=self.device_type, dtype=dtype)
+
+    def __call__(self, inputs, labels):
+        """Accumulate gradients for one micro-batch and return its loss"""
+        # Under DDP, only the micro-batch that completes the window all-reduces
+        syncs = self.pending + 1 == self.config.grad_accum_steps
+        no_sync = getattr(self.model, "no_sync", None)
+        with contextlib.ExitStack() as stack:
+            if no_sync is not None and not syncs:
+                stack.enter_context(no_sync())
+            with self.profiler.stage("forward"), self.autocast():
+                outputs = self.model(inputs, labels=labels)
+            loss = outputs.loss
+            with self.profiler.stage("backward"):
+                self.scaler.scale(loss / self.config.grad_accum_steps).backward()
+        self.pending += 1
+        if self.pending == self.config.grad_accum_steps:
+            self.flush()
+        return loss.item()
+
+    def flush(self):
+        """Step the optimizer on whatever gradients have been accumulated"""
+        if self.pending == 0:
+            return
+        with self.profiler.stage("optimizer"):
+            if self.pending < self.config.grad_accum_steps:
+                self._complete_partial_window()
+            if self.config.max_grad_norm is not None:
+                self.scaler.unscale_(self.optimizer)
+                torch.nn.utils.clip_grad_norm_(
+                    self.model.parameters(), self.config.max_grad_norm
+                )
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+            self.optimizer.zero_grad(set_to_none=True)
+        self.pending = 0
+        self.steps += 1
+
+    def _complete_partial_window(self):
+        """Turn the gradients of a partial window into its mean gradient.
+
+        Every micro-batch loss was divided by ``grad_accum_steps``, which
+        under-weights a window cut short at the end of an epoch. Under DDP no
+        micro-batch of the window synchronised either, so the gradients are
+        averaged across ranks here.
+        """
+        scale = self.config.grad_accum_steps / self.pending
+        unsynced = getattr(self.model, "no_sync", None) is not None
+        for param in self.model.parameters():
+            if param.grad is None:
+                continue
+            if unsynced:
+                torch.distributed.all_reduce(param.grad)
+                param.grad /= get_world_size()
+            param.grad *= scale
+
+
+def log(*args):
+    """print() on the main process only, so ranks do not repeat each other"""
+    if is_main_process():
+        print(*args)
+
+
+def _grad_scaler(device_type, enabled):
+    if hasattr(torch.amp, "GradScaler"):  # torch >= 2.3
+        return torch.amp.GradScaler(device_type, enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def build_dataloader(dataset, config, tokenizer=None):
+    """Create the training DataLoader, with duration-aware batches if configured.
+
+    Under torch.distributed every rank gets a disjoint shard of the batches.
+    With a ``tokenizer``, transcripts of samples carrying ``text`` become
+    the batch's ``labels``. An IterableDataset, such as
+    StreamingSpeechDataset, splits the corpus itself and is batched by
+    ``batch_size`` without a sampler.
+    """
+    loader_kwargs = {
+        "collate_fn": SpeechCollator(tokenizer, augment=_batch_augment(config)),
+        "num_workers": config.num_workers,
+        "pin_memory": torch.cuda.is_available(),
+    }
+    if config.num_workers > 0:
+        loader_kwargs["prefetch_factor"] = config.prefetch_factor
+        loader_kwargs["persistent_workers"] = True
+    if isinstance(dataset, IterableDataset):
+        return _streaming_dataloader(dataset, config, loader_kwargs)
+    if config.max_batch_seconds is not None:
+        sampler = DurationBatchSampler(
+            _padded_durations(dataset), config.max_batch_seconds, seed=config.seed
+        )
+        if get_world_size() > 1:
+            sampler = DistributedBatchSampler(sampler, get_world_size(), get_rank())
+    else:
+        if get_world_size() > 1:
+            sampler = DistributedSampler(
+                dataset, get_world_size(), get_rank(), shuffle=False
+            )
+        else:
+            sampler = SequentialSampler(dataset)
+        sampler = BatchSampler(sampler, config.batch_size, drop_last=False)
+    return DataLoader(
+        dataset, batch_sampler=ResumableBatchSampler(sampler), **loader_kwargs
+    )
+
+
+def _padded_durations(dataset):
+    """Seconds of audio every sample costs once the processor has padded it"""
+    durations = dataset.durations()
+    if getattr(dataset, "model_type", None) == "whisper":
+        from harpertoken.longform import CHUNK_SECONDS
+
+        # The feature extractor pads or truncates every clip to one window
+        return [CHUNK_SECONDS] * len(durations)
+    return durations
+
+
+def _streaming_dataloader(dataset, config, loader_kwargs):
+    if config.max_batch_seconds is not None:
+        msg = "max_batch_seconds needs a map-style dataset; streams use batch_size"
+        raise ValueError(msg)
+    if hasattr(dataset, "world_size"):
+        # Streams are split in the DataLoader workers, which need not share
+        # this process's torch.distributed state
+        dataset.rank, dataset.world_size = get_rank(), get_world_size()
+    return DataLoader(dataset, batch_size=config.batch_size, **loader_kwargs)
+
+
+def _epoch_batches(dataloader, epoch, skip):
+    """The batches of ``epoch``, minus the first ``skip`` already trained on"""
+    sampler = dataloader.batch_sampler
+    if isinstance(sampler, ResumableBatchSampler):
+        sampler.set_epoch(epoch)
+        sampler.skip = skip
+        return dataloader
+    # A stream cannot seek, so its first batches are read and dropped
+    return islice(dataloader, skip, None)
+
+
+def _batch_augment(config):
+    if not config.augment:
+        return None
+    from harpertoken.augment import SPEED_FACTORS, BatchAugment, NoiseBank, SpecAugment
+
+    return BatchAugment(
+        spec_augment=SpecAugment(),
+        speed_factors=SPEED_FACTORS,
+        noise=NoiseBank(config.noise_dir) if config.noise_dir else None,
+        seed=config.seed,
+    )
+
+
+def _check_config(model_type, config):
+    """Reject settings that would otherwise be ignored, before any work"""
+    if config.resume and config.checkpoint_dir is None:
+        msg = "resume requires checkpoint_dir"
+        raise ValueError(msg)
+    # Waveform augmentation runs on the padded batch, after feature extraction
+    if config.noise_dir is not None and model_type != "wav2vec2":
+        msg = f"noise_dir needs waveform inputs, but {model_type} trains on features"
+        raise ValueError(msg)
+
+
+def _open_profiler(config):
+    """Profiler for the training loop, disabled unless profile_path is set"""
+    output = config.profile_path
+    if output is not None and output != "-" and get_world_size() > 1:
+        path = Path(output)
+        output = path.with_name(f"{path.stem}.rank{get_rank()}{path.suffix}")
+    profiler = Profiler(
+        output,
+        trace_dir=config.trace_dir,
+        trace_steps=config.trace_steps,
+        synchronize=torch.cuda.is_available(),
+    )
+    profiler.fields["rank"] = get_rank()
+    return profiler
+
+
+def _open_checkpoints(config, stateful):
+    """Return the CheckpointManager, if any, and the progress to start from"""
+    progress = {
+        "epoch": 0,
+        "batch": 0,
+        "step": 0,
+        "epoch_loss": 0.0,
+        "num_samples": 0,
+        "epoch_time": 0.0,
+        "training_log": {"loss": [], "learning_rate": [], "epoch_times": []},
+    }
+    if config.checkpoint_dir is None:
+        return None, progress
+    checkpoints = CheckpointManager(config.checkpoint_dir)
+    restored = checkpoints.restore(stateful) if config.resume else None
+    if restored is not None:
+        progress = restored
+        log(f"Resumed from epoch {progress['epoch'] + 1}, batch {progress['batch']}")
+    return checkpoints, progress
+
+
+def _save_checkpoint(checkpoints, train_step, stateful, progress):
+    progress["step"] = train_step.steps
+    # Every rank holds the same weights; rank 0 writes them
+    if checkpoints is not None and is_main_process():
+        checkpoints.save(train_step.steps, stateful, progress)
+
+
+def _checkpoint_due(config, train_step):
+    """True right after every ``checkpoint_every``-th optimizer step"""
+    return (
+        config.checkpoint_every > 0
+        and train_step.pending == 0
+        and train_step.steps % config.checkpoint_every == 0
+    )
+
+
+def _batch_labels(batch, inputs):
+    """Padded labels from the collator, else dummy labels"""
+    labels = batch.get("labels")
+    if labels is None:
+        labels = torch.zeros((inputs.shape[0], 1), dtype=torch.long)
+    return labels
+
+
+def _training_dataset(model_type, cache_dir, config):
+    # transformers is only needed once training actually starts
+    from harpertoken.dataset import (
+        LiveSpeechDataset,
+        PackedSpeechDataset,
+        StreamingSpeechDataset,
+    )
+    from harpertoken.store import AudioStore
+
+    corpora = [c for c in (config.audio_store, config.stream_source) if c is not None]
+    if not corpora:
+        # With a cache_dir, features are extracted once and read back from
+        # disk in later epochs
+        return LiveSpeechDataset(model_type=model_type, cache_dir=cache_dir)
+    if len(corpora) > 1:
+        msg = "Set either audio_store or stream_source, not both"
+        raise ValueError(msg)
+    if model_type != "whisper":
+        msg = "Corpus training supports whisper only"
+        raise ValueError(msg)
+    if config.stream_source is not None:
+        return StreamingSpeechDataset(config.stream_source, model_type)
+    store = AudioStore(config.audio_store)
+    missing = sum(text is None for text in store.texts)
+    if missing:
+        msg = f"{missing} clips in {config.audio_store} have no transcript"
+        raise ValueError(msg)
+    return PackedSpeechDataset(store, model_type)
+
+
+def train_model(  # noqa: PLR0913
+    model_type="whisper",
+    num_epochs=10,
+    initial_lr=1e-4,
+    cache_dir=None,
+    config=None,
+    *,
+    dataset=None,
+    model=None,
+):
+    """Fine-tune a speech model.
+
+    ``dataset`` and ``model`` replace the dataset chosen by ``config`` and
+    the pretrained SpeechModel, e.g. to train offline in tests. Transcripts
+    of samples carrying ``text`` are tokenized with the dataset processor's
+    tokenizer into the labels.
+    """
+    from harpertoken.model import SpeechModel
+
+    config = config or TrainingConfig()
+    _check_config(model_type, config)
+    if dataset is None:
+        dataset = _training_dataset(model_type, cache_dir, config)
+    tokenizer = getattr(getattr(dataset, "processor", None), "tokenizer", None)
+    dataloader = build_dataloader(dataset, config, tokenizer)
 
     # Initialize model
-    model = SpeechModel(model_type=model_type)
-    optimizer = AdamW(model.parameters(), lr=initial_lr)
+    if model is None:
+        model = SpeechModel(model_type=model_type)
+    if config.freeze_encoder:
+        model.freeze_encoder()
+    # DistributedDataParallel when launched with several processes
+    model = wrap_model(model)
+    # Frozen parameters get no optimizer state
+    trainable = [p for p in model.parameters() if p.requires_grad]
+    optimizer = AdamW(trainable, lr=initial_lr)
     scheduler = lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.1)
+    profiler = _open_profiler(config)
+    train_step = TrainStep(model, optimizer, config, profiler)
 
     # Create models directory if it doesn't exist
     os.makedirs("models", exist_ok=True)
 
-    # Training metrics
-    training_log = {"loss": [], "learning_rate": [], "epoch_times": []}
+    # Everything a checkpoint saves, plus the epoch/batch position and metrics
+    stateful = {
+        "model": unwrap_model(model),
+        "optimizer": optimizer,
+        "scheduler": scheduler,
+        "scaler": train_step.scaler,
+    }
+    checkpoints, progress = _open_checkpoints(config, stateful)
+    training_log = progress["training_log"]
+    train_step.steps = progress["step"]
 
     # Fine-tuning process
     model.train()
-    print(f"Starting Speech Recognition AI Fine Tune with {model_type}...")
-    print(f"Initial learning rate: {initial_lr}, Epochs: {num_epochs}")
-    print("Press Ctrl+C to stop training")
+    log(f"Starting Speech Recognition AI Fine Tune with {model_type}...")
+    log(f"Initial learning rate: {initial_lr}, Epochs: {num_epochs}")
+    log("Press Ctrl+C to stop training")
 
     try:
-        for epoch in range(num_epochs):
-            epoch_start = time.time()
-            epoch_loss = 0
-            num_batches = 0
+        for epoch in range(progress["epoch"], num_epochs):
+            progress["epoch"] = epoch
+            epoch_start = time.time() - progress["epoch_time"]
+            # Skip the batches a resumed checkpoint already trained on
+            batches = _epoch_batches(dataloader, epoch, progress["batch"])
 
-            for batch in dataloader:
-                optimizer.zero_grad()
-                inputs = batch["input_features"]
+            # Time spent waiting on the DataLoader is the "data" stage
+            for batch in profiler.timed(batches, "data"):
+                # Whisper trains on log-mel features, wav2vec2 on waveforms
+                key = "input_features" if "input_features" in batch else "input_values"
+                inputs = batch[key]
+                labels = _batch_labels(batch, inputs)
 
-                # Create dummy labels for training
-                labels = torch.zeros((1, 1), dtype=torch.long)
+                # Forward and backward pass; steps the optimizer every
+                # grad_accum_steps micro-batches
+                loss = train_step(inputs, labels)
+                progress["epoch_loss"] += loss
+                progress["batch"] += 1
+                progress["num_samples"] += inputs.shape[0]
+                profiler.count("samples", inputs.shape[0])
+                profiler.step(epoch=epoch, loss=loss)
 
-                # Forward pass
-                outputs = model(inputs, labels=labels)
-                loss = outputs.loss
-                epoch_loss += loss.item()
-                num_batches += 1
+                log(f"Epoch [{epoch + 1}/{num_epochs}], Loss: {loss:.4f}")
 
-                # Backward pass and optimization
-                loss.backward()
-                optimizer.step()
+                if _checkpoint_due(config, train_step):
+                    progress["epoch_time"] = time.time() - epoch_start
+                    _save_checkpoint(checkpoints, train_step, stateful, progress)
 
-                print(f"Epoch [{epoch + 1}/{num_epochs}], Loss: {loss.item():.4f}")
+            # Apply gradients left over from a partial accumulation window
+            train_step.flush()
 
             # Update scheduler
             scheduler.step()
 
             # Calculate epoch metrics
-            avg_loss = epoch_loss / num_batches
+            avg_loss = progress["epoch_loss"] / max(progress["batch"], 1)
             current_lr = optimizer.param_groups[0]["lr"]
             epoch_time = time.time() - epoch_start
 
@@ -70,13 +484,39 @@ def train_model(model_type="whisper", num_epochs=10, initial_lr=1e-4):
             training_log["learning_rate"].append(current_lr)
             training_log["epoch_times"].append(epoch_time)
 
-            print(f"Epoch [{epoch + 1}/{num_epochs}] completed")
-            print(f"Average Loss: {avg_loss:.4f}")
-            print(f"Learning Rate: {current_lr:.2e}")
-            print(f"Epoch Time: {epoch_time:.2f} seconds\n")
+            log(f"Epoch [{epoch + 1}/{num_epochs}] completed")
+            log(f"Average Loss: {avg_loss:.4f}")
+            log(f"Learning Rate: {current_lr:.2e}")
+            log(f"Epoch Time: {epoch_time:.2f} seconds")
+            # Every rank processes its own shard of the data
+            throughput = progress["num_samples"] * get_world_size() / epoch_time
+            log(f"Throughput: {throughput:.2f} samples/sec\n")
+            profiler.summary(epoch=epoch, loss=avg_loss)
+
+            progress.update(
+                epoch=epoch + 1, batch=0, epoch_loss=0.0, num_samples=0, epoch_time=0.0
+            )
+            _save_checkpoint(checkpoints, train_step, stateful, progress)
 
     except KeyboardInterrupt:
-        print("\nTraining stopped by user")
+        log("\nTraining stopped by user")
+    finally:
+        profiler.close()
+        if checkpoints is not None:
+            checkpoints.close()
+
+    # Only rank 0 saves the final model and uploads
+    barrier()
+    if not is_main_process():
+        return
+    save_and_upload(
+        unwrap_model(model), model_type, training_log, push_to_hub=config.push_to_hub
+    )
+
+
+def save_and_upload(model, model_type, training_log, push_to_hub=True):
+    """Save the fine-tuned model with its training log and push it to the Hub"""
+    from huggingface_hub import HfApi, login
 
     # Save fine-tuned model
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -90,6 +530,8 @@ def train_model(model_type="whisper", num_epochs=10, initial_lr=1e-4):
     print("Training metrics:")
     print(f"Final Loss: {training_log['loss'][-1]:.4f}")
     print(f"Final Learning Rate: {training_log['learning_rate'][-1]:.2e}")
+    if not push_to_hub:
+        return
 
     # Upload to Hugging Face Hub
     try:
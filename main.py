@@ -1,7 +1,5 @@
 import argparse
 
-from harpertoken.train import train_model
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -10,6 +8,145 @@ if __name__ == "__main__":
         default="whisper",
         help="Model type to use (whisper or wav2vec2)",
     )
+    parser.add_argument(
+        "--feature_cache_dir",
+        type=str,
+        default=None,
+        help="Cache processed features here so later epochs skip extraction",
+    )
+    parser.add_argument(
+        "--audio_store",
+        type=str,
+        default=None,
+        help="Train Whisper on a transcribed corpus packed by scripts.pack_audio "
+        "instead of recording",
+    )
+    parser.add_argument(
+        "--stream_source",
+        type=str,
+        default=None,
+        help="Train Whisper on a transcribed corpus streamed from a manifest or "
+        "tar shards (path or glob) instead of recording",
+    )
+    parser.add_argument(
+        "--augment",
+        action="store_true",
+        help="SpecAugment batches; speed perturb (and with --noise_dir, add "
+        "noise to) waveform inputs",
+    )
+    parser.add_argument(
+        "--noise_dir",
+        type=str,
+        default=None,
+        help="Directory of noise recordings mixed into wav2vec2 waveforms by --augment",
+    )
+    parser.add_argument(
+        "--no_push_to_hub",
+        action="store_true",
+        help="Save the fine-tuned model locally without uploading it",
+    )
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument(
+        "--max_batch_seconds",
+        type=float,
+        default=None,
+        help="Fill batches up to this many seconds of padded audio; Whisper "
+        "pads every clip to 30 s",
+    )
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--prefetch_factor", type=int, default=2)
+    parser.add_argument(
+        "--precision",
+        choices=["fp32", "bf16", "fp16"],
+        default="fp32",
+        help="bf16 autocasts on CPU or GPU; fp16 uses CUDA AMP",
+    )
+    parser.add_argument("--grad_accum_steps", type=int, default=1)
+    parser.add_argument("--max_grad_norm", type=float, default=None)
+    parser.add_argument(
+        "--freeze_encoder",
+        action="store_true",
+        help="Freeze the Whisper encoder / wav2vec2 feature encoder",
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        type=str,
+        default=None,
+        help="Write resumable training checkpoints to this directory",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        default=0,
+        help="Optimizer steps between checkpoints (0: end of each epoch only)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume from the latest checkpoint in --checkpoint_dir",
+    )
+    parser.add_argument(
+        "--profile_path",
+        type=str,
+        default=None,
+        help="Append per-step stage timings and data-wait ratio as JSON lines",
+    )
+    parser.add_argument(
+        "--trace_dir",
+        type=str,
+        default=None,
+        help="Directory for torch.profiler traces (with --trace_steps)",
+    )
+    parser.add_argument(
+        "--trace_steps",
+        type=int,
+        default=0,
+        help="Capture a torch.profiler trace of this many training steps",
+    )
+    parser.add_argument(
+        "--nproc_per_node",
+        type=int,
+        default=1,
+        help="Train with this many DistributedDataParallel processes (gloo, CPU)",
+    )
     args = parser.parse_args()
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume requires --checkpoint_dir")
+    if args.noise_dir is not None and args.model_type != "wav2vec2":
+        parser.error("--noise_dir needs wav2vec2, whisper trains on features")
 
-    train_model(model_type=args.model_type)
+    # Imported after parsing so --help and argument errors return at once
+    # instead of waiting for torch to load
+    from harpertoken.distributed import launch
+    from harpertoken.train import TrainingConfig, train_model
+
+    config = TrainingConfig(
+        batch_size=args.batch_size,
+        max_batch_seconds=args.max_batch_seconds,
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch_factor,
+        precision=args.precision,
+        grad_accum_steps=args.grad_accum_steps,
+        max_grad_norm=args.max_grad_norm,
+        freeze_encoder=args.freeze_encoder,
+        checkpoint_dir=args.checkpoint_dir,
+        checkpoint_every=args.checkpoint_every,
+        resume=args.resume,
+        profile_path=args.profile_path,
+        trace_dir=args.trace_dir,
+        trace_steps=args.trace_steps,
+        audio_store=args.audio_store,
+        stream_source=args.stream_source,
+        augment=args.augment,
+        noise_dir=args.noise_dir,
+        push_to_hub=not args.no_push_to_hub,
+    )
+    train_kwargs = {
+        "model_type": args.model_type,
+        "cache_dir": args.feature_cache_dir,
+        "config": config,
+    }
+    if args.nproc_per_node > 1:
+        launch(train_model, args.nproc_per_node, **train_kwargs)
+    else:
+        train_model(**train_kwargs)
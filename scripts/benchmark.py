@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Reproducible offline benchmark suite.
+
+Runs SpeechModel forward/generate, generate on the exported TorchScript
+graphs, feature extraction, edit distance, the training step and training
+augmentation on synthetic audio with tiny, locally constructed model
+configs, so no network access or downloaded weights are needed. Every
+benchmark runs in a fresh process so its peak RSS is its own. Results are
+written as JSON and can be compared against a stored baseline, in which
+case the exit status is 1 when any benchmark regressed beyond the
+tolerance.
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+DEFAULT_BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+# Run settings that change the numbers; a baseline must match them
+COMPARED_SETTINGS = ("quick", "threads")
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register ``fn(quick)`` as a benchmark.
+
+    ``fn`` does its setup and returns ``(step, samples, audio_seconds)``:
+    a zero-argument callable timed once per iteration, the samples it
+    processes per call and the seconds of audio they hold (0 if not audio).
+    """
+
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+def synthetic_audio(num_clips, seconds, seed=0):
+    """Tones plus noise, deterministic for a given seed"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return [
+        (
+            0.3 * np.sin(2 * np.pi * rng.uniform(100, 1000) * t)
+            + 0.05 * rng.standard_normal(len(t))
+        ).astype(np.float32)
+        for _ in range(num_clips)
+    ]
+
+
+def tiny_config(model_type):
+    """A few-layer config of the real architecture, built without downloads"""
+    if model_type == "whisper":
+        from transformers import WhisperConfig
+
+        return WhisperConfig(
+            d_model=64,
+            encoder_layers=2,
+            decoder_layers=2,
+            encoder_attention_heads=2,
+            decoder_attention_heads=2,
+            encoder_ffn_dim=128,
+            decoder_ffn_dim=128,
+            max_target_positions=64,
+        )
+    from transformers import Wav2Vec2Config
+
+    return Wav2Vec2Config(
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=128,
+        conv_dim=(32,) * 7,
+        num_conv_pos_embeddings=16,
+    )
+
+
+def _tiny_model(model_type):
+    import torch
+
+    from harpertoken.model import SpeechModel
+
+    torch.manual_seed(0)
+    return SpeechModel(model_type, config=tiny_config(model_type))
+
+
+@benchmark("whisper_forward")
+def bench_whisper_forward(quick):
+    import torch
+
+    model = _tiny_model("whisper").eval()
+    batch = 2 if quick else 4
+    features = torch.randn(batch, 80, 3000)
+    labels = torch.zeros(batch, 8, dtype=torch.long)
+
+    def step():
+        with torch.no_grad():
+            model(features, labels=labels)
+
+    return step, batch, batch * 30.0
+
+
+@benchmark("whisper_generate")
+def bench_whisper_generate(quick):
+    import torch
+
+    model = _tiny_model("whisper").eval()
+    batch, tokens = (2, 4) if quick else (4, 16)
+    features = torch.randn(batch, 80, 3000)
+
+    def step():
+        with torch.no_grad():
+            # A fixed number of tokens, so random weights hitting EOS early
+            # do not change the amount of work
+            model.generate(
+                input_features=features,
+                attention_mask=torch.ones(batch, 3000, dtype=torch.long),
+                max_new_tokens=tokens,
+                min_new_tokens=tokens,
+            )
+
+    return step, batch, batch * 30.0
+
+
+@benchmark("whisper_generate_torchscript")
+def bench_whisper_generate_torchscript(quick):
+    """whisper_generate on the exported TorchScript graphs"""
+    import tempfile
+
+    import torch
+
+    from harpertoken.export import ExportedWhisper, export_whisper
+
+    model = _tiny_model("whisper").model.eval()
+    with tempfile.TemporaryDirectory() as output_dir:
+        exported = ExportedWhisper.from_pretrained(export_whisper(model, output_dir))
+    batch, tokens = (2, 4) if quick else (4, 16)
+    features = torch.randn(batch, 80, 3000)
+
+    def step():
+        exported.generate(features, max_new_tokens=tokens, min_new_tokens=tokens)
+
+    return step, batch, batch * 30.0
+
+
+@benchmark("wav2vec2_forward")
+def bench_wav2vec2_forward(quick):
+    import torch
+
+    model = _tiny_model("wav2vec2").eval()
+    batch, seconds = (2, 2.0) if quick else (4, 5.0)
+    values = torch.from_numpy(np.stack(synthetic_audio(batch, seconds)))
+
+    def step():
+        with torch.no_grad():
+            model(values)
+
+    return step, batch, batch * seconds
+
+
+@benchmark("whisper_features")
+def bench_whisper_features(quick):
+    from transformers import WhisperFeatureExtractor
+
+    extractor = WhisperFeatureExtractor()
+    clips = synthetic_audio(4 if quick else 16, 10.0)
+
+    def step():
+        extractor(clips, sampling_rate=SAMPLE_RATE, return_tensors="pt")
+
+    return step, len(clips), 10.0 * len(clips)
+
+
+@benchmark("mel_batch")
+def bench_mel_batch(quick):
+    from harpertoken.preprocessing import AudioPreprocessor
+
+    preprocessor = AudioPreprocessor(normalize=True)
+    clips = synthetic_audio(4 if quick else 16, 10.0)
+
+    def step():
+        # Half the clips arrive at 8 kHz and go through the resampler
+        preprocessor.process_batch(
+            [clip[::2] if i % 2 else clip for i, clip in enumerate(clips)],
+            sample_rate=[8000 if i % 2 else SAMPLE_RATE for i in range(len(clips))],
+        )
+
+    return step, len(clips), 10.0 * len(clips)
+
+
+@benchmark("edit_distance")
+def bench_edit_distance(quick):
+    from harpertoken.evaluate import edit_distances
+    from scripts.benchmark_edit_distance import make_corpus
+
+    predictions, references = make_corpus(200 if quick else 2000, 200)
+
+    def step():
+        edit_distances(predictions, references)
+
+    return step, len(predictions), 0.0
+
+
+@benchmark("train_step")
+def bench_train_step(quick):
+    import torch
+
+    from harpertoken.train import TrainingConfig, TrainStep
+
+    model = _tiny_model("whisper").train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    train_step = TrainStep(model, optimizer, TrainingConfig())
+    batch = 2 if quick else 4
+    features = torch.randn(batch, 80, 3000)
+    labels = torch.randint(0, 1000, (batch, 16))
+
+    def step():
+        train_step(features, labels)
+
+    return step, batch, batch * 30.0
+
+
+@benchmark("augment_batch")
+def bench_augment_batch(quick):
+    """SpecAugment of a train_step-sized batch plus waveform augmentation"""
+    import tempfile
+
+    import soundfile as sf
+    import torch
+
+    from harpertoken.augment import SPEED_FACTORS, BatchAugment, NoiseBank, SpecAugment
+
+    batch = 2 if quick else 4
+    features = torch.randn(batch, 80, 3000)
+    waveforms = torch.from_numpy(np.stack(synthetic_audio(batch, 10.0)))
+    lengths = torch.full((batch,), waveforms.shape[-1])
+    with tempfile.TemporaryDirectory() as noise_dir:
+        sf.write(f"{noise_dir}/noise.wav", synthetic_audio(1, 5.0, seed=1)[0], 16000)
+        noise = NoiseBank(noise_dir, prob=1.0)
+    augment = BatchAugment(SpecAugment(), SPEED_FACTORS, noise)
+
+    def step():
+        augment.features(features)
+        augment.waveforms(waveforms, lengths)
+
+    return step, batch, batch * 10.0
+
+
+def run_benchmark(name, quick, iterations, threads):
+    """Time one benchmark in the current process and summarise it"""
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.manual_seed(0)
+    step, samples, audio_seconds = BENCHMARKS[name](quick)
+    step()  # warm-up: lazy initialisation, allocator growth
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        step()
+        latencies.append(time.perf_counter() - start)
+    latencies = np.asarray(latencies)
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {
+        "samples_per_sec": samples / latencies.mean(),
+        "rtf": latencies.mean() / audio_seconds if audio_seconds else None,
+        "latency_p50_ms": p50 * 1000,
+        "latency_p95_ms": p95 * 1000,
+        "peak_rss_mb": peak_rss_mb(),
+        "iterations": iterations,
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def compare(results, baseline, tolerance, meta=None):
+    """Return a list of human-readable regressions against ``baseline``.
+
+    With the ``meta`` of the current run, raises ValueError when the
+    baseline ran with different COMPARED_SETTINGS, whose numbers are not
+    comparable.
+    """
+    if meta is not None:
+        check_settings(meta, baseline)
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        checks = [
+            ("samples_per_sec", -1),  # lower is worse
+            ("latency_p95_ms", 1),
+            ("peak_rss_mb", 1),
+        ]
+        for metric, sign in checks:
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if sign * change > tolerance:
+                regressions.append(
+                    f"{name}.{metric}: {old:.2f} -> {new:.2f} ({change:+.0%})"
+                )
+    return regressions
+
+
+def check_settings(meta, baseline):
+    """Raise ValueError unless ``baseline`` ran with the settings in ``meta``"""
+    reference = baseline.get("meta", {})
+    differing = [
+        f"{setting}={reference[setting]!r} (this run {meta.get(setting)!r})"
+        for setting in COMPARED_SETTINGS
+        if setting in reference and reference[setting] != meta.get(setting)
+    ]
+    if differing:
+        msg = f"Baseline ran with {', '.join(differing)}; use the same settings"
+        raise ValueError(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--only", nargs="+", choices=sorted(BENCHMARKS), help="Run these only"
+    )
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument(
+        "--quick", action="store_true", help="Smaller inputs, for smoke tests"
+    )
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument(
+        "--baseline",
+        nargs="?",
+        const=str(DEFAULT_BASELINE),
+        help=f"Compare against this results file (default {DEFAULT_BASELINE.name})",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative change treated as a regression",
+    )
+    args = parser.parse_args()
+    settings = {"threads": args.threads, "quick": args.quick}
+    baseline = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        # Refuse before spending minutes on numbers that cannot be compared
+        try:
+            check_settings(settings, baseline)
+        except ValueError as exc:
+            parser.error(str(exc))
+
+    names = args.only or list(BENCHMARKS)
+    results = {}
+    # spawn, so each benchmark starts from a clean process and peak RSS
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[name] = pool.submit(
+                run_benchmark, name, args.quick, args.iterations, args.threads
+            ).result()
+        result = results[name]
+        rtf = f"{result['rtf']:.4f}" if result["rtf"] is not None else "-"
+        print(
+            f"{name:>28}: {result['samples_per_sec']:9.2f} samples/s  "
+            f"RTF {rtf:>7}  p50 {result['latency_p50_ms']:8.2f} ms  "
+            f"p95 {result['latency_p95_ms']:8.2f} ms  "
+            f"RSS {result['peak_rss_mb'] or 0:7.1f} MB",
+            file=sys.stderr,
+        )
+
+    import torch
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            **settings,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance, report["meta"])
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
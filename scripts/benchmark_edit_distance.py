@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark harpertoken.evaluate.edit_distance against the original
+list-of-lists dynamic-programming implementation.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from harpertoken.evaluate import calculate_cer, edit_distance, edit_distances
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz "
+
+
+def reference_edit_distance(prediction, reference):
+    """The full-table DP that edit_distance replaced, kept as a baseline"""
+    m = len(prediction) + 1
+    n = len(reference) + 1
+    dp = [[0] * n for _ in range(m)]
+    for i in range(m):
+        dp[i][0] = i
+    for j in range(n):
+        dp[0][j] = j
+    for i in range(1, m):
+        for j in range(1, n):
+            cost = 0 if prediction[i - 1] == reference[j - 1] else 1
+            dp[i][j] = min(dp[i - 1][j] + 1, dp[i][j - 1] + 1, dp[i - 1][j - 1] + cost)
+    return dp[m - 1][n - 1]
+
+
+def make_corpus(num_pairs, length, error_rate=0.1, seed=0):
+    """Random references plus predictions with roughly ``error_rate`` edits"""
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(ALPHABET))
+    references, predictions = [], []
+    for _ in range(num_pairs):
+        reference = rng.choice(letters, size=length)
+        prediction = reference.copy()
+        edits = rng.random(length) < error_rate
+        prediction[edits] = rng.choice(letters, size=int(edits.sum()))
+        references.append("".join(reference))
+        predictions.append("".join(prediction))
+    return predictions, references
+
+
+def time_call(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num_pairs", type=int, default=200)
+    parser.add_argument("--length", type=int, default=500)
+    args = parser.parse_args()
+
+    predictions, references = make_corpus(args.num_pairs, args.length)
+
+    baseline, baseline_time = time_call(
+        lambda: [reference_edit_distance(p, r) for p, r in zip(predictions, references)]
+    )
+    pairwise, pairwise_time = time_call(
+        lambda: [edit_distance(p, r) for p, r in zip(predictions, references)]
+    )
+    corpus, corpus_time = time_call(edit_distances, predictions, references)
+    if not baseline == pairwise == corpus:
+        msg = "edit_distance disagrees with the reference implementation"
+        raise AssertionError(msg)
+
+    print(f"{args.num_pairs} pairs of {args.length} characters")
+    print(f"CER: {calculate_cer(predictions, references):.4f}")
+    print(f"reference DP:    {baseline_time:8.3f} s")
+    print(
+        f"edit_distance:   {pairwise_time:8.3f} s "
+        f"({baseline_time / pairwise_time:.1f}x)"
+    )
+    print(f"edit_distances:  {corpus_time:8.3f} s ({baseline_time / corpus_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
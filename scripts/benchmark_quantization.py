@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compare WER and CPU latency of fp32, int8 and bf16 Whisper inference on a
+fixed set of local clips.
+
+The manifest is a JSONL/CSV file with ``audio_path`` and ``text`` columns.
+"""
+
+import argparse
+import io
+import time
+
+import torch
+
+from harpertoken.audio import read_manifest
+from harpertoken.evaluate import evaluate_corpus, normalize
+from harpertoken.quantize import PRECISIONS
+from scripts.inference import load_fine_tuned_model, transcribe_files
+
+
+def model_size_mb(model):
+    """Serialized size of the state dict, which includes packed int8 weights"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def benchmark(precision, entries, args):
+    start = time.perf_counter()
+    model, processor = load_fine_tuned_model(
+        args.model_path,
+        args.processor_path,
+        precision=precision,
+        quantized_cache_dir=args.quantized_cache_dir,
+    )
+    load_time = time.perf_counter() - start
+
+    audio_paths = [entry["audio_path"] for entry in entries]
+    # Warm-up so one-off kernel initialisation is not counted
+    list(transcribe_files(model, processor, audio_paths[:1], batch_size=1))
+    start = time.perf_counter()
+    results = list(
+        transcribe_files(model, processor, audio_paths, batch_size=args.batch_size)
+    )
+    elapsed = time.perf_counter() - start
+
+    report = evaluate_corpus(
+        [normalize(result["transcription"]) for result in results],
+        [normalize(entry["text"]) for entry in entries],
+        num_workers=1,
+    )
+    audio_seconds = sum(result["duration"] for result in results)
+    return {
+        "precision": precision,
+        "wer": report.wer,
+        "load_s": load_time,
+        "latency_s": elapsed / len(results),
+        "rtf": elapsed / audio_seconds,
+        "size_mb": model_size_mb(model),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--manifest", required=True)
+    parser.add_argument("--model_path", default="openai/whisper-small")
+    parser.add_argument("--processor_path", default="openai/whisper-small")
+    parser.add_argument(
+        "--precisions", nargs="+", choices=PRECISIONS, default=list(PRECISIONS)
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--quantized_cache_dir", default=None)
+    args = parser.parse_args()
+
+    if args.num_threads:
+        torch.set_num_threads(args.num_threads)
+    entries = list(read_manifest(args.manifest))
+
+    rows = [benchmark(precision, entries, args) for precision in args.precisions]
+    baseline = rows[0]
+    print(f"{len(entries)} clips, {torch.get_num_threads()} threads")
+    print(
+        f"{'precision':>9} {'WER':>7} {'load s':>7} {'s/clip':>7} "
+        f"{'RTF':>6} {'speedup':>7} {'MB':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['precision']:>9} {row['wer']:7.4f} {row['load_s']:7.2f} "
+            f"{row['latency_s']:7.3f} {row['rtf']:6.3f} "
+            f"{baseline['latency_s'] / row['latency_s']:6.2f}x {row['size_mb']:7.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
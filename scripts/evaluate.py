@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Evaluate a Whisper or wav2vec2 CTC model on a manifest of audio with
+reference transcripts.
+
+The manifest is a JSONL/CSV file with ``audio_path`` and ``text`` columns.
+Per-utterance hypotheses, WER/CER and RTF are written as JSON lines while
+the evaluation runs; the corpus WER/CER and real-time factors are printed at
+the end and optionally saved with --report.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from harpertoken.audio import read_manifest
+from harpertoken.evaluate import ManifestEvaluator
+from harpertoken.export import BACKENDS
+from harpertoken.quantize import PRECISIONS, load_for_inference
+from harpertoken.registry import shared_processor
+from scripts.inference import load_fine_tuned_model, transcribe_batch
+
+
+def load_transcriber(args):
+    """Return ``transcribe_batch(waveforms) -> texts`` and its sample rate"""
+    if args.model_type == "whisper":
+        model, processor = load_fine_tuned_model(
+            args.model_path,
+            args.processor_path,
+            precision=args.precision,
+            backend=args.backend,
+        )
+        sample_rate = processor.feature_extractor.sampling_rate
+        return (
+            lambda waveforms: transcribe_batch(
+                model, processor, waveforms, sample_rate
+            ),
+            sample_rate,
+        )
+
+    from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+    from harpertoken.ctc import CTCDecoder, NGramLM, ctc_transcriber
+
+    model = load_for_inference(Wav2Vec2ForCTC, args.model_path, args.precision)
+    processor = shared_processor(Wav2Vec2Processor, args.processor_path)
+    decoder = CTCDecoder.from_tokenizer(
+        processor.tokenizer,
+        beam_width=args.beam_width,
+        lm=NGramLM.from_arpa(args.lm_path) if args.lm_path else None,
+        alpha=args.lm_weight,
+        beta=args.word_bonus,
+    )
+    return (
+        ctc_transcriber(model, processor, decoder),
+        processor.feature_extractor.sampling_rate,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--manifest", required=True)
+    parser.add_argument(
+        "--model_type", choices=["whisper", "wav2vec2"], default="whisper"
+    )
+    parser.add_argument(
+        "--model_path", help="Default openai/whisper-small or wav2vec2-base-960h"
+    )
+    parser.add_argument("--processor_path", help="Default --model_path")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument(
+        "--backend",
+        choices=("eager", *BACKENDS),
+        default="eager",
+        help="whisper: decode the graphs scripts.export wrote to --model_path",
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Loader threads reading audio ahead of the decoder thread",
+    )
+    parser.add_argument(
+        "--output",
+        help="Per-utterance JSONL results (default stdout)",
+    )
+    parser.add_argument("--report", help="Also write the corpus summary here")
+    parser.add_argument(
+        "--no_normalize",
+        action="store_true",
+        help="Score the raw text instead of lower-cased, unpunctuated text",
+    )
+    parser.add_argument(
+        "--beam_width",
+        type=int,
+        default=1,
+        help="wav2vec2: CTC prefix beam width; 1 decodes greedily",
+    )
+    parser.add_argument("--lm_path", help="wav2vec2: ARPA word n-gram LM")
+    parser.add_argument("--lm_weight", type=float, default=0.5)
+    parser.add_argument("--word_bonus", type=float, default=1.0)
+    args = parser.parse_args()
+    if args.model_path is None:
+        args.model_path = (
+            "openai/whisper-small"
+            if args.model_type == "whisper"
+            else "facebook/wav2vec2-base-960h"
+        )
+    args.processor_path = args.processor_path or args.model_path
+
+    transcribe, sample_rate = load_transcriber(args)
+    evaluator = ManifestEvaluator(
+        transcribe,
+        sample_rate=sample_rate,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        normalize_text=not args.no_normalize,
+    )
+
+    output = Path(args.output).open("w") if args.output else sys.stdout  # noqa: SIM115
+    try:
+        _, summary = evaluator.run(read_manifest(args.manifest), output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(
+        f"{summary['num_utterances']} utterances, "
+        f"{summary['audio_seconds'] / 3600:.2f} h: "
+        f"WER {summary['wer']:.4f}, CER {summary['cer']:.4f}, "
+        f"RTF {summary['rtf']:.3f} (wall {summary['wall_rtf']:.3f})",
+        file=sys.stderr,
+    )
+    if summary["failed"]:
+        print(f"{summary['failed']} files could not be read", file=sys.stderr)
+    if args.report:
+        Path(args.report).write_text(json.dumps(summary, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Export a fine-tuned Whisper model for the TorchScript or ONNX Runtime
+inference backends.
+
+Reads a ``save_pretrained`` directory (or Hub id) and writes the encoder and
+decoder-with-past graphs, the config and the processor to --output_dir,
+which scripts.inference and scripts.evaluate then load with --backend.
+"""
+
+import argparse
+
+from harpertoken.export import BACKENDS, export_whisper
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model_path", required=True, help="Fine-tuned model")
+    parser.add_argument("--processor_path", help="Default --model_path")
+    parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--backend", choices=BACKENDS, default="torchscript")
+    args = parser.parse_args()
+
+    from transformers import WhisperForConditionalGeneration, WhisperProcessor
+
+    model = WhisperForConditionalGeneration.from_pretrained(args.model_path).eval()
+    output_dir = export_whisper(model, args.output_dir, backend=args.backend)
+    WhisperProcessor.from_pretrained(
+        args.processor_path or args.model_path
+    ).save_pretrained(output_dir)
+    print(f"Exported {args.backend} graphs to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,71 @@
 import argparse
+import json
+import sys
+import time
+from pathlib import Path
 
-import torchaudio
-from transformers import WhisperForConditionalGeneration, WhisperProcessor
+import torch
 
+from harpertoken.audio import list_audio_files, load_audio, read_manifest
+from harpertoken.decoding import Decoder, load_draft_model
+from harpertoken.export import BACKENDS, ExportedWhisper
+from harpertoken.longform import iter_file_windows, transcribe_long
+from harpertoken.profiling import Profiler
+from harpertoken.quantize import PRECISIONS, load_for_inference
+from harpertoken.registry import shared_processor
+
+
+def load_fine_tuned_model(
+    model_path,
+    processor_path,
+    precision="fp32",
+    quantized_cache_dir=None,
+    backend="eager",
+):
+    """Load fine-tuned Speech Recognition AI model and processor
+
+    ``precision`` "int8" or "bf16" loads a dynamically quantized or bfloat16
+    model for faster CPU inference; int8 models are cached in
+    ``quantized_cache_dir`` so later runs skip quantization. ``backend``
+    "torchscript" or "onnx" loads the graphs scripts/export.py wrote to
+    ``model_path`` instead, to be decoded with TorchScript or ONNX Runtime.
+    """
+    from transformers import WhisperForConditionalGeneration, WhisperProcessor
 
-def load_fine_tuned_model(model_path, processor_path):
-    """Load fine-tuned Speech Recognition AI model and processor"""
     print(f"Loading fine-tuned Speech Recognition AI model from {model_path}")
-    model = WhisperForConditionalGeneration.from_pretrained(model_path)
-    processor = WhisperProcessor.from_pretrained(processor_path)
+    processor = shared_processor(WhisperProcessor, processor_path)
+    if backend != "eager":
+        if precision != "fp32":
+            msg = f"The {backend} backend runs the exported fp32 graphs"
+            raise ValueError(msg)
+        return ExportedWhisper.from_pretrained(model_path, backend), processor
+    model = load_for_inference(
+        WhisperForConditionalGeneration,
+        model_path,
+        precision,
+        cache_dir=quantized_cache_dir,
+    )
     return model, processor
 
 
-def transcribe_audio(model, processor, audio_path):
-    """Transcribe audio using fine-tuned Speech Recognition AI"""
+def transcribe_audio(model, processor, audio_path, profiler=None):
+    """Transcribe audio using fine-tuned Speech Recognition AI
+
+    ``model`` is the eager model, or an ExportedWhisper for the TorchScript
+    and ONNX Runtime backends (see load_fine_tuned_model). ``profiler`` times
+    loading ("data"), feature extraction, generation and decoding.
+    """
+    profiler = profiler or Profiler()
     print(f"Transcribing audio file: {audio_path}")
-    # Load and preprocess audio
-    waveform, sample_rate = torchaudio.load(audio_path)
-    # Convert to mono 1D float32 array for the processor
-    if waveform.dim() == 2:
-        waveform = waveform.mean(dim=0)
-    inputs = processor(waveform.numpy(), sampling_rate=sample_rate, return_tensors="pt")
+    # Load as mono and resample to the rate the feature extractor expects
+    sample_rate = processor.feature_extractor.sampling_rate
+    with profiler.stage("data"):
+        waveform = load_audio(audio_path, sample_rate)
+    with profiler.stage("features"):
+        inputs = processor(waveform, sampling_rate=sample_rate, return_tensors="pt")
 
     # Whisper expects input_features and (optionally) attention_mask
     if not hasattr(inputs, "attention_mask") or inputs.attention_mask is None:
-        import torch
-
         inputs.attention_mask = torch.ones(
             inputs.input_features.shape[0],
             inputs.input_features.shape[1],
@@ -33,19 +73,150 @@ def transcribe_audio(model, processor, audio_path):
         )
 
     # Generate transcription using fine-tuned model
-    with torch.no_grad():
+    with profiler.stage("generate"), torch.no_grad():
         generated_ids = model.generate(
-            input_features=inputs.input_features,
+            input_features=inputs.input_features.to(model.dtype),
             attention_mask=inputs.attention_mask,
             language="en",
             task="transcribe",
         )
 
     # Decode transcription
-    transcription = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    with profiler.stage("decode"):
+        transcriptions = processor.batch_decode(generated_ids, skip_special_tokens=True)
+        transcription = transcriptions[0]
+    profiler.count("samples")
+    profiler.count("audio_seconds", len(waveform) / sample_rate)
+    profiler.step(audio_path=str(audio_path))
     return transcription
 
 
+def transcribe_long_audio(model, processor, audio_path, batch_size=4):
+    """Transcribe a recording of any length with overlapping 30 s windows"""
+    print(f"Transcribing long-form audio file: {audio_path}")
+    windows = iter_file_windows(
+        audio_path, sample_rate=processor.feature_extractor.sampling_rate
+    )
+    return transcribe_long(
+        model,
+        processor,
+        windows,
+        batch_size=batch_size,
+        language="en",
+        task="transcribe",
+    )
+
+
+def bucket_by_length(lengths, batch_size):
+    """Group clip indices into batches of similar length.
+
+    Sorting by length before batching keeps the clips in a batch close in
+    duration, so the decoder stops at roughly the same step for all of them.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i : i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def transcribe_batch(model, processor, waveforms, sample_rate=16000, profiler=None):
+    """Transcribe a list of mono waveforms with one padded generate call"""
+    profiler = profiler or Profiler()
+    with profiler.stage("features"):
+        inputs = processor(
+            waveforms,
+            sampling_rate=sample_rate,
+            return_attention_mask=True,
+            return_tensors="pt",
+        )
+    with profiler.stage("generate"), torch.no_grad():
+        generated_ids = model.generate(
+            input_features=inputs.input_features.to(model.dtype),
+            attention_mask=inputs.attention_mask,
+            language="en",
+            task="transcribe",
+        )
+    with profiler.stage("decode"):
+        return processor.batch_decode(generated_ids, skip_special_tokens=True)
+
+
+def transcribe_files(  # noqa: PLR0913
+    model, processor, audio_paths, batch_size=8, bucket_size=64, *, profiler=None
+):
+    """Transcribe many audio files in length-bucketed batches.
+
+    Files are read ``bucket_size`` at a time, sorted by duration inside that
+    window and decoded ``batch_size`` clips per ``generate`` call, so memory
+    stays bounded however long the file list is. Results are yielded as dicts
+    in input order. ``profiler`` records one step per ``generate`` call.
+    """
+    profiler = profiler or Profiler()
+    window = []
+    for audio_path in audio_paths:
+        window.append(audio_path)
+        if len(window) == bucket_size:
+            yield from _transcribe_window(
+                model, processor, window, batch_size, profiler
+            )
+            window = []
+    if window:
+        yield from _transcribe_window(model, processor, window, batch_size, profiler)
+
+
+def _transcribe_window(model, processor, audio_paths, batch_size, profiler):
+    sample_rate = processor.feature_extractor.sampling_rate
+    # Loading the window is charged to the step of its first batch
+    with profiler.stage("data"):
+        waveforms = [load_audio(path, sample_rate) for path in audio_paths]
+    transcriptions = [None] * len(waveforms)
+    for batch in bucket_by_length([len(w) for w in waveforms], batch_size):
+        texts = transcribe_batch(
+            model, processor, [waveforms[i] for i in batch], sample_rate, profiler
+        )
+        for i, text in zip(batch, texts):
+            transcriptions[i] = text
+        profiler.count("samples", len(batch))
+        profiler.count(
+            "audio_seconds", sum(len(waveforms[i]) for i in batch) / sample_rate
+        )
+        profiler.step(batch_size=len(batch))
+    for path, waveform, text in zip(audio_paths, waveforms, transcriptions):
+        yield {
+            "audio_path": path,
+            "duration": len(waveform) / sample_rate,
+            "transcription": text,
+        }
+
+
+def _run_batched(model, processor, args, profiler):
+    if args.manifest:
+        audio_paths = (entry["audio_path"] for entry in read_manifest(args.manifest))
+    else:
+        audio_paths = list_audio_files(args.audio_dir)
+
+    output = Path(args.output).open("w") if args.output else sys.stdout  # noqa: SIM115
+    start = time.perf_counter()
+    num_clips = 0
+    try:
+        for result in transcribe_files(
+            model,
+            processor,
+            audio_paths,
+            batch_size=args.batch_size,
+            bucket_size=args.bucket_size,
+            profiler=profiler,
+        ):
+            output.write(json.dumps(result) + "\n")
+            num_clips += 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"Transcribed {num_clips} clips in {elapsed:.2f} seconds "
+        f"({num_clips / max(elapsed, 1e-9):.2f} clips/sec)",
+        file=sys.stderr,
+    )
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Speech Recognition AI Fine Tune Inference",
@@ -56,18 +227,121 @@ if __name__ == "__main__":
         required=True,
         help="Path to fine-tuned processor",
     )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--audio_path", help="Path to audio file to transcribe")
+    source.add_argument(
+        "--audio_dir",
+        help="Directory of audio files to transcribe in batches",
+    )
+    source.add_argument(
+        "--manifest",
+        help="JSONL/CSV manifest with an audio_path column to transcribe in batches",
+    )
     parser.add_argument(
-        "--audio_path",
-        required=True,
-        help="Path to audio file to transcribe",
+        "--batch_size",
+        type=int,
+        default=8,
+        help="Clips per generate call in directory/manifest mode",
+    )
+    parser.add_argument(
+        "--bucket_size",
+        type=int,
+        default=64,
+        help="Clips loaded and sorted by duration before batching",
+    )
+    parser.add_argument(
+        "--long_form",
+        action="store_true",
+        help="Transcribe --audio_path in overlapping 30 s windows with timestamps",
+    )
+    parser.add_argument(
+        "--output",
+        help="Write JSONL results here instead of stdout (directory/manifest mode)",
+    )
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="fp32",
+        help="int8 dynamic quantization or bf16 weights for CPU inference",
+    )
+    parser.add_argument(
+        "--quantized_cache_dir",
+        help="Cache int8 models here so later runs skip quantization",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("eager", *BACKENDS),
+        default="eager",
+        help="Decode with the TorchScript or ONNX Runtime graphs scripts.export "
+        "wrote to --model_path",
+    )
+    parser.add_argument(
+        "--draft_model_path",
+        help="Small Whisper (e.g. openai/whisper-tiny) drafting tokens for "
+        "assisted decoding of single clips; transcripts are unchanged",
+    )
+    parser.add_argument(
+        "--static_cache",
+        action="store_true",
+        help="Decode into a preallocated KV cache reused across generate calls",
+    )
+    parser.add_argument(
+        "--profile_path",
+        help="Append per-step stage timings as JSON lines here (- for stderr)",
+    )
+    parser.add_argument(
+        "--trace_dir",
+        help="Directory for torch.profiler traces (with --trace_steps)",
+    )
+    parser.add_argument(
+        "--trace_steps",
+        type=int,
+        default=0,
+        help="Capture a torch.profiler trace of this many generate calls",
     )
 
     args = parser.parse_args()
+    if args.backend != "eager" and (
+        args.draft_model_path or args.static_cache or args.long_form
+    ):
+        parser.error(f"--backend {args.backend} decodes short-form audio greedily")
 
     # Load fine-tuned model and processor
-    model, processor = load_fine_tuned_model(args.model_path, args.processor_path)
+    model, processor = load_fine_tuned_model(
+        args.model_path,
+        args.processor_path,
+        precision=args.precision,
+        quantized_cache_dir=args.quantized_cache_dir,
+        backend=args.backend,
+    )
+    if args.draft_model_path or args.static_cache:
+        draft_model = (
+            load_draft_model(args.draft_model_path, dtype=model.dtype)
+            if args.draft_model_path
+            else None
+        )
+        model = Decoder(model, draft_model, static_cache=args.static_cache)
 
-    # Transcribe audio
-    transcription = transcribe_audio(model, processor, args.audio_path)
-    print("\nTranscription Result:")
-    print(transcription)
+    if args.audio_path and args.long_form:
+        result = transcribe_long_audio(
+            model, processor, args.audio_path, batch_size=args.batch_size
+        )
+        print("\nTranscription Result:")
+        for segment in result["segments"]:
+            print(
+                f"[{segment['start']:8.2f} -> {segment['end']:8.2f}] {segment['text']}"
+            )
+    else:
+        with Profiler(
+            args.profile_path, trace_dir=args.trace_dir, trace_steps=args.trace_steps
+        ) as profiler:
+            if args.audio_path:
+                # Transcribe audio
+                transcription = transcribe_audio(
+                    model, processor, args.audio_path, profiler
+                )
+                print("\nTranscription Result:")
+                print(transcription)
+            else:
+                _run_batched(model, processor, args, profiler)
+            profiler.summary()
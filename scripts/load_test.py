@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Measure transcription server throughput and latency on localhost.
+
+Sends one audio file repeatedly from concurrent keep-alive connections and
+reports requests per second, p50/p99 latency and rejected requests, followed
+by the server's own /metrics.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+async def request(reader, writer, method, path, body=b""):
+    """Send one HTTP/1.1 request on an open connection; return (status, json)"""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    status = int(head[0].split(" ")[1])
+    length = next(
+        int(line.split(":", 1)[1])
+        for line in head[1:]
+        if line.lower().startswith("content-length:")
+    )
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(args, body, num_requests, latencies, statuses):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    try:
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, "POST", "/transcribe", body)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+    finally:
+        writer.close()
+
+
+async def run(args):
+    body = Path(args.audio_path).read_bytes()
+    latencies, statuses = [], []
+    per_client = [
+        args.requests // args.concurrency + (i < args.requests % args.concurrency)
+        for i in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(client(args, body, n, latencies, statuses) for n in per_client)
+    )
+    elapsed = time.perf_counter() - start
+
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    _, metrics = await request(reader, writer, "GET", "/metrics")
+    writer.close()
+
+    ok = statuses.count(200)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    print(f"{len(statuses)} requests, concurrency {args.concurrency}")
+    print(f"throughput: {ok / elapsed:.2f} req/s in {elapsed:.2f} s")
+    print(f"latency: p50 {p50:.1f} ms, p99 {p99:.1f} ms")
+    print(
+        f"rejected (503): {statuses.count(503)}, other errors: {len(statuses) - ok - statuses.count(503)}"
+    )
+    print("server metrics:", json.dumps(metrics, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--audio_path", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
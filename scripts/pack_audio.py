@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Pack a directory or manifest of audio into one memory-mapped corpus.
+
+Every clip is decoded and resampled once; training then reads zero-copy
+slices of the packed file (python main.py --audio_store <output_dir>)
+instead of decoding audio on every access.
+"""
+
+import argparse
+import sys
+
+from harpertoken.audio import list_audio_files, read_manifest
+from harpertoken.store import STORE_DTYPES, pack_audio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--audio_dir", help="Pack every audio file below this")
+    source.add_argument(
+        "--manifest", help="JSONL/CSV with audio_path and optional text columns"
+    )
+    parser.add_argument("--output_dir", required=True)
+    parser.add_argument("--sample_rate", type=int, default=16000)
+    parser.add_argument(
+        "--dtype",
+        choices=STORE_DTYPES,
+        default="int16",
+        help="int16 is half the size of float32, at 16-bit PCM precision",
+    )
+    args = parser.parse_args()
+
+    sources = (
+        read_manifest(args.manifest)
+        if args.manifest
+        else list_audio_files(args.audio_dir)
+    )
+    store = pack_audio(
+        sources, args.output_dir, sample_rate=args.sample_rate, dtype=args.dtype
+    )
+    hours = sum(store.durations()) / 3600
+    print(
+        f"Packed {len(store)} clips ({hours:.2f} h) into {args.output_dir}",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
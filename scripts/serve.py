@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Serve transcription over HTTP and WebSocket with a model kept warm in memory.
+
+Concurrent requests are micro-batched into shared generate calls. See
+harpertoken.server.TranscriptionServer for the endpoints.
+"""
+
+import argparse
+import asyncio
+import contextlib
+
+from harpertoken.quantize import PRECISIONS
+from harpertoken.server import MicroBatcher, TranscriptionServer, batch_transcriber
+from scripts.inference import load_fine_tuned_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model_path", default="openai/whisper-small")
+    parser.add_argument("--processor_path", default="openai/whisper-small")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=10,
+        help="How long a batch waits for more requests before running",
+    )
+    parser.add_argument(
+        "--max_queue",
+        type=int,
+        default=64,
+        help="Requests allowed to wait; more are rejected with 503",
+    )
+    args = parser.parse_args()
+
+    model, processor = load_fine_tuned_model(
+        args.model_path, args.processor_path, precision=args.precision
+    )
+    sample_rate = processor.feature_extractor.sampling_rate
+    batcher = MicroBatcher(
+        batch_transcriber(
+            model, processor, sample_rate, language="en", task="transcribe"
+        ),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue=args.max_queue,
+    )
+    server = TranscriptionServer(batcher, sample_rate)
+    print(f"Serving on http://{args.host}:{args.port}")
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(server.serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Transcribe speech as it is spoken, from the microphone, an audio file or a
+raw 16-bit PCM pipe.
+
+Partial hypotheses are redrawn in place on the current line; a line is
+finished once voice activity detection closes the segment.
+"""
+
+import argparse
+import asyncio
+import sys
+
+from harpertoken.decoding import Decoder, load_draft_model
+from harpertoken.quantize import PRECISIONS
+from harpertoken.streaming import (
+    FileSource,
+    MicrophoneSource,
+    Segmenter,
+    stream_transcripts,
+    whisper_transcriber,
+)
+from scripts.inference import load_fine_tuned_model
+
+
+async def run(args):
+    model, processor = load_fine_tuned_model(
+        args.model_path, args.processor_path, precision=args.precision
+    )
+    if args.draft_model_path:
+        # Segments are transcribed one at a time, the case assisted decoding
+        # speeds up
+        draft_model = load_draft_model(args.draft_model_path, dtype=model.dtype)
+        model = Decoder(model, draft_model)
+    sample_rate = processor.feature_extractor.sampling_rate
+    if args.input is None:
+        source = MicrophoneSource(sample_rate)
+        print("Listening... press Ctrl+C to stop", file=sys.stderr)
+    else:
+        source = FileSource(args.input, sample_rate, realtime=args.realtime)
+    segmenter = Segmenter(
+        sample_rate,
+        threshold=args.vad_threshold,
+        min_silence=args.min_silence,
+        partial_every=args.partial_every,
+    )
+    transcribe = whisper_transcriber(
+        model, processor, sample_rate, language="en", task="transcribe"
+    )
+
+    async for hypothesis in stream_transcripts(source, transcribe, segmenter):
+        line = f"[{hypothesis.start:8.2f} -> {hypothesis.end:8.2f}] {hypothesis.text}"
+        if hypothesis.final:
+            print(f"\r\033[K{line}", flush=True)
+        else:
+            print(f"\r\033[K{line}", end="", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model_path", default="openai/whisper-small")
+    parser.add_argument("--processor_path", default="openai/whisper-small")
+    parser.add_argument(
+        "--input",
+        help="Audio file, or - for raw 16-bit mono PCM on stdin; "
+        "default is the microphone",
+    )
+    parser.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Feed --input at the speed of the audio, as a microphone would",
+    )
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32")
+    parser.add_argument(
+        "--draft_model_path",
+        help="Small Whisper, e.g. openai/whisper-tiny, for assisted decoding",
+    )
+    parser.add_argument("--vad_threshold", type=float, default=0.01)
+    parser.add_argument("--min_silence", type=float, default=0.5)
+    parser.add_argument("--partial_every", type=float, default=1.0)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        print(file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
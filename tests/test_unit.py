@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import sys
 import unittest
@@ -122,5 +123,2111 @@ class TestHarpertoken(unittest.TestCase):
         assert callable(test_transcription)
 
 
+def _write_wav(path, num_samples, sample_rate=16000):
+    """Write a short sine tone as 16-bit PCM with the stdlib wave module"""
+    import wave
+
+    import numpy as np
+
+    t = np.arange(num_samples) / sample_rate
+    pcm = (0.1 * np.sin(2 * np.pi * 440 * t) * 32767).astype("<i2")
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+class _FrameCountProcessor:
+    """Whisper feature extractor whose "tokenizer" decodes frame counts"""
+
+    def __init__(self):
+        from transformers import WhisperFeatureExtractor
+
+        self.feature_extractor = WhisperFeatureExtractor()
+
+    def __call__(self, audio, **kwargs):
+        return self.feature_extractor(audio, **kwargs)
+
+    def batch_decode(self, ids, **_kwargs):
+        return [str(int(row[0])) for row in ids]
+
+
+class _CharTokenizer:
+    """Tokenizes text into one id per character"""
+
+    def __call__(self, text):
+        import types
+
+        return types.SimpleNamespace(input_ids=[ord(char) for char in text])
+
+
+class _FrameCountModel:
+    """Stands in for Whisper: emits the number of attended frames per clip"""
+
+    def __init__(self):
+        import torch
+
+        self.batch_sizes = []
+        self.dtype = torch.float32
+
+    def generate(self, input_features, attention_mask, **_kwargs):
+        self.batch_sizes.append(input_features.shape[0])
+        return attention_mask.sum(dim=1, keepdim=True)
+
+
+class TestBatchedInference(unittest.TestCase):
+    def test_bucket_by_length(self):
+        """Batches hold clips of neighbouring length and cover every index"""
+        from scripts.inference import bucket_by_length
+
+        batches = bucket_by_length([50, 10, 40, 20, 30], batch_size=2)
+        self.assertEqual(batches, [[1, 3], [4, 2], [0]])
+
+    def test_transcribe_files_keeps_input_order(self):
+        """Bucketed batches are mapped back to the files they came from"""
+        import tempfile
+        from pathlib import Path
+
+        from scripts.inference import transcribe_files
+
+        lengths = [16000, 4000, 12000, 8000, 2000]
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, num_samples in enumerate(lengths):
+                path = Path(tmp) / f"clip{i}.wav"
+                _write_wav(path, num_samples)
+                paths.append(str(path))
+
+            model = _FrameCountModel()
+            results = list(
+                transcribe_files(
+                    model, _FrameCountProcessor(), paths, batch_size=2, bucket_size=4
+                )
+            )
+
+        self.assertEqual([r["audio_path"] for r in results], paths)
+        self.assertEqual(
+            [r["transcription"] for r in results], ["100", "25", "75", "50", "13"]
+        )
+        self.assertEqual(model.batch_sizes, [2, 2, 1])
+
+
+class _ScriptedWindowModel:
+    """Stands in for Whisper: emits the running index of each window it sees"""
+
+    def __init__(self):
+        import torch
+
+        self.seen = 0
+        self.dtype = torch.float32
+
+    def generate(self, input_features, **_kwargs):
+        import torch
+
+        batch = input_features.shape[0]
+        ids = torch.arange(self.seen, self.seen + batch).unsqueeze(1)
+        self.seen += batch
+        return ids
+
+
+class _ScriptedWindowProcessor(_FrameCountProcessor):
+    """Decodes window ``i`` to the words spoken inside it, with timestamps.
+
+    Word ``w`` is spoken from ``2w`` to ``2w + 1`` seconds.
+    """
+
+    def __init__(self, step_seconds, chunk_seconds, num_words):
+        super().__init__()
+        self.step_seconds = step_seconds
+        self.chunk_seconds = chunk_seconds
+        self.num_words = num_words
+
+    def decode(self, ids, **_kwargs):
+        start = int(ids[0]) * self.step_seconds
+        offsets = [
+            {"text": f" w{w}", "timestamp": (2 * w - start, 2 * w + 1 - start)}
+            for w in range(self.num_words)
+            if start <= 2 * w and 2 * w + 1 <= start + self.chunk_seconds
+        ]
+        return {"text": "".join(o["text"] for o in offsets), "offsets": offsets}
+
+
+class TestLongForm(unittest.TestCase):
+    def test_iter_windows_overlap_without_copying(self):
+        """Windows step by chunk - overlap and are views of the input"""
+        import numpy as np
+
+        from harpertoken.longform import iter_windows
+
+        audio = np.zeros(70 * 100, dtype=np.float32)
+        windows = list(
+            iter_windows(audio, sample_rate=100, chunk_seconds=30, overlap_seconds=5)
+        )
+        self.assertEqual([start for start, _ in windows], [0.0, 25.0, 50.0])
+        self.assertEqual([len(w) for _, w in windows], [3000, 3000, 2000])
+        self.assertTrue(all(np.shares_memory(w, audio) for _, w in windows))
+
+    def test_iter_file_windows_matches_in_memory_windows(self):
+        """Reading a file window by window gives the same windows"""
+        import tempfile
+        from pathlib import Path
+
+        import numpy as np
+
+        from harpertoken.audio import load_audio
+        from harpertoken.longform import iter_file_windows, iter_windows
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "long.wav"
+            _write_wav(path, 16000 * 7)
+            kwargs = {"chunk_seconds": 3, "overlap_seconds": 1}
+            from_file = list(iter_file_windows(path, **kwargs))
+            in_memory = list(iter_windows(load_audio(path), **kwargs))
+
+        self.assertEqual([s for s, _ in from_file], [s for s, _ in in_memory])
+        for (_, a), (_, b) in zip(from_file, in_memory):
+            np.testing.assert_array_equal(a, b)
+
+    def test_transcribe_long_stitches_overlaps(self):
+        """Words inside an overlap are emitted once, with absolute timestamps"""
+        import numpy as np
+
+        from harpertoken.longform import iter_windows, transcribe_long
+
+        num_words = 35
+        processor = _ScriptedWindowProcessor(20, 30, num_words)
+        audio = np.zeros(16000 * 70, dtype=np.float32)
+        windows = iter_windows(audio, chunk_seconds=30, overlap_seconds=10)
+
+        result = transcribe_long(_ScriptedWindowModel(), processor, windows, 2)
+
+        expected = " ".join(f"w{w}" for w in range(num_words))
+        self.assertEqual(result["text"], expected)
+        self.assertEqual(
+            result["segments"][13], {"start": 26, "end": 27, "text": "w13"}
+        )
+
+
+class TestEditDistance(unittest.TestCase):
+    def test_matches_reference_dp(self):
+        """Bit-parallel distance equals the full DP table on random strings"""
+        import numpy as np
+
+        from harpertoken.evaluate import edit_distance, edit_distances
+        from scripts.benchmark_edit_distance import reference_edit_distance
+
+        rng = np.random.default_rng(0)
+        pairs = [
+            tuple(
+                "".join(rng.choice(list("abc"), size=rng.integers(0, 80)))
+                for _ in range(2)
+            )
+            for _ in range(300)
+        ]
+        expected = [reference_edit_distance(p, r) for p, r in pairs]
+        self.assertEqual([edit_distance(p, r) for p, r in pairs], expected)
+        self.assertEqual(edit_distances(*zip(*pairs)), expected)
+
+    def test_token_sequences(self):
+        """Sequences of words are compared token by token"""
+        from harpertoken.evaluate import edit_distance
+
+        self.assertEqual(edit_distance(["the", "cat", "sat"], ["the", "hat"]), 2)
+        self.assertEqual(edit_distance([], ["a", "b"]), 2)
+
+    def test_length_mismatch(self):
+        """Corpus scoring rejects misaligned predictions and references"""
+        from harpertoken.evaluate import edit_distances
+
+        with self.assertRaises(ValueError):
+            edit_distances(["a"], ["a", "b"])
+
+
+class TestCorpusEvaluation(unittest.TestCase):
+    def test_wer_counts_words(self):
+        """calculate_wer divides word edits by reference words"""
+        from harpertoken.evaluate import calculate_wer
+
+        self.assertEqual(calculate_wer(["hello there"], ["hello world"]), 0.5)
+
+    def test_error_breakdown(self):
+        """Substitutions, insertions and deletions come from one alignment"""
+        from harpertoken.evaluate import score_utterance
+
+        report = score_utterance("the cat sat on the mat", "a cat sat on mat")
+        self.assertEqual(
+            (report.substitutions, report.insertions, report.deletions), (1, 1, 0)
+        )
+        self.assertEqual(report.reference_words, 5)
+        self.assertAlmostEqual(report.wer, 2 / 5)
+
+    def test_corpus_matches_pairwise_scores(self):
+        """Pooled, chunked scoring agrees with scoring each pair alone"""
+        import numpy as np
+
+        from harpertoken.evaluate import edit_distance, evaluate_corpus
+
+        rng = np.random.default_rng(0)
+        words = ["a", "b", "c", "dd", "eee"]
+        references = [
+            " ".join(rng.choice(words, size=rng.integers(0, 12))) for _ in range(200)
+        ]
+        predictions = [
+            " ".join(rng.choice(words, size=rng.integers(0, 12))) for _ in range(200)
+        ]
+
+        total, reports = evaluate_corpus(
+            predictions, references, num_workers=2, chunk_size=16, per_utterance=True
+        )
+
+        for prediction, reference, report in zip(predictions, references, reports):
+            self.assertEqual(
+                report.word_errors, edit_distance(prediction.split(), reference.split())
+            )
+            self.assertEqual(report.char_errors, edit_distance(prediction, reference))
+        self.assertEqual(total, sum(reports, type(total)()))
+        self.assertEqual(total.num_utterances, 200)
+
+
+class TestManifestEvaluator(unittest.TestCase):
+    def test_streams_ordered_results_and_totals(self):
+        import io
+        import json
+        import tempfile
+        from pathlib import Path
+
+        from harpertoken.audio import read_manifest
+        from harpertoken.evaluate import ManifestEvaluator
+
+        def transcribe_batch(waveforms):
+            # Longer clips come back wrong, with punctuation to normalise
+            return [
+                "Hello, World!" if len(w) < 8000 else "hello there" for w in waveforms
+            ]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            lines = []
+            for i in range(5):
+                _write_wav(Path(tmp) / f"{i}.wav", 4000 * (i + 1))
+                lines.append(
+                    json.dumps({"audio_path": f"{i}.wav", "text": "hello world"})
+                )
+            manifest = Path(tmp) / "manifest.jsonl"
+            manifest.write_text("\n".join(lines) + "\n")
+
+            output = io.StringIO()
+            evaluator = ManifestEvaluator(transcribe_batch, batch_size=2, num_workers=2)
+            total, summary = evaluator.run(read_manifest(manifest), output)
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([r["index"] for r in records], list(range(5)))
+        self.assertEqual([r["wer"] for r in records], [0.0, 1 / 2, 1 / 2, 1 / 2, 1 / 2])
+        self.assertEqual(total.num_utterances, 5)
+        self.assertEqual(total.word_errors, 4)
+        self.assertAlmostEqual(summary["audio_seconds"], 4000 * 15 / 16000)
+        self.assertGreater(summary["rtf"], 0)
+
+    def test_unreadable_files_are_recorded_and_decoding_is_serial(self):
+        """A missing file gets an error record; decode calls never overlap"""
+        import io
+        import json
+        import tempfile
+        import threading
+        import time
+        from pathlib import Path
+
+        from harpertoken.audio import read_manifest
+        from harpertoken.evaluate import ManifestEvaluator
+
+        active, overlaps = [], []
+        lock = threading.Lock()
+
+        def transcribe_batch(waveforms):
+            with lock:
+                active.append(1)
+                overlaps.append(len(active) > 1)
+            time.sleep(0.01)
+            with lock:
+                active.pop()
+            return ["hello world"] * len(waveforms)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            lines = []
+            for i in range(6):
+                if i != 2:
+                    _write_wav(Path(tmp) / f"{i}.wav", 4000)
+                lines.append(
+                    json.dumps({"audio_path": f"{i}.wav", "text": "hello world"})
+                )
+            manifest = Path(tmp) / "manifest.jsonl"
+            manifest.write_text("\n".join(lines) + "\n")
+
+            output = io.StringIO()
+            evaluator = ManifestEvaluator(transcribe_batch, batch_size=2, num_workers=4)
+            total, summary = evaluator.run(read_manifest(manifest), output)
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([r["index"] for r in records], list(range(6)))
+        self.assertIn("could not load audio", records[2]["error"])
+        self.assertEqual(total.num_utterances, 5)
+        self.assertEqual(summary["failed"], 1)
+        self.assertFalse(any(overlaps))
+
+
+class TestFeatureCache(unittest.TestCase):
+    def test_second_access_skips_extraction(self):
+        """Features are computed once and then read back as a memory map"""
+        import tempfile
+
+        import numpy as np
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.cache import FeatureCache
+
+        extractor = WhisperFeatureExtractor()
+        audio = np.random.default_rng(0).standard_normal(16000).astype(np.float32)
+        calls = []
+
+        def compute(a):
+            calls.append(1)
+            return extractor(a, sampling_rate=16000).input_features[0]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = FeatureCache(tmp, extractor)
+            first = cache.get_or_compute(audio, 16000, compute)
+            second = cache.get_or_compute(audio, 16000, compute)
+
+            self.assertEqual(len(calls), 1)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertIsInstance(second, np.memmap)
+            np.testing.assert_array_equal(first, second)
+
+    def test_key_changes_with_audio_and_config(self):
+        """New audio or a new processor config never hits an old entry"""
+        import tempfile
+
+        import numpy as np
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.cache import FeatureCache
+
+        audio = np.zeros(1600, dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = FeatureCache(tmp, WhisperFeatureExtractor())
+            cache.get_or_compute(audio, 16000, lambda a: a)
+            self.assertIsNone(cache.load(cache.key(audio + 1, 16000)))
+
+            other = FeatureCache(tmp, WhisperFeatureExtractor(feature_size=128))
+            self.assertNotEqual(other.cache_dir, cache.cache_dir)
+            self.assertIsNone(other.load(other.key(audio, 16000)))
+
+
+def _write_corpus(tmp, num_clips):
+    """A manifest and two tar shards of short clips with texts t0, t1, ..."""
+    import json
+    import tarfile
+    from pathlib import Path
+
+    manifest = Path(tmp) / "train.jsonl"
+    with manifest.open("w") as f:
+        for i in range(num_clips):
+            _write_wav(Path(tmp) / f"utt{i}.wav", 1600 * (i + 1), 8000)
+            f.write(json.dumps({"audio_path": f"utt{i}.wav", "text": f"t{i}"}))
+            f.write("\n")
+    shards = []
+    for shard in range(2):
+        path = Path(tmp) / f"shard{shard}.tar"
+        with tarfile.open(path, "w") as tar:
+            for i in range(shard, num_clips, 2):
+                tar.add(Path(tmp) / f"utt{i}.wav", arcname=f"utt{i}.wav")
+                text = Path(tmp) / f"utt{i}.txt"
+                text.write_text(f"t{i}")
+                tar.add(text, arcname=f"utt{i}.txt")
+        shards.append(str(path))
+    return str(manifest), shards
+
+
+class TestStreamingDataset(unittest.TestCase):
+    def test_manifest_samples_match_getitem_shape(self):
+        """Samples are resampled Whisper features with their transcript"""
+        import tempfile
+
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.dataset import StreamingSpeechDataset
+
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 3)
+            dataset = StreamingSpeechDataset(
+                manifest, processor=WhisperFeatureExtractor()
+            )
+            samples = list(dataset)
+
+        self.assertEqual([s["text"] for s in samples], ["t0", "t1", "t2"])
+        self.assertEqual(tuple(samples[0]["input_features"].shape), (80, 3000))
+
+    def test_streams_partition_the_corpus(self):
+        """Ranks and workers see disjoint samples that together cover everything"""
+        import tempfile
+
+        from torch.utils.data import DataLoader
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.dataset import StreamingSpeechDataset
+
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, shards = _write_corpus(tmp, 8)
+            for source in (manifest, shards, f"{tmp}/shard*.tar"):
+                seen = []
+                for rank in range(2):
+                    dataset = StreamingSpeechDataset(
+                        source, processor=WhisperFeatureExtractor()
+                    )
+                    dataset.rank, dataset.world_size = rank, 2
+                    loader = DataLoader(dataset, batch_size=None, num_workers=2)
+                    seen.extend(sample["text"] for sample in loader)
+                self.assertEqual(sorted(seen), sorted(f"t{i}" for i in range(8)))
+
+    def test_train_model_streams_a_manifest(self):
+        """A streamed corpus trains through build_dataloader, transcripts as labels"""
+        import tempfile
+        from pathlib import Path
+
+        from harpertoken.dataset import StreamingSpeechDataset
+        from harpertoken.model import SpeechModel
+        from harpertoken.train import TrainingConfig, train_model
+        from scripts.benchmark import tiny_config
+
+        seen = []
+
+        class LabelRecordingModel(SpeechModel):
+            def forward(self, inputs, labels=None):
+                seen.append(labels)
+                return super().forward(inputs, labels=labels)
+
+        processor = _FrameCountProcessor()
+        processor.tokenizer = _CharTokenizer()
+        model = LabelRecordingModel("whisper", config=tiny_config("whisper"))
+        cwd = Path.cwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 3)
+            dataset = StreamingSpeechDataset(manifest, processor=processor)
+            os.chdir(tmp)
+            try:
+                train_model(
+                    num_epochs=2,
+                    config=TrainingConfig(
+                        batch_size=2, num_workers=1, push_to_hub=False
+                    ),
+                    dataset=dataset,
+                    model=model,
+                )
+            finally:
+                os.chdir(cwd)
+
+        # Two batches (2 + 1 clips) in each of the two epochs
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(seen[1].tolist(), [[ord("t"), ord("2")]])
+
+    def test_ranks_get_equal_sample_counts(self):
+        """Uneven streams wrap around so every rank runs the same number of steps"""
+        import tempfile
+
+        from torch.utils.data import DataLoader
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.dataset import StreamingSpeechDataset
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Shards of 4 and 3 clips; the manifest splits 7 clips over 4 streams
+            manifest, shards = _write_corpus(tmp, 7)
+            for source, num_workers in ((shards, 0), (manifest, 2)):
+                per_rank = []
+                for rank in range(2):
+                    dataset = StreamingSpeechDataset(
+                        source, processor=WhisperFeatureExtractor()
+                    )
+                    dataset.rank, dataset.world_size = rank, 2
+                    loader = DataLoader(
+                        dataset, batch_size=None, num_workers=num_workers
+                    )
+                    per_rank.append([sample["text"] for sample in loader])
+                self.assertEqual(len(per_rank[0]), len(per_rank[1]))
+                self.assertEqual(
+                    set(per_rank[0] + per_rank[1]), {f"t{i}" for i in range(7)}
+                )
+
+
+class TestAudioStore(unittest.TestCase):
+    def test_pack_round_trips_clips_zero_copy(self):
+        """Clips read back as views of one memory map, within int16 precision"""
+        import pickle
+        import tempfile
+
+        import numpy as np
+
+        from harpertoken.audio import load_audio, read_manifest
+        from harpertoken.store import INT16_SCALE, AudioStore, pack_audio
+
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 3)
+            store = pack_audio(read_manifest(manifest), f"{tmp}/store")
+            float_store = pack_audio(
+                read_manifest(manifest), f"{tmp}/float", dtype="float32"
+            )
+            reopened = AudioStore(f"{tmp}/store")
+
+            self.assertEqual(reopened.texts, ["t0", "t1", "t2"])
+            self.assertEqual(reopened.durations(), [0.2, 0.4, 0.6])
+            for i, path in enumerate(reopened.paths):
+                expected = load_audio(path)
+                self.assertTrue(np.shares_memory(reopened[i], reopened.samples))
+                np.testing.assert_allclose(
+                    reopened.audio(i), expected, atol=1 / INT16_SCALE
+                )
+                np.testing.assert_array_equal(float_store.audio(i), expected)
+            self.assertEqual(store.samples.dtype, np.int16)
+            # Workers get the index, not a copy of the audio
+            self.assertLess(len(pickle.dumps(reopened)), reopened.samples.nbytes)
+
+    def test_dataset_reads_packed_clips_in_workers(self):
+        import tempfile
+
+        from torch.utils.data import DataLoader
+        from transformers import WhisperFeatureExtractor
+
+        from harpertoken.audio import read_manifest
+        from harpertoken.dataset import PackedSpeechDataset
+        from harpertoken.store import pack_audio
+
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 4)
+            pack_audio(read_manifest(manifest), f"{tmp}/store")
+            dataset = PackedSpeechDataset(
+                f"{tmp}/store", processor=WhisperFeatureExtractor()
+            )
+            loader = DataLoader(dataset, batch_size=None, num_workers=2)
+            samples = list(loader)
+
+        self.assertEqual([s["text"] for s in samples], ["t0", "t1", "t2", "t3"])
+        self.assertEqual(tuple(samples[0]["input_features"].shape), (80, 3000))
+
+    def test_train_model_learns_packed_transcripts(self):
+        """Transcripts of a packed store reach the loss as labels"""
+        import tempfile
+        from pathlib import Path
+
+        import torch
+
+        from harpertoken.audio import read_manifest
+        from harpertoken.batching import LABEL_PAD_ID
+        from harpertoken.dataset import PackedSpeechDataset
+        from harpertoken.model import SpeechModel
+        from harpertoken.store import pack_audio
+        from harpertoken.train import TrainingConfig, train_model
+        from scripts.benchmark import tiny_config
+
+        seen = []
+
+        class LabelRecordingModel(SpeechModel):
+            def forward(self, inputs, labels=None):
+                seen.append(labels)
+                return super().forward(inputs, labels=labels)
+
+        processor = _FrameCountProcessor()
+        processor.tokenizer = _CharTokenizer()
+        model = LabelRecordingModel("whisper", config=tiny_config("whisper"))
+        cwd = Path.cwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 2)
+            store = pack_audio(read_manifest(manifest), f"{tmp}/store")
+            dataset = PackedSpeechDataset(store, processor=processor)
+            os.chdir(tmp)
+            try:
+                train_model(
+                    num_epochs=1,
+                    config=TrainingConfig(batch_size=2, push_to_hub=False),
+                    dataset=dataset,
+                    model=model,
+                )
+            finally:
+                os.chdir(cwd)
+
+        expected = [processor.tokenizer(text).input_ids for text in ("t0", "t1")]
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0].tolist(), expected)
+        self.assertNotIn(LABEL_PAD_ID, seen[0].tolist()[0])
+        self.assertTrue(torch.is_tensor(seen[0]))
+
+    def test_train_model_rejects_untranscribed_store(self):
+        import tempfile
+
+        from harpertoken.store import pack_audio
+        from harpertoken.train import TrainingConfig, train_model
+
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_wav(f"{tmp}/a.wav", 1600)
+            pack_audio([f"{tmp}/a.wav"], f"{tmp}/store")
+            with self.assertRaisesRegex(ValueError, "no transcript"):
+                train_model(config=TrainingConfig(audio_store=f"{tmp}/store"))
+
+
+class TestDynamicBatching(unittest.TestCase):
+    def test_batches_respect_padded_budget(self):
+        """Every sample lands in one batch whose padded length fits the budget"""
+        import numpy as np
+
+        from harpertoken.batching import DurationBatchSampler
+
+        durations = np.random.default_rng(0).uniform(1, 20, size=100)
+        sampler = DurationBatchSampler(durations, max_batch_duration=60, seed=1)
+        batches = list(sampler)
+
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(100)))
+        for batch in batches:
+            self.assertLessEqual(len(batch) * durations[batch].max(), 60)
+        self.assertEqual(batches, list(sampler))
+        sampler.set_epoch(1)
+        self.assertNotEqual(batches, list(sampler))
+
+    def test_whisper_budget_counts_padded_windows(self):
+        """Whisper clips cost one 30 s window each, wav2vec2 clips their length"""
+        from harpertoken.train import TrainingConfig, build_dataloader
+
+        class ClipDataset:
+            def __init__(self, model_type):
+                self.model_type = model_type
+
+            def durations(self):
+                return [5.0] * 8
+
+            def __len__(self):
+                return 8
+
+            def __getitem__(self, index):
+                return index
+
+        config = TrainingConfig(max_batch_seconds=60)
+        whisper = build_dataloader(ClipDataset("whisper"), config)
+        wav2vec2 = build_dataloader(ClipDataset("wav2vec2"), config)
+
+        self.assertEqual({len(b) for b in whisper.batch_sampler}, {2})
+        self.assertEqual({len(b) for b in wav2vec2.batch_sampler}, {8})
+
+    def test_collator_pads_inputs_and_labels(self):
+        """Variable-length inputs and labels are padded with matching masks"""
+        import torch
+
+        from harpertoken.batching import LABEL_PAD_ID, SpeechCollator
+
+        batch = SpeechCollator()(
+            [
+                {"input_values": torch.ones(1, 3), "labels": [5, 6]},
+                {"input_values": torch.ones(1, 5), "labels": [7]},
+            ]
+        )
+
+        self.assertEqual(tuple(batch["input_values"].shape), (2, 5))
+        self.assertEqual(batch["attention_mask"].tolist(), [[1, 1, 1, 0, 0], [1] * 5])
+        self.assertEqual(batch["input_values"][0].tolist(), [1, 1, 1, 0, 0])
+        self.assertEqual(batch["labels"].tolist(), [[5, 6], [7, LABEL_PAD_ID]])
+
+
+class TestAugment(unittest.TestCase):
+    def test_spec_augment_is_seeded_and_stays_in_valid_frames(self):
+        import torch
+
+        from harpertoken.augment import BatchAugment, SpecAugment
+
+        features = torch.randn(4, 80, 300)
+        frames = torch.tensor([300, 200, 100, 50])
+        first = BatchAugment(SpecAugment(time_width=40), seed=3).features(
+            features, frames
+        )
+        again = BatchAugment(SpecAugment(time_width=40), seed=3).features(
+            features, frames
+        )
+        torch.testing.assert_close(first, again)
+        changed = first != features
+        self.assertTrue(changed.any())
+        # Time masks never reach the padding, and stay under 20% of a clip
+        time_masked = changed.all(dim=1)
+        for row, valid in enumerate(frames.tolist()):
+            self.assertFalse(time_masked[row, valid:].any())
+            self.assertLessEqual(int(time_masked[row].sum()), 2 * valid // 5)
+
+    def test_waveform_augmentation(self):
+        """Speed factors rescale lengths; noise lands at the requested SNR"""
+        import tempfile
+
+        import numpy as np
+        import torch
+
+        from harpertoken.augment import BatchAugment, NoiseBank
+
+        waveforms = torch.randn(3, 16000)
+        lengths = torch.tensor([16000, 8000, 4000])
+        fast, fast_lengths = BatchAugment(speed_factors=(1.25,)).waveforms(
+            waveforms, lengths
+        )
+        self.assertEqual(fast_lengths.tolist(), [12800, 6400, 3200])
+        self.assertEqual(fast.shape[-1], 12800)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            _write_wav(f"{tmp}/noise.wav", 4000)
+            noise = NoiseBank(tmp, snr_db=(10.0, 10.0), prob=1.0)
+        noisy, _ = BatchAugment(noise=noise).waveforms(waveforms, lengths)
+        added = noisy - waveforms
+        for row, length in enumerate(lengths.tolist()):
+            snr = 10 * np.log10(
+                float((waveforms[row, :length] ** 2).sum())
+                / float((added[row, :length] ** 2).sum())
+            )
+            self.assertAlmostEqual(snr, 10.0, places=3)
+            self.assertFalse(added[row, length:].any())
+
+    def test_collator_augments_padded_batch(self):
+        import torch
+
+        from harpertoken.augment import BatchAugment, SpecAugment
+        from harpertoken.batching import SpeechCollator
+
+        samples = [{"input_features": torch.randn(80, 3000)} for _ in range(2)]
+        batch = SpeechCollator(augment=BatchAugment(SpecAugment()))(samples)
+        originals = torch.stack([sample["input_features"] for sample in samples])
+        self.assertEqual(batch["input_features"].shape, originals.shape)
+        self.assertFalse(torch.equal(batch["input_features"], originals))
+
+    def test_wav2vec2_training_augments_waveforms(self):
+        """train_model feeds wav2vec2 speed-perturbed, noisy waveform batches"""
+        import tempfile
+        from pathlib import Path
+
+        import torch
+        from transformers import Wav2Vec2FeatureExtractor
+
+        from harpertoken.audio import read_manifest
+        from harpertoken.batching import SpeechCollator
+        from harpertoken.dataset import PackedSpeechDataset
+        from harpertoken.model import SpeechModel
+        from harpertoken.store import pack_audio
+        from harpertoken.train import TrainingConfig, train_model
+        from scripts.benchmark import tiny_config
+
+        seen = []
+
+        class InputRecordingModel(SpeechModel):
+            def forward(self, inputs, labels=None):
+                seen.append(inputs)
+                return super().forward(inputs, labels=labels)
+
+        model = InputRecordingModel("wav2vec2", config=tiny_config("wav2vec2"))
+        cwd = Path.cwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            manifest, _ = _write_corpus(tmp, 4)
+            store = pack_audio(read_manifest(manifest), f"{tmp}/store")
+            dataset = PackedSpeechDataset(
+                store, "wav2vec2", processor=Wav2Vec2FeatureExtractor()
+            )
+            Path(tmp, "noise").mkdir()
+            _write_wav(Path(tmp, "noise", "hum.wav"), 4000)
+            config = TrainingConfig(
+                batch_size=4,
+                augment=True,
+                noise_dir=f"{tmp}/noise",
+                push_to_hub=False,
+            )
+            os.chdir(tmp)
+            try:
+                train_model(
+                    "wav2vec2",
+                    num_epochs=1,
+                    config=config,
+                    dataset=dataset,
+                    model=model,
+                )
+            finally:
+                os.chdir(cwd)
+
+        plain = SpeechCollator()([dataset[i] for i in range(4)])["input_values"]
+        self.assertEqual(len(seen), 1)
+        self.assertEqual(seen[0].dim(), 2)
+        self.assertFalse(seen[0].shape == plain.shape and torch.equal(seen[0], plain))
+
+    def test_noise_needs_waveform_inputs(self):
+        """Whisper trains on features, which noise mixing would never reach"""
+        from harpertoken.train import TrainingConfig, train_model
+
+        with self.assertRaisesRegex(ValueError, "noise_dir needs waveform inputs"):
+            train_model("whisper", config=TrainingConfig(noise_dir="noise"))
+
+
+def _tiny_regressor():
+    """A linear model with the ``model(inputs, labels=...).loss`` interface"""
+    import types
+
+    import torch
+
+    class Regressor(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.linear = torch.nn.Linear(4, 1)
+
+        def forward(self, inputs, labels=None):
+            predictions = self.linear(inputs).squeeze(-1).float()
+            return types.SimpleNamespace(loss=((predictions - labels) ** 2).mean())
+
+    torch.manual_seed(0)
+    return Regressor()
+
+
+class TestTrainStep(unittest.TestCase):
+    def test_accumulation_matches_full_batch(self):
+        """Two accumulated half-batches take the same step as one full batch"""
+        import copy
+
+        import torch
+
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        inputs, labels = torch.randn(4, 4), torch.randn(4)
+        accumulated = _tiny_regressor()
+        full = copy.deepcopy(accumulated)
+
+        step = TrainStep(
+            accumulated,
+            torch.optim.SGD(accumulated.parameters(), lr=0.1),
+            TrainingConfig(grad_accum_steps=2),
+        )
+        step(inputs[:2], labels[:2])
+        self.assertEqual(step.pending, 1)
+        step(inputs[2:], labels[2:])
+        self.assertEqual(step.pending, 0)
+        TrainStep(full, torch.optim.SGD(full.parameters(), lr=0.1), TrainingConfig())(
+            inputs, labels
+        )
+
+        for a, b in zip(accumulated.parameters(), full.parameters()):
+            torch.testing.assert_close(a, b)
+
+    def test_partial_window_is_not_under_scaled(self):
+        """A window cut short by flush steps on the mean of its micro-batches"""
+        import copy
+
+        import torch
+
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        inputs, labels = torch.randn(4, 4), torch.randn(4)
+        partial = _tiny_regressor()
+        full = copy.deepcopy(partial)
+
+        step = TrainStep(
+            partial,
+            torch.optim.SGD(partial.parameters(), lr=0.1),
+            TrainingConfig(grad_accum_steps=4),
+        )
+        step(inputs[:2], labels[:2])
+        step(inputs[2:], labels[2:])
+        step.flush()
+        TrainStep(full, torch.optim.SGD(full.parameters(), lr=0.1), TrainingConfig())(
+            inputs, labels
+        )
+
+        for a, b in zip(partial.parameters(), full.parameters()):
+            torch.testing.assert_close(a, b)
+
+    def test_clipping_and_bf16(self):
+        """Gradient clipping bounds the update; bf16 autocast runs on CPU"""
+        import torch
+
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        model = _tiny_regressor()
+        before = torch.cat([p.detach().flatten() for p in model.parameters()])
+        config = TrainingConfig(precision="bf16", max_grad_norm=0.01)
+        step = TrainStep(model, torch.optim.SGD(model.parameters(), lr=1.0), config)
+        loss = step(100 * torch.randn(8, 4), torch.randn(8))
+
+        after = torch.cat([p.detach().flatten() for p in model.parameters()])
+        self.assertTrue(torch.isfinite(torch.tensor(loss)))
+        self.assertLessEqual((after - before).norm().item(), 0.01 + 1e-6)
+
+
+def _streaming_rank_worker(shards, out_dir):
+    """Record the batches this rank's training DataLoader yields from shards"""
+    import json
+    from pathlib import Path
+
+    import torch
+    import torch.distributed as dist
+    from transformers import WhisperFeatureExtractor
+
+    from harpertoken.dataset import StreamingSpeechDataset
+    from harpertoken.distributed import get_rank
+    from harpertoken.train import TrainingConfig, build_dataloader
+
+    seen = {}
+    # Whole shards per rank, then every n-th sample over ranks and workers
+    for num_workers in (0, 2):
+        dataset = StreamingSpeechDataset(shards, processor=WhisperFeatureExtractor())
+        config = TrainingConfig(batch_size=1, num_workers=num_workers)
+        seen[num_workers] = []
+        for batch in build_dataloader(dataset, config):
+            # Stands in for the gradient all-reduce, which every rank must join
+            dist.all_reduce(torch.ones(1))
+            seen[num_workers].append(batch["text"])
+    Path(out_dir, f"rank{get_rank()}.json").write_text(json.dumps(seen))
+
+
+def _ddp_regression_worker(inputs, labels, out_path, grad_accum_steps=1):
+    """Train the tiny regressor on this rank's shard of the batch"""
+    import torch
+
+    from harpertoken.distributed import (
+        get_rank,
+        get_world_size,
+        is_main_process,
+        unwrap_model,
+        wrap_model,
+    )
+    from harpertoken.train import TrainingConfig, TrainStep
+
+    model = wrap_model(_tiny_regressor())
+    step = TrainStep(
+        model,
+        torch.optim.SGD(model.parameters(), lr=0.1),
+        TrainingConfig(grad_accum_steps=grad_accum_steps),
+    )
+    shard = len(inputs) // get_world_size()
+    rows = slice(get_rank() * shard, (get_rank() + 1) * shard)
+    for _ in range(3):
+        step(inputs[rows], labels[rows])
+    step.flush()
+    if is_main_process():
+        torch.save(unwrap_model(model).state_dict(), out_path)
+
+
+class TestDistributedTraining(unittest.TestCase):
+    def test_batches_are_split_evenly(self):
+        """Every rank runs the same number of steps and no batch is lost"""
+        from harpertoken.batching import DistributedBatchSampler
+
+        batches = [[0], [1], [2], [3], [4]]
+        shards = [list(DistributedBatchSampler(batches, 2, rank)) for rank in (0, 1)]
+
+        self.assertEqual([len(shard) for shard in shards], [3, 3])
+        self.assertEqual(
+            sorted(b[0] for shard in shards for b in shard), [0, 0, 1, 2, 3, 4]
+        )
+        self.assertEqual(list(DistributedBatchSampler([], 2, 1)), [])
+
+    def test_ddp_matches_single_process(self):
+        """Two gloo ranks on half batches end up where one process does"""
+        import tempfile
+        from pathlib import Path
+
+        import torch
+
+        from harpertoken.distributed import launch
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        inputs, labels = torch.randn(8, 4), torch.randn(8)
+        with tempfile.TemporaryDirectory() as tmp:
+            out_path = str(Path(tmp) / "ddp.pt")
+            launch(_ddp_regression_worker, 2, inputs, labels, out_path)
+            ddp_state = torch.load(out_path)
+
+        model = _tiny_regressor()
+        step = TrainStep(
+            model, torch.optim.SGD(model.parameters(), lr=0.1), TrainingConfig()
+        )
+        for _ in range(3):
+            step(inputs, labels)
+
+        for name, value in model.state_dict().items():
+            torch.testing.assert_close(ddp_state[name], value)
+
+    def test_streamed_ranks_run_equal_steps(self):
+        """Uneven shards still give every rank the same number of batches"""
+        import json
+        import tempfile
+        from pathlib import Path
+
+        from harpertoken.distributed import launch
+
+        with tempfile.TemporaryDirectory() as tmp:
+            # Shards of 4 and 3 clips
+            _, shards = _write_corpus(tmp, 7)
+            launch(_streaming_rank_worker, 2, shards, tmp)
+            ranks = [
+                json.loads(Path(tmp, f"rank{rank}.json").read_text())
+                for rank in range(2)
+            ]
+
+        for num_workers in ("0", "2"):
+            batches = [rank[num_workers] for rank in ranks]
+            self.assertEqual(len(batches[0]), len(batches[1]))
+            texts = {text for rank in batches for batch in rank for text in batch}
+            self.assertEqual(texts, {f"t{i}" for i in range(7)})
+
+    def test_ddp_partial_window_is_averaged_across_ranks(self):
+        """A partial accumulation window still all-reduces its gradients"""
+        import tempfile
+        from pathlib import Path
+
+        import torch
+
+        from harpertoken.distributed import launch
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        inputs, labels = torch.randn(8, 4), torch.randn(8)
+        with tempfile.TemporaryDirectory() as tmp:
+            out_path = str(Path(tmp) / "ddp.pt")
+            launch(_ddp_regression_worker, 2, inputs, labels, out_path, 2)
+            ddp_state = torch.load(out_path)
+
+        model = _tiny_regressor()
+        step = TrainStep(
+            model,
+            torch.optim.SGD(model.parameters(), lr=0.1),
+            TrainingConfig(grad_accum_steps=2),
+        )
+        for _ in range(3):
+            step(inputs, labels)
+        step.flush()
+
+        for name, value in model.state_dict().items():
+            torch.testing.assert_close(ddp_state[name], value)
+
+
+class TestCheckpointing(unittest.TestCase):
+    def _training_state(self):
+        import torch
+
+        model = _tiny_regressor()
+        optimizer = torch.optim.AdamW(model.parameters(), lr=0.1)
+        scheduler = torch.optim.lr_scheduler.StepLR(optimizer, step_size=1)
+        return {"model": model, "optimizer": optimizer, "scheduler": scheduler}
+
+    def _train(self, state, steps):
+        import torch
+
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        step = TrainStep(state["model"], state["optimizer"], TrainingConfig())
+        for _ in range(steps):
+            step(torch.randn(4, 4), torch.randn(4))
+            state["scheduler"].step()
+
+    def test_resume_requires_checkpoint_dir(self):
+        from harpertoken.train import TrainingConfig, train_model
+
+        with self.assertRaisesRegex(ValueError, "resume requires checkpoint_dir"):
+            train_model(config=TrainingConfig(resume=True))
+
+    def test_resume_continues_identically(self):
+        """Training on from a restored checkpoint matches uninterrupted training"""
+        import tempfile
+
+        import torch
+
+        from harpertoken.checkpoint import CheckpointManager
+
+        torch.manual_seed(1)
+        state = self._training_state()
+        self._train(state, 2)
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = CheckpointManager(tmp, keep=2)
+            for step in (1, 2):
+                manager.save(step, state, {"epoch": 0, "batch": step})
+            self._train(state, 2)
+            manager.save(4, state, {"epoch": 0, "batch": 4})
+            manager.wait()
+            self.assertEqual(
+                [p.name for p in manager.checkpoints()],
+                ["step-00000002.safetensors", "step-00000004.safetensors"],
+            )
+
+            restored = self._training_state()
+            progress = manager.restore(restored, manager.checkpoints()[0])
+            manager.close()
+
+        self.assertEqual(progress, {"epoch": 0, "batch": 2})
+        self._train(restored, 2)
+        for name, value in state["model"].state_dict().items():
+            torch.testing.assert_close(restored["model"].state_dict()[name], value)
+        self.assertEqual(
+            restored["scheduler"].get_last_lr(), state["scheduler"].get_last_lr()
+        )
+
+    def test_restore_without_checkpoint(self):
+        import tempfile
+
+        from harpertoken.checkpoint import CheckpointManager
+
+        with tempfile.TemporaryDirectory() as tmp:
+            manager = CheckpointManager(tmp)
+            self.assertIsNone(manager.restore(self._training_state()))
+            manager.close()
+
+    def test_sampler_skips_consumed_batches(self):
+        """A resumed epoch starts after the batches already trained on"""
+        from torch.utils.data import BatchSampler, SequentialSampler
+
+        from harpertoken.batching import ResumableBatchSampler
+
+        sampler = ResumableBatchSampler(
+            BatchSampler(SequentialSampler(range(5)), 2, drop_last=False)
+        )
+        sampler.skip = 2
+        self.assertEqual(list(sampler), [[4]])
+        self.assertEqual(list(sampler), [[0, 1], [2, 3], [4]])
+        self.assertEqual(len(sampler), 3)
+
+
+class _CountingModel:
+    """Stands in for a transformers class; counts from_pretrained calls"""
+
+    calls = 0
+
+    @classmethod
+    def from_pretrained(cls, _model_id, **_kwargs):
+        import time
+
+        import torch
+
+        cls.calls += 1
+        time.sleep(0.05)  # give concurrent callers a chance to race
+        return torch.nn.Linear(2, 2)
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        _CountingModel.calls = 0
+
+    def test_loads_once_across_threads(self):
+        """Concurrent requests for one model share a single load"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        from harpertoken.registry import ModelRegistry
+
+        registry = ModelRegistry()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            models = list(
+                pool.map(lambda _: registry.model(_CountingModel, "a"), range(8))
+            )
+
+        self.assertEqual(_CountingModel.calls, 1)
+        self.assertTrue(all(model is models[0] for model in models))
+        self.assertFalse(models[0].training)
+        self.assertFalse(any(p.requires_grad for p in models[0].parameters()))
+
+    def test_lru_eviction(self):
+        """The least recently used model is dropped past max_models"""
+        from harpertoken.registry import ModelRegistry
+
+        registry = ModelRegistry(max_models=2)
+        first = registry.model(_CountingModel, "a")
+        registry.model(_CountingModel, "b")
+        registry.model(_CountingModel, "a")  # "b" is now least recently used
+        registry.model(_CountingModel, "c")
+
+        self.assertIs(registry.model(_CountingModel, "a"), first)
+        self.assertEqual(_CountingModel.calls, 3)
+        registry.model(_CountingModel, "b")
+        self.assertEqual(_CountingModel.calls, 4)
+
+    def test_slow_processor_load_does_not_block_models(self):
+        """Only callers of the processor being loaded wait for it"""
+        import threading
+
+        from harpertoken.registry import ModelRegistry
+
+        release = threading.Event()
+
+        class SlowProcessor:
+            @classmethod
+            def from_pretrained(cls, _model_id, **_kwargs):
+                release.wait(10)
+                return cls()
+
+        registry = ModelRegistry()
+        registry.model(_CountingModel, "a")
+        loading = threading.Thread(target=registry.processor, args=(SlowProcessor, "p"))
+        loading.start()
+        lookup = threading.Thread(target=registry.model, args=(_CountingModel, "a"))
+        lookup.start()
+        lookup.join(timeout=5)
+        finished = not lookup.is_alive()
+        release.set()
+        loading.join()
+
+        self.assertTrue(finished)
+        self.assertIs(
+            registry.processor(SlowProcessor, "p"),
+            registry.processor(SlowProcessor, "p"),
+        )
+
+
+class _TinyPretrained:
+    """Stands in for a transformers class: a small fp32 MLP"""
+
+    calls = 0
+
+    @classmethod
+    def from_pretrained(cls, _model_id, **_kwargs):
+        import torch
+
+        cls.calls += 1
+        torch.manual_seed(0)
+        return torch.nn.Sequential(
+            torch.nn.Linear(16, 32), torch.nn.ReLU(), torch.nn.Linear(32, 4)
+        )
+
+
+class TestQuantization(unittest.TestCase):
+    def test_int8_close_to_fp32(self):
+        """Dynamic quantization swaps the linear layers and keeps outputs close"""
+        import torch
+
+        from harpertoken.quantize import quantize_model
+
+        inputs = torch.randn(8, 16)
+        model = _TinyPretrained.from_pretrained("tiny")
+        expected = model(inputs)
+        quantized = quantize_model(model, "int8")
+
+        self.assertNotIsInstance(quantized[0], torch.nn.Linear)
+        torch.testing.assert_close(quantized(inputs), expected, atol=0.05, rtol=0)
+        with self.assertRaises(ValueError):
+            quantize_model(model, "int4")
+
+    def test_quantized_model_is_cached(self):
+        """A second start loads the int8 model from disk instead of re-quantizing"""
+        import tempfile
+
+        import torch
+
+        from harpertoken.quantize import load_for_inference
+
+        _TinyPretrained.calls = 0
+        inputs = torch.randn(2, 16)
+        with tempfile.TemporaryDirectory() as tmp:
+            first = load_for_inference(_TinyPretrained, "tiny", "int8", cache_dir=tmp)
+            second = load_for_inference(_TinyPretrained, "tiny", "int8", cache_dir=tmp)
+
+        self.assertEqual(_TinyPretrained.calls, 1)
+        self.assertIsNot(first, second)
+        torch.testing.assert_close(first(inputs), second(inputs))
+
+    def test_cache_key_follows_the_hub_commit(self):
+        """Moving a branch to a new commit invalidates the quantized cache"""
+        import tempfile
+        from pathlib import Path
+
+        from huggingface_hub import constants
+
+        from harpertoken.quantize import QuantizedModelCache, resolve_revision
+
+        def checkout(hub, sha):
+            (hub / "snapshots" / sha).mkdir(parents=True)
+            (hub / "snapshots" / sha / "config.json").write_text("{}")
+            (hub / "refs").mkdir(exist_ok=True)
+            (hub / "refs" / "main").write_text(sha)
+
+        hub_cache = constants.HF_HUB_CACHE
+        with tempfile.TemporaryDirectory() as tmp:
+            constants.HF_HUB_CACHE = tmp
+            try:
+                cache = QuantizedModelCache(f"{tmp}/quantized")
+                hub = Path(tmp) / "models--org--tiny"
+                checkout(hub, "a" * 40)
+                first = cache.key(_TinyPretrained, "org/tiny", None, "int8")
+                self.assertEqual(resolve_revision("org/tiny"), "a" * 40)
+                checkout(hub, "b" * 40)
+                second = cache.key(_TinyPretrained, "org/tiny", None, "int8")
+            finally:
+                constants.HF_HUB_CACHE = hub_cache
+
+        self.assertNotEqual(first, second)
+        self.assertIsNone(resolve_revision(tmp))
+        self.assertEqual(resolve_revision("org/missing", "v1"), "v1")
+
+
+def _speech_pattern(sample_rate, pattern):
+    """Concatenate (seconds, is_tone) spans of silence and a loud tone"""
+    import numpy as np
+
+    spans = []
+    for seconds, tone in pattern:
+        t = np.arange(int(seconds * sample_rate)) / sample_rate
+        amplitude = 0.3 if tone else 0.0
+        spans.append((amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32))
+    return np.concatenate(spans)
+
+
+class TestStreaming(unittest.TestCase):
+    def test_ring_buffer_wraps_and_drops_oldest(self):
+        import numpy as np
+
+        from harpertoken.streaming import RingBuffer
+
+        ring = RingBuffer(5)
+        ring.write(np.arange(3))
+        self.assertEqual(ring.read().tolist(), [0, 1, 2])
+        ring.write(np.arange(4))
+        ring.write(np.arange(4, 7))
+        self.assertEqual(ring.read().tolist(), [2, 3, 4, 5, 6])
+        self.assertEqual(ring.dropped, 2)
+
+    def test_segments_follow_voice_activity(self):
+        """Two utterances separated by silence become two final segments"""
+        from harpertoken.streaming import Segmenter
+
+        sample_rate = 16000
+        audio = _speech_pattern(
+            sample_rate, [(0.5, False), (1.2, True), (1.0, False), (0.6, True)]
+        )
+        segmenter = Segmenter(sample_rate, partial_every=0.5)
+        events = []
+        for offset in range(0, len(audio), 1600):
+            events.extend(segmenter.push(audio[offset : offset + 1600]))
+        events.extend(segmenter.flush())
+
+        finals = [(start / sample_rate, len(a)) for final, start, a in events if final]
+        self.assertEqual(len(finals), 2)
+        self.assertAlmostEqual(finals[0][0], 0.3, delta=0.05)
+        self.assertAlmostEqual(finals[1][0], 2.5, delta=0.05)
+        # Partials come before the final of their segment
+        self.assertFalse(events[0][0])
+
+    def test_stream_from_pipe(self):
+        """A raw PCM pipe is transcribed incrementally, ending with finals"""
+        import asyncio
+        import io
+
+        import numpy as np
+
+        from harpertoken.streaming import FileSource, stream_transcripts
+
+        sample_rate = 16000
+        audio = _speech_pattern(sample_rate, [(0.3, False), (2.0, True), (0.8, False)])
+        pipe = io.BytesIO((audio * 32767).astype("<i2").tobytes())
+
+        async def collect():
+            source = FileSource(pipe, sample_rate, block_seconds=0.05)
+            return [
+                hypothesis
+                async for hypothesis in stream_transcripts(
+                    source, lambda a: f"{len(a) / sample_rate:.2f}"
+                )
+            ]
+
+        hypotheses = asyncio.run(collect())
+        finals = [h for h in hypotheses if h.final]
+        self.assertEqual(len(finals), 1)
+        self.assertIs(hypotheses[-1], finals[0])
+        self.assertGreater(len(hypotheses), 1)
+        self.assertTrue(
+            np.isclose(float(finals[0].text), finals[0].end - finals[0].start)
+        )
+
+
+class TestAudioPreprocessor(unittest.TestCase):
+    def test_resampler_kernels_are_cached(self):
+        import torch
+
+        from harpertoken.preprocessing import _resampler, resample
+
+        waveform = torch.randn(8000)
+        self.assertIs(resample(waveform, 16000, 16000), waveform)
+        self.assertEqual(resample(waveform, 8000, 16000).shape[-1], 16000)
+        self.assertIs(_resampler(8000, 16000), _resampler(8000, 16000))
+
+    def test_batch_matches_single_clips(self):
+        """Mixed-rate clips in one batch get the features each gets alone"""
+        import torch
+
+        from harpertoken.preprocessing import AudioPreprocessor, resample
+
+        preprocessor = AudioPreprocessor()
+        clips = [torch.randn(8000), torch.randn(24000)]
+        features, frames = preprocessor.process_batch(clips, sample_rate=[8000, 16000])
+
+        self.assertEqual(features.shape[:2], (2, 64))
+        self.assertEqual(frames.tolist(), [16000 // 200 + 1, 24000 // 200 + 1])
+        for clip, rate, row, n in zip(clips, [8000, 16000], features, frames):
+            alone = preprocessor.process(clip, rate)
+            # Frames near the end of the shorter clip see its zero padding
+            torch.testing.assert_close(row[:, : n - 2], alone[:, : n - 2])
+            self.assertEqual(alone.shape[-1], n)
+        self.assertEqual(
+            resample(clips[0], 8000, 16000).shape[-1], (frames[0] - 1) * 200
+        )
+
+    def test_normalized_features(self):
+        """Normalised frames have zero mean per bin; padding stays zero"""
+        import torch
+
+        from harpertoken.preprocessing import AudioPreprocessor
+
+        preprocessor = AudioPreprocessor(normalize=True)
+        padded = torch.zeros(2, 16000)
+        padded[0] = torch.randn(16000)
+        padded[1, :8000] = torch.randn(8000)
+        features, frames = preprocessor.process_batch(padded, lengths=[16000, 8000])
+
+        valid = features[1, :, : frames[1]]
+        torch.testing.assert_close(valid.mean(-1), torch.zeros(64), atol=1e-4, rtol=0)
+        self.assertEqual(features[1, :, frames[1] :].abs().sum().item(), 0)
+
+
+def _length_batch(waveforms):
+    """transcribe_batch stand-in: the length of every waveform as text"""
+    import time
+
+    time.sleep(0.02)
+    return [str(len(audio)) for audio in waveforms]
+
+
+class TestServer(unittest.TestCase):
+    def test_requests_are_micro_batched(self):
+        """Concurrent requests share model calls and get their own results"""
+        import asyncio
+
+        import numpy as np
+
+        from harpertoken.server import MicroBatcher, QueueFullError
+
+        async def scenario():
+            batcher = MicroBatcher(_length_batch, max_batch_size=4, max_wait_ms=50)
+            batcher.start()
+            texts = await asyncio.gather(
+                *(batcher.submit(np.zeros(n)) for n in range(1, 7))
+            )
+            await batcher.close()
+
+            # With no worker draining the queue, the third request is shed
+            full = MicroBatcher(_length_batch, max_queue=2)
+            waiting = [asyncio.ensure_future(full.submit(np.zeros(1))) for _ in "ab"]
+            await asyncio.sleep(0)
+            with self.assertRaises(QueueFullError):
+                await full.submit(np.zeros(1))
+            for task in waiting:
+                task.cancel()
+            return texts, batcher.metrics, full.metrics
+
+        texts, metrics, full_metrics = asyncio.run(scenario())
+        self.assertEqual(texts, ["1", "2", "3", "4", "5", "6"])
+        self.assertEqual(list(metrics.batch_sizes), [4, 2])
+        self.assertEqual(full_metrics.rejected, 1)
+
+    def test_http_and_websocket(self):
+        """POST /transcribe, /metrics and a WebSocket stream on localhost"""
+        import asyncio
+        import base64
+        import json
+        import os
+        import struct
+        import tempfile
+        from pathlib import Path
+
+        from harpertoken.server import MicroBatcher, TranscriptionServer
+        from scripts.load_test import request
+
+        with tempfile.TemporaryDirectory() as tmp:
+            wav_path = Path(tmp) / "clip.wav"
+            _write_wav(wav_path, 8000)
+            wav = wav_path.read_bytes()
+
+        pcm = (
+            _speech_pattern(16000, [(0.2, False), (1.0, True), (0.8, False)]) * 32767
+        ).astype("<i2")
+
+        def client_frame(opcode, payload):
+            mask = os.urandom(4)
+            masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+            header = bytes([0x80 | opcode])
+            if len(payload) < 126:
+                header += bytes([0x80 | len(payload)])
+            else:
+                header += bytes([0x80 | 126]) + struct.pack(">H", len(payload))
+            return header + mask + masked
+
+        async def scenario():
+            batcher = MicroBatcher(_length_batch)
+            batcher.start()
+            server = TranscriptionServer(batcher)
+            tcp = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = tcp.sockets[0].getsockname()[1]
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            transcribed = await request(reader, writer, "POST", "/transcribe", wav)
+            metrics = await request(reader, writer, "GET", "/metrics")
+            missing = await request(reader, writer, "GET", "/nope")
+            writer.close()
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            key = base64.b64encode(os.urandom(16)).decode()
+            writer.write(
+                "GET /ws HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\n"
+                f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n\r\n".encode()
+            )
+            await reader.readuntil(b"\r\n\r\n")
+            for offset in range(0, len(pcm), 1600):
+                writer.write(client_frame(0x2, pcm[offset : offset + 1600].tobytes()))
+            writer.write(client_frame(0x1, b"end"))
+            messages = []
+            while True:
+                first, length = await reader.readexactly(2)
+                if length == 126:
+                    (length,) = struct.unpack(">H", await reader.readexactly(2))
+                payload = await reader.readexactly(length)
+                if first & 0x0F == 0x8:
+                    break
+                messages.append(json.loads(payload))
+            writer.close()
+
+            tcp.close()
+            await batcher.close()
+            return transcribed, metrics, missing, messages
+
+        transcribed, metrics, missing, messages = asyncio.run(scenario())
+        self.assertEqual(transcribed, (200, {"text": "8000", "duration": 0.5}))
+        self.assertEqual(metrics[0], 200)
+        self.assertEqual(metrics[1]["requests_total"], 1)
+        self.assertGreater(metrics[1]["latency_p99_ms"], 0)
+        self.assertEqual(missing[0], 404)
+        self.assertTrue(messages[-1]["final"])
+        self.assertEqual(sum(m["final"] for m in messages), 1)
+
+    def test_bad_requests_and_full_queue(self):
+        """Malformed requests get a 400; a full queue closes a stream with 1013"""
+        import asyncio
+        import json
+        import struct
+
+        import numpy as np
+
+        from harpertoken.server import MicroBatcher, TranscriptionServer
+
+        pcm = (
+            _speech_pattern(16000, [(0.2, False), (1.0, True), (0.8, False)]) * 32767
+        ).astype("<i2")
+
+        async def status_of(port, head):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(head.encode())
+            status_line = await reader.readuntil(b"\r\n")
+            writer.close()
+            return int(status_line.split()[1])
+
+        async def scenario():
+            # Nothing drains the queue, which is already full
+            batcher = MicroBatcher(_length_batch, max_queue=1)
+            batcher.queue.put_nowait(np.zeros(1))
+            server = TranscriptionServer(batcher)
+            tcp = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = tcp.sockets[0].getsockname()[1]
+
+            statuses = [
+                await status_of(
+                    port, "POST /transcribe HTTP/1.1\r\nContent-Length: ten\r\n\r\n"
+                ),
+                await status_of(
+                    port,
+                    "GET /ws HTTP/1.1\r\nUpgrade: websocket\r\n"
+                    "Connection: Upgrade\r\n\r\n",
+                ),
+            ]
+
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(
+                b"GET /ws HTTP/1.1\r\nUpgrade: websocket\r\n"
+                b"Connection: Upgrade\r\nSec-WebSocket-Key: a2V5\r\n\r\n"
+            )
+            await reader.readuntil(b"\r\n\r\n")
+            # Unmasked client frames are accepted by the server
+            for offset in range(0, len(pcm), 1600):
+                chunk = pcm[offset : offset + 1600].tobytes()
+                writer.write(b"\x82\x7e" + struct.pack(">H", len(chunk)) + chunk)
+            writer.write(b"\x81\x03end")
+            frames = []
+            while True:
+                first, length = await reader.readexactly(2)
+                payload = await reader.readexactly(length)
+                frames.append((first & 0x0F, payload))
+                if first & 0x0F == 0x8:
+                    break
+            writer.close()
+            tcp.close()
+            await batcher.close()
+            return statuses, frames
+
+        statuses, frames = asyncio.run(scenario())
+        self.assertEqual(statuses, [400, 400])
+        self.assertIn("queue is full", json.loads(frames[-2][1])["error"])
+        self.assertEqual(frames[-1], (0x8, struct.pack(">H", 1013)))
+
+
+class TestProfiling(unittest.TestCase):
+    def test_step_records(self):
+        """Each step reports its stages, data-wait ratio and throughput"""
+        import io
+        import json
+        import time
+
+        from harpertoken.profiling import Profiler
+
+        output = io.StringIO()
+        profiler = Profiler(output)
+
+        def slow_batches():
+            for batch in range(2):
+                time.sleep(0.02)
+                yield batch
+
+        for _ in profiler.timed(slow_batches()):
+            with profiler.stage("forward"):
+                time.sleep(0.01)
+            profiler.count("samples", 4)
+            profiler.step(epoch=0)
+        profiler.summary(epoch=0)
+
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual([r["event"] for r in records], ["step", "step", "summary"])
+        step = records[0]
+        self.assertEqual(step["epoch"], 0)
+        self.assertEqual(set(step["stages"]), {"data", "forward"})
+        self.assertGreater(step["data_wait_ratio"], 0.4)
+        self.assertLess(step["data_wait_ratio"], 1.0)
+        self.assertGreater(step["samples_per_sec"], 0)
+        self.assertEqual(records[-1]["counters"]["samples"], 8)
+
+    def test_train_step_stages_and_disabled_profiler(self):
+        import io
+        import json
+
+        import torch
+
+        from harpertoken.profiling import Profiler
+        from harpertoken.train import TrainingConfig, TrainStep
+
+        output = io.StringIO()
+        model = _tiny_regressor()
+        profiler = Profiler(output)
+        step = TrainStep(
+            model,
+            torch.optim.SGD(model.parameters(), lr=0.1),
+            TrainingConfig(),
+            profiler,
+        )
+        step(torch.randn(2, 4), torch.randn(2))
+        profiler.step()
+        record = json.loads(output.getvalue())
+        self.assertEqual(set(record["stages"]), {"forward", "backward", "optimizer"})
+
+        # Without an output nothing is recorded or written
+        disabled = Profiler()
+        with disabled.stage("forward"):
+            pass
+        disabled.step()
+        self.assertEqual(disabled.steps, 0)
+
+
+class TestDecoding(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from transformers import WhisperConfig, WhisperForConditionalGeneration
+
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        cls.model = SpeechModel("whisper", config=tiny_config("whisper")).eval()
+        torch.manual_seed(1)
+        cls.draft = WhisperForConditionalGeneration(
+            WhisperConfig(
+                d_model=32,
+                encoder_layers=1,
+                decoder_layers=1,
+                encoder_attention_heads=2,
+                decoder_attention_heads=2,
+                encoder_ffn_dim=64,
+                decoder_ffn_dim=64,
+                max_target_positions=64,
+            )
+        ).eval()
+        cls.features = torch.randn(2, 80, 3000)
+
+    def _generate(self, features):
+        import torch
+
+        with torch.no_grad():
+            return self.model.generate(
+                input_features=features, max_new_tokens=12, min_new_tokens=12
+            )
+
+    def test_assisted_and_static_cache_match_greedy(self):
+        """Neither mode changes the decoded tokens"""
+        import torch
+
+        self.model.decoder = None
+        single = self.features[:1]
+        greedy_single = self._generate(single)
+        greedy_batch = self._generate(self.features)
+        try:
+            self.model.configure_decoding(draft_model=self.draft)
+            torch.testing.assert_close(self._generate(single), greedy_single)
+            # Batches fall back to plain decoding
+            torch.testing.assert_close(self._generate(self.features), greedy_batch)
+
+            self.model.configure_decoding(static_cache=True)
+            first = self._generate(self.features)
+            cache = self.model.decoder.cache
+            torch.testing.assert_close(first, greedy_batch)
+            # A second call of the same batch size reuses the cache
+            torch.testing.assert_close(self._generate(self.features), greedy_batch)
+            self.assertIs(self.model.decoder.cache, cache)
+        finally:
+            self.model.decoder = None
+
+
+class TestEncoderCache(unittest.TestCase):
+    def test_sweep_reuses_encoder_outputs(self):
+        """Decoding the same clips again skips the encoder, same tokens"""
+        import torch
+
+        from harpertoken.cache import EncoderCache
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        model = SpeechModel("whisper", config=tiny_config("whisper")).eval()
+        features = torch.randn(2, 80, 3000)
+        kwargs = {"input_features": features, "max_new_tokens": 6}
+        with torch.no_grad():
+            expected = model.generate(**kwargs)
+            cache = EncoderCache()
+            model.configure_decoding(encoder_cache=cache)
+            torch.testing.assert_close(model.generate(**kwargs), expected)
+            self.assertEqual((cache.hits, cache.misses), (0, 2))
+            beams = model.generate(**kwargs, num_beams=2)
+            self.assertEqual((cache.hits, cache.misses), (2, 2))
+        self.assertEqual(beams.shape[0], 2)
+
+    def test_eviction_spills_to_disk(self):
+        import tempfile
+
+        import torch
+
+        from harpertoken.cache import EncoderCache
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        model = SpeechModel("whisper", config=tiny_config("whisper")).model.eval()
+        model.to(torch.bfloat16)
+        features = torch.randn(3, 80, 3000, dtype=torch.bfloat16)
+        with tempfile.TemporaryDirectory() as spill_dir:
+            # Room for a single clip's output in memory
+            cache = EncoderCache(max_bytes=1500 * 64 * 2, spill_dir=spill_dir)
+            first = cache.encode(model, features)
+            self.assertEqual(cache.nbytes, cache.max_bytes)
+            again = cache.encode(model, features)
+            self.assertEqual(again.dtype, torch.bfloat16)
+            self.assertEqual(cache.misses, 3)
+            self.assertEqual(cache.hits + cache.disk_hits, 3)
+            self.assertGreater(cache.disk_hits, 0)
+            torch.testing.assert_close(again, first)
+
+    def test_weight_updates_invalidate_entries(self):
+        """Weights changed in place after caching miss instead of going stale"""
+        import torch
+
+        from harpertoken.cache import EncoderCache
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        model = SpeechModel("whisper", config=tiny_config("whisper")).model.eval()
+        features = torch.randn(1, 80, 3000)
+        cache = EncoderCache()
+        first = cache.encode(model, features)
+        cache.encode(model, features)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        with torch.no_grad():
+            next(model.get_encoder().parameters()).mul_(2)
+        updated = cache.encode(model, features)
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertFalse(torch.equal(updated, first))
+
+
+_CTC_VOCAB = ["<pad>", "<s>", "</s>", "<unk>", "|", "A", "B", "C", "T"]
+
+
+def _ctc_logits(frames):
+    """Log-probabilities putting most mass on the given token per frame"""
+    import torch
+
+    logits = torch.full((len(frames), len(_CTC_VOCAB)), -10.0)
+    for t, frame in enumerate(frames):
+        for token, prob in frame.items():
+            logits[t, _CTC_VOCAB.index(token)] = torch.tensor(prob).log()
+    return logits
+
+
+_ARPA = r"""\data\
+ngram 1=3
+ngram 2=1
+
+\1-grams:
+-1.0 <unk>
+-0.5 the -0.3
+-0.7 cat -0.2
+
+\2-grams:
+-0.1 the cat
+
+\end\
+"""
+
+
+class TestCTC(unittest.TestCase):
+    def test_greedy_collapses_repeats_and_blanks(self):
+        import torch
+
+        from harpertoken.ctc import CTCDecoder, greedy_decode
+
+        frames = ["C", "C", "<pad>", "A", "<pad>", "A", "T", "T", "<pad>", "B"]
+        logits = _ctc_logits([{token: 0.9} for token in frames])
+        batch = torch.stack([logits, logits])
+        ids = greedy_decode(batch, lengths=[10, 8])
+        self.assertEqual(
+            [[_CTC_VOCAB[i] for i in row] for row in ids],
+            [["C", "A", "A", "T", "B"], ["C", "A", "A", "T"]],
+        )
+        decoder = CTCDecoder(_CTC_VOCAB)
+        self.assertEqual(decoder.decode(batch, [10, 8]), ["CAATB", "CAAT"])
+        # Without an LM the beam search agrees with the best path here
+        beam = CTCDecoder(_CTC_VOCAB, beam_width=4)
+        self.assertEqual(beam.decode(batch, [10, 8]), ["CAATB", "CAAT"])
+
+    def test_lm_resolves_acoustic_ambiguity(self):
+        from harpertoken.ctc import CTCDecoder, NGramLM
+
+        logits = _ctc_logits(
+            [{"C": 0.9}, {"A": 0.9}, {"B": 0.55, "T": 0.45}, {"<pad>": 0.9}]
+        ).unsqueeze(0)
+        self.assertEqual(CTCDecoder(_CTC_VOCAB, beam_width=8).decode(logits), ["CAB"])
+        lm = NGramLM.from_texts(["the cat", "a cat sat"])
+        decoder = CTCDecoder(_CTC_VOCAB, beam_width=8, lm=lm, alpha=1.0)
+        self.assertEqual(decoder.decode(logits), ["CAT"])
+
+    def test_arpa_backoff(self):
+        import math
+        import tempfile
+        from pathlib import Path
+
+        from harpertoken.ctc import NGramLM
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "lm.arpa"
+            path.write_text(_ARPA)
+            lm = NGramLM.from_arpa(path)
+        self.assertAlmostEqual(lm.score(["the"], "CAT"), -0.1 * math.log(10))
+        # Unseen bigram: backoff weight of the context plus the unigram
+        self.assertAlmostEqual(lm.score(["cat"], "the"), (-0.2 - 0.5) * math.log(10))
+        self.assertAlmostEqual(lm.score([], "dog"), -1.0 * math.log(10))
+
+    def test_speech_model_ctc_head(self):
+        import torch
+
+        from harpertoken.ctc import output_lengths
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        model = SpeechModel("wav2vec2", config=tiny_config("wav2vec2"))
+        values = torch.randn(2, 16000)
+        labels = torch.tensor([[5, 6, 7], [5, -100, -100]])
+        self.assertTrue(torch.isfinite(model(values, labels=labels).loss))
+
+        model.eval()
+        attention_mask = torch.ones(2, 16000, dtype=torch.long)
+        attention_mask[1, 8000:] = 0
+        ids = model.generate(input_values=values, attention_mask=attention_mask)
+        lengths = output_lengths(model.model.config, attention_mask.sum(-1))
+        self.assertEqual(ids.shape, (2, lengths[0].item()))
+        self.assertTrue((ids[1, lengths[1] :] == 0).all())
+
+
+class TestExport(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        import tempfile
+
+        import torch
+        from transformers import WhisperForConditionalGeneration
+
+        from harpertoken.export import ExportedWhisper, export_whisper
+        from scripts.benchmark import tiny_config
+
+        torch.manual_seed(0)
+        cls.model = WhisperForConditionalGeneration(tiny_config("whisper")).eval()
+        cls.features = torch.randn(2, 80, 3000)
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.exported = ExportedWhisper.from_pretrained(
+            export_whisper(cls.model, cls.tmp.name)
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def _step_logits(self, exported, ids):
+        """Logits of every position, decoding ``ids`` one token at a time"""
+        import torch
+
+        config = exported.config
+        heads = config.decoder_attention_heads
+        empty = torch.zeros(
+            config.decoder_layers, len(ids), heads, 0, config.d_model // heads
+        )
+        cross = exported.encoder(self.features)
+        cache = [empty, empty]
+        logits = []
+        for position in range(ids.shape[1]):
+            step, *cache = exported.decoder(
+                ids[:, position : position + 1],
+                torch.tensor([position]),
+                *cache,
+                *cross,
+            )
+            logits.append(step)
+        return torch.stack(logits, dim=1)
+
+    def test_decoder_with_past_matches_eager(self):
+        """Step-by-step graph logits equal one eager forward pass"""
+        import torch
+
+        from harpertoken.export import ExportedWhisper
+
+        ids = torch.randint(0, 1000, (2, 6))
+        with torch.no_grad():
+            expected = self.model(
+                input_features=self.features, decoder_input_ids=ids
+            ).logits
+        for exported in (ExportedWhisper.from_model(self.model), self.exported):
+            torch.testing.assert_close(
+                self._step_logits(exported, ids), expected, atol=1e-4, rtol=1e-4
+            )
+
+    def test_generate_matches_eager_greedy(self):
+        import torch
+
+        kwargs = {"max_new_tokens": 12, "min_new_tokens": 12}
+        with torch.no_grad():
+            expected = self.model.generate(input_features=self.features, **kwargs)
+        torch.testing.assert_close(
+            self.exported.generate(self.features, **kwargs), expected
+        )
+        with self.assertRaises(ValueError):
+            self.exported.generate(self.features, num_beams=4)
+
+    @unittest.skipUnless(
+        importlib.util.find_spec("onnx") and importlib.util.find_spec("onnxruntime"),
+        "onnx and onnxruntime are not installed",
+    )
+    def test_onnx_runtime_matches_eager(self):
+        import torch
+
+        from harpertoken.export import ExportedWhisper, export_whisper
+
+        output_dir = os.path.join(self.tmp.name, "onnx")
+        exported = ExportedWhisper.from_pretrained(
+            export_whisper(self.model, output_dir, backend="onnx")
+        )
+        ids = torch.randint(0, 1000, (2, 6))
+        with torch.no_grad():
+            expected = self.model(
+                input_features=self.features, decoder_input_ids=ids
+            ).logits
+        torch.testing.assert_close(
+            self._step_logits(exported, ids), expected, atol=1e-4, rtol=1e-4
+        )
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_speech_model_from_config(self):
+        """A config builds a randomly initialised model without downloads"""
+        import torch
+
+        from harpertoken.model import SpeechModel
+        from scripts.benchmark import tiny_config
+
+        model = SpeechModel("whisper", config=tiny_config("whisper")).eval()
+        features = torch.randn(1, 80, 3000)
+        with torch.no_grad():
+            output = model(features, labels=torch.zeros(1, 4, dtype=torch.long))
+        self.assertTrue(torch.isfinite(output.loss))
+
+    def test_compare_flags_regressions(self):
+        from scripts.benchmark import compare
+
+        baseline = {
+            "results": {
+                "a": {"samples_per_sec": 100.0, "latency_p95_ms": 10.0},
+                "b": {"samples_per_sec": 100.0, "peak_rss_mb": 500.0},
+            }
+        }
+        results = {
+            "a": {"samples_per_sec": 70.0, "latency_p95_ms": 10.5},
+            "b": {"samples_per_sec": 130.0, "peak_rss_mb": 520.0},
+            "new": {"samples_per_sec": 1.0},
+        }
+        regressions = compare(results, baseline, tolerance=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith("a.samples_per_sec"))
+
+    def test_compare_refuses_baseline_with_other_settings(self):
+        from scripts.benchmark import compare
+
+        baseline = {"meta": {"quick": False, "threads": 1}, "results": {}}
+        self.assertEqual(compare({}, baseline, 0.2, {"quick": False, "threads": 1}), [])
+        with self.assertRaisesRegex(ValueError, "quick=False"):
+            compare({}, baseline, 0.2, {"quick": True, "threads": 1})
+
+
+def _imported_modules(statement):
+    """Top-level modules loaded by ``statement`` in a fresh interpreter"""
+    import json
+    import subprocess
+
+    root = os.path.join(os.path.dirname(__file__), "..")
+    code = f"{statement}; import json, sys; print(json.dumps(sorted(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return {name.split(".")[0] for name in json.loads(result.stdout)}
+
+
+class TestImportTime(unittest.TestCase):
+    def test_evaluate_does_not_import_torch(self):
+        """The metric helpers stay usable without paying for torch"""
+        modules = _imported_modules("import harpertoken.evaluate")
+        self.assertNotIn("torch", modules)
+        self.assertNotIn("transformers", modules)
+
+    def test_train_defers_transformers(self):
+        """transformers and the Hub client load when training starts"""
+        modules = _imported_modules("import harpertoken.train")
+        self.assertNotIn("transformers", modules)
+        self.assertNotIn("huggingface_hub", modules)
+
+
 if __name__ == "__main__":
     unittest.main()